@@ -0,0 +1,75 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from core.tracing import tracer
+
+
+def atomic_write(path, data):
+    """先写同目录下的临时文件再 os.replace，读者永远看不到写了一半的文件"""
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class AsyncWriter:
+    """
+    单线程后台写盘队列：保存操作在 GUI 线程只做提交，编码和写盘都在工作线程完成。
+    只有一个 worker，同一路径的多次写入按提交顺序落盘。
+    写入失败时在工作线程中调用 on_error(tag, 异常)，tag 为提交时给出的标识 (通常是条目 key)，
+    GUI 需要自己切回主线程处理。
+    """
+
+    def __init__(self, on_error=None):
+        self.on_error = on_error
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="async-writer")
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def write_bytes(self, path, data, tag=None):
+        return self.submit(atomic_write, path, data, tag=tag)
+
+    def write_mask_png(self, path, mask_np, tag=None):
+        """Mask (0/1) 编码为 0/255 的 PNG 后原子写入；传入的数组会被拷贝"""
+        mask = (mask_np > 0).astype('uint8') * 255
+
+        def _task():
+            with tracer.span("save.mask_png", path=os.path.basename(path), size=f"{mask.shape[1]}x{mask.shape[0]}"):
+                ok, buf = cv2.imencode('.png', mask)
+                if not ok: raise IOError(f"PNG 编码失败: {path}")
+                atomic_write(path, buf.tobytes())
+
+        return self.submit(_task, tag=tag)
+
+    def submit(self, fn, *args, tag=None):
+        future = self._executor.submit(self._run, tag, fn, *args)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def flush(self):
+        """等待所有已提交的写入完成"""
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            future.result()
+
+    def shutdown(self):
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+    def _discard(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def _run(self, tag, fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"后台写入失败 ({tag}): {e}")
+            if self.on_error is not None: self.on_error(tag, e)
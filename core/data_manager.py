@@ -3,18 +3,63 @@ import json
 import shutil
 import numpy as np
 
+from core.dir_scanner import DirectoryScanner, MASK_SUFFIX
+from core.mask_store import MaskStore
+from core.raster_reader import open_raster
+
+# 文件夹模式的标注存放在数据目录下的隐藏目录中 (扫描时会跳过以 . 开头的目录)
+MASK_STORE_DIRNAME = ".lisa_masks"
+
 
 class DataManager:
     def __init__(self):
         self.root_dir = ""
-        self.file_list = []
+        self.file_list = []  # 当前列表中显示的文件 (受过滤条件影响)
+        self.all_files = []  # 目录中的全部图片 (相对 root_dir 的路径)
+        self.annotated = set()  # 已有 Mask 的图片
+        self.unannotated_only = False
         self.current_index = -1
+        self.mask_store = None
+
+    def load_directory(self, path, recursive=False):
+        """同步扫描整个目录，返回可见文件列表"""
+        scanner = self.begin_directory(path, recursive)
+        for batch in scanner.scan():
+            self.add_scan_batch(batch)
+        return self.file_list
 
-    def load_directory(self, path):
+    def begin_directory(self, path, recursive=False):
+        """
+        重置文件列表并返回扫描器。调用方可在后台线程迭代 scanner.scan()，
+        再把每个批次交给 add_scan_batch (在持有 DataManager 的线程中调用)。
+        """
         self.root_dir = path
-        valid_ext = ('.jpg', '.png', '.tif')
-        self.file_list = [f for f in os.listdir(path) if f.lower().endswith(valid_ext)]
-        self.file_list.sort()
+        self.file_list = []
+        self.all_files = []
+        self.annotated = set()
+        self.current_index = -1
+        self.mask_store = MaskStore(os.path.join(path, MASK_STORE_DIRNAME))
+        return DirectoryScanner(path, recursive=recursive)
+
+    def add_scan_batch(self, batch):
+        """合并一批扫描结果，返回其中需要显示的文件"""
+        visible = []
+        for rel_path, has_mask in batch:
+            has_mask = has_mask or rel_path in self.mask_store
+            self.all_files.append(rel_path)
+            if has_mask: self.annotated.add(rel_path)
+            if not (self.unannotated_only and has_mask): visible.append(rel_path)
+        self.file_list.extend(visible)
+        return visible
+
+    def set_unannotated_only(self, enabled):
+        """切换“仅未标注”过滤，直接使用扫描时记录的 Mask 状态，无需访问磁盘"""
+        self.unannotated_only = enabled
+        if enabled:
+            self.file_list = [f for f in self.all_files if f not in self.annotated]
+        else:
+            self.file_list = list(self.all_files)
+        self.current_index = -1
         return self.file_list
 
     def get_current_data(self):
@@ -27,9 +72,42 @@ class DataManager:
             return img_path, json_path
         return None, None
 
-    def save_annotation(self, mask_np, text_data):
-        # 实现保存 Mask 和 JSON 的逻辑
-        pass
+    def get_current_key(self):
+        """当前图片在 MaskStore 中的 key (相对 root_dir 的路径)"""
+        if 0 <= self.current_index < len(self.file_list):
+            return self.file_list[self.current_index]
+        return None
+
+    def get_legacy_mask_path(self, img_path):
+        """旧布局下与图片同目录的 <名称>_mask.png"""
+        return os.path.splitext(img_path)[0] + MASK_SUFFIX if img_path else None
+
+    def load_annotation(self, key=None):
+        """从 MaskStore 读取 (mask, text)，没有记录时返回 (None, None)"""
+        key = key or self.get_current_key()
+        if not key or self.mask_store is None: return None, None
+        return self.mask_store.read(key)
+
+    def load_annotation_text(self, key=None):
+        key = key or self.get_current_key()
+        if not key or self.mask_store is None: return None
+        return self.mask_store.read_text(key)
+
+    def save_annotation(self, mask_np, text_data, key=None, store=None):
+        """
+        把 Mask 和文本写入分片存储，key 默认为当前图片。
+        在后台线程调用时须显式传入提交时的 key 和 store：执行前可能已经切换了目录。
+        """
+        key = key or self.get_current_key()
+        store = store or self.mask_store
+        if not key or mask_np is None or store is None: return
+        store.write(key, mask_np, text_data)
+        if store is self.mask_store: self.annotated.add(key)
+
+    def export_mask_pngs(self, out_dir=None):
+        """导出为逐文件 PNG，默认写回图片旁边 (<名称>_mask.png)"""
+        if self.mask_store is None: return []
+        return self.mask_store.export_png(out_dir or self.root_dir, suffix=MASK_SUFFIX)
 
     def delete_current_file(self):
         # 实现移动到回收站逻辑
@@ -40,10 +118,9 @@ class DataManager:
             return json.load(f)
 
     def load_npy_image(self, npy_path):
-        """加载 .npy 格式图像"""
-        if os.path.exists(npy_path):
-            data = np.load(npy_path)
-            # 4通道取前3通道作为RGB
-            if len(data.shape) == 3 and data.shape[-1] >= 3:
-                return data[..., :3].astype(np.uint8)
-        return None
\ No newline at end of file
+        """加载 .npy 格式图像 (mmap 方式打开，只读取前 3 个通道)"""
+        reader = open_raster(npy_path)
+        # 4通道取前3通道作为RGB；与以前一样直接转换为 uint8，不做拉伸 (拉伸显示见 read_composite)
+        if reader is not None and reader.bands >= 3:
+            return reader.read_window(0, 0, reader.width, reader.height, bands=(0, 1, 2)).astype(np.uint8)
+        return None
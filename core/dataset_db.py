@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+
+# 列表显示和预读只需要这些字段，其余内容在选中时再从 data 列解析
+LIGHT_FIELDS = ('id', 'category', 'status', 'image_path_rgb', 'mask_path')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    seq INTEGER PRIMARY KEY,
+    id TEXT UNIQUE NOT NULL,
+    category TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    image_path_rgb TEXT,
+    mask_path TEXT,
+    data TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_items_category ON items(category);
+CREATE INDEX IF NOT EXISTS idx_items_status ON items(status);
+"""
+
+
+def default_owner():
+    """标注员标识：主机名 + 进程号，同一台机器开多个窗口也互不冲突"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class DatasetDB:
+    """
+    SQLite (WAL 模式) 数据集后端，支持多个 GUI 实例同时标注同一个数据集。
+    - 每条数据一行，原始条目完整保存在 data 列 (保持键顺序)，导出 JSON 与导入前一致
+    - id/category/status 建索引，按行更新 conversations 与 mask_path
+    - checkout/release 实现条目租约：同一时间只有持有租约的实例能保存该条目
+    - 每次更新递增 version，调用方传入 expected_version 时可检测并拒绝覆盖别人的修改
+    """
+
+    def __init__(self, db_path, owner=None, lease_seconds=600):
+        self.db_path = db_path
+        self.owner = owner or default_owner()
+        self.lease_seconds = lease_seconds
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.release_all()
+        self.conn.close()
+
+    # ==========================
+    # 导入 / 导出
+    # ==========================
+    def import_json(self, json_path):
+        """
+        导入 LISA JSON 数组，数据库中已存在的 id 会被覆盖；返回写入的行数。
+        每条数据以 id 为主键，缺少 id 或文件内 id 重复时抛出 ValueError，不写入任何数据
+        (否则多条会合并成一行，导出后与原文件不一致)。
+        """
+        with open(json_path, 'r', encoding='utf-8') as f:
+            items = json.load(f)
+        seen, missing, duplicates = set(), [], []
+        for pos, item in enumerate(items):
+            item_id = item.get('id') if isinstance(item, dict) else None
+            if item_id is None or item_id == '':
+                missing.append(pos)
+                continue
+            # 数据库中 id 按文本存储，1 和 "1" 也算重复
+            key = str(item_id)
+            if key in seen: duplicates.append(key)
+            seen.add(key)
+        if missing or duplicates:
+            problems = []
+            if missing: problems.append(f"{len(missing)} 条缺少 id (位置 {missing[:5]})")
+            if duplicates: problems.append(f"{len(duplicates)} 个重复 id ({duplicates[:5]})")
+            raise ValueError(f"无法导入 {json_path}: " + "，".join(problems))
+        now = time.time()
+        rows = [(str(item['id']), item.get('category'), item.get('image_path_rgb'),
+                 item.get('mask_path') or item.get('training_mask_path'),
+                 json.dumps(item, ensure_ascii=False), now) for item in items]
+        self._write("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany(
+                "INSERT INTO items (id, category, image_path_rgb, mask_path, data, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET category=excluded.category, image_path_rgb=excluded.image_path_rgb, "
+                "mask_path=excluded.mask_path, data=excluded.data, version=version + 1, updated_at=excluded.updated_at",
+                rows)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+    def export_json(self, json_path):
+        """按导入顺序导出为 JSON 数组，格式与 MainWindow 保存 JSON 时一致"""
+        items = [json.loads(row['data']) for row in self.conn.execute("SELECT data FROM items ORDER BY seq")]
+        tmp_path = json_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(items, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, json_path)
+        return len(items)
+
+    # ==========================
+    # 查询
+    # ==========================
+    def count(self, category=None, status=None):
+        sql, args = self._where(category, status)
+        return self.conn.execute(f"SELECT COUNT(*) FROM items{sql}", args).fetchone()[0]
+
+    def list_items(self, category=None, status=None):
+        """返回轻量字段列表 [{id, category, status, image_path_rgb, mask_path}, ...]"""
+        sql, args = self._where(category, status)
+        rows = self.conn.execute(f"SELECT {', '.join(LIGHT_FIELDS)} FROM items{sql} ORDER BY seq", args)
+        return [dict(row) for row in rows]
+
+    def get_item(self, item_id):
+        """返回 (完整条目, version)，不存在时返回 (None, None)"""
+        row = self.conn.execute("SELECT data, version FROM items WHERE id = ?", (item_id,)).fetchone()
+        if row is None: return None, None
+        return json.loads(row['data']), row['version']
+
+    def lease_holder(self, item_id):
+        """返回当前有效租约的持有者，没有时返回 None"""
+        row = self.conn.execute("SELECT lease_owner, lease_expires FROM items WHERE id = ?", (item_id,)).fetchone()
+        if row is None or row['lease_owner'] is None or (row['lease_expires'] or 0) < time.time(): return None
+        return row['lease_owner']
+
+    # ==========================
+    # 租约
+    # ==========================
+    def checkout(self, item_id):
+        """尝试获取 (或续期) 条目租约，被其他实例持有且未过期时返回 False"""
+        now = time.time()
+        cur = self._write(
+            "UPDATE items SET lease_owner = ?, lease_expires = ? WHERE id = ? "
+            "AND (lease_owner IS NULL OR lease_owner = ? OR lease_expires < ?)",
+            (self.owner, now + self.lease_seconds, item_id, self.owner, now))
+        return cur.rowcount == 1
+
+    def checkout_next(self, status='pending'):
+        """领取下一条没有被占用的数据，返回 id 或 None"""
+        now = time.time()
+        row = self._write(
+            "UPDATE items SET lease_owner = ?, lease_expires = ? WHERE seq = ("
+            "SELECT seq FROM items WHERE status = ? AND (lease_owner IS NULL OR lease_expires < ?) "
+            "ORDER BY seq LIMIT 1) RETURNING id",
+            (self.owner, now + self.lease_seconds, status, now)).fetchone()
+        return row['id'] if row else None
+
+    def release(self, item_id):
+        self._write("UPDATE items SET lease_owner = NULL, lease_expires = NULL WHERE id = ? AND lease_owner = ?",
+                    (item_id, self.owner))
+
+    def release_all(self):
+        self._write("UPDATE items SET lease_owner = NULL, lease_expires = NULL WHERE lease_owner = ?", (self.owner,))
+
+    # ==========================
+    # 更新
+    # ==========================
+    def update_item(self, item_id, conversations=None, mask_path=None, status=None, expected_version=None):
+        """
+        按行更新条目。需要持有租约 (或该条目无人占用)；
+        传入 expected_version 时，若期间被别人改过则拒绝写入。成功返回新的 version，失败返回 None。
+        """
+        self._write("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                "SELECT data, version, lease_owner, lease_expires FROM items WHERE id = ?", (item_id,)).fetchone()
+            leased_by_other = (row is not None and row['lease_owner'] not in (None, self.owner)
+                               and (row['lease_expires'] or 0) >= time.time())
+            if row is None or leased_by_other or (expected_version is not None and row['version'] != expected_version):
+                self.conn.execute("ROLLBACK")
+                return None
+            item = json.loads(row['data'])
+            if conversations is not None: item['conversations'] = conversations
+            if mask_path is not None:
+                key = 'mask_path' if 'mask_path' in item or 'training_mask_path' not in item else 'training_mask_path'
+                item[key] = mask_path
+            new_version = row['version'] + 1
+            self.conn.execute(
+                "UPDATE items SET data = ?, mask_path = COALESCE(?, mask_path), status = COALESCE(?, status), "
+                "version = ?, updated_at = ?, lease_expires = CASE WHEN lease_owner = ? THEN ? ELSE lease_expires END "
+                "WHERE id = ?",
+                (json.dumps(item, ensure_ascii=False), mask_path, status, new_version, time.time(),
+                 self.owner, time.time() + self.lease_seconds, item_id))
+            self.conn.execute("COMMIT")
+            return new_version
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def delete_item(self, item_id):
+        cur = self._write("DELETE FROM items WHERE id = ? AND (lease_owner IS NULL OR lease_owner = ? "
+                          "OR lease_expires < ?)", (item_id, self.owner, time.time()))
+        return cur.rowcount == 1
+
+    # ==========================
+    # 内部
+    # ==========================
+    def _write(self, sql, args=()):
+        # 其他实例持有写锁时 sqlite 会按 timeout 等待，这里再兜底重试几次
+        for attempt in range(5):
+            try:
+                return self.conn.execute(sql, args)
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) or attempt == 4: raise
+                time.sleep(0.2 * (attempt + 1))
+
+    @staticmethod
+    def _where(category, status):
+        clauses, args = [], []
+        if category is not None:
+            clauses.append("category = ?")
+            args.append(category)
+        if status is not None:
+            clauses.append("status = ?")
+            args.append(status)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), args
@@ -0,0 +1,116 @@
+import os
+import json
+import hashlib
+
+# 索引放在用户缓存目录而不是数据目录里：写索引会改变数据目录的 mtime，导致下次总要重扫
+INDEX_DIR = os.path.join(os.path.expanduser("~"), ".cache", "lisa_label", "dir_index")
+INDEX_VERSION = 2
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp', '.webp')
+# 文件夹模式下 Mask 与图片同目录，命名为 <图片名去后缀>_mask.png
+MASK_SUFFIX = "_mask.png"
+
+
+class DirectoryScanner:
+    """
+    基于 os.scandir 的流式目录扫描器。
+
+    扫描结果按目录持久化到 INDEX_DIR 下 (以 root 绝对路径的哈希命名)，记录目录 mtime 与目录内的文件名。
+    再次打开时，目录 mtime 未变化的目录直接复用索引，不再 scandir；
+    发生过增删的目录重新 scandir 取文件名列表，但不 stat 其中的文件 (类型来自目录项本身)，
+    所以每个目录的开销只有一次 stat，和目录内文件数无关。
+    """
+
+    def __init__(self, root, recursive=False, extensions=IMAGE_EXTENSIONS, batch_size=2000):
+        self.root = root
+        self.recursive = recursive
+        self.extensions = tuple(e.lower() for e in extensions)
+        self.batch_size = batch_size
+        root_key = hashlib.sha1(os.path.abspath(root).encode('utf-8')).hexdigest()
+        self.index_path = os.path.join(INDEX_DIR, root_key + ".json")
+        self.cancelled = False
+        self._old_dirs = self._load_index()
+        self.dirs = {}
+
+    def cancel(self):
+        self.cancelled = True
+
+    def scan(self):
+        """生成器：按批次产出 [(相对路径, 是否已有 Mask), ...]，目录内按文件名排序"""
+        self.dirs = {}
+        batch = []
+        stack = ['']
+        while stack:
+            if self.cancelled: return
+            rel_dir = stack.pop()
+            info = self._scan_dir(rel_dir)
+            if info is None: continue
+            self.dirs[rel_dir] = info
+            masks = set(info['masks'])
+            for name in sorted(info['files']):
+                rel_path = f"{rel_dir}/{name}" if rel_dir else name
+                has_mask = os.path.splitext(name)[0] + MASK_SUFFIX in masks
+                batch.append((rel_path, has_mask))
+                if len(batch) >= self.batch_size:
+                    yield batch
+                    batch = []
+            if self.recursive:
+                # 倒序入栈，保证子目录按名称顺序出栈
+                for sub in sorted(info['subdirs'], reverse=True):
+                    stack.append(f"{rel_dir}/{sub}" if rel_dir else sub)
+        if batch: yield batch
+        if not self.cancelled: self._save_index()
+
+    def _scan_dir(self, rel_dir):
+        abs_dir = os.path.join(self.root, rel_dir)
+        try:
+            dir_mtime = os.stat(abs_dir).st_mtime_ns
+        except OSError:
+            return None
+        cached = self._old_dirs.get(rel_dir)
+        if cached and cached.get('mtime') == dir_mtime:
+            return cached
+
+        files, subdirs, masks = [], [], []
+        try:
+            with os.scandir(abs_dir) as it:
+                for entry in it:
+                    name = entry.name
+                    if name.startswith('.'): continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(name)
+                            continue
+                        lower = name.lower()
+                        if lower.endswith(MASK_SUFFIX):
+                            masks.append(name)
+                        elif lower.endswith(self.extensions):
+                            files.append(name)
+                    except OSError:
+                        continue
+        except OSError:
+            return None
+        return {'mtime': dir_mtime, 'files': files, 'subdirs': subdirs, 'masks': masks}
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get('version') != INDEX_VERSION or list(data.get('extensions', [])) != list(self.extensions):
+            return {}
+        return data.get('dirs', {})
+
+    def _save_index(self):
+        # 非递归扫描只覆盖根目录，保留之前递归扫描得到的子目录记录
+        dirs = self.dirs if self.recursive else {**self._old_dirs, **self.dirs}
+        data = {'version': INDEX_VERSION, 'extensions': list(self.extensions), 'dirs': dirs}
+        tmp_path = self.index_path + ".tmp"
+        try:
+            os.makedirs(INDEX_DIR, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            # 索引写不进去不影响本次扫描结果
+            print(f"目录索引保存失败: {e}")
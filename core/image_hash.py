@@ -0,0 +1,153 @@
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "lisa_label", "phash")
+# 同组判定的默认汉明距离 (64 位 pHash)
+DEFAULT_RADIUS = 6
+
+
+def dhash(gray, size=8):
+    """差值哈希：缩放到 (size+1)xsize，比较相邻像素"""
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return _bits_to_int(bits)
+
+
+def phash(gray, size=8, highfreq_factor=4):
+    """感知哈希：32x32 DCT 取左上 8x8 低频系数，与中位数比较 (不含直流分量)"""
+    n = size * highfreq_factor
+    small = cv2.resize(gray, (n, n), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:size, :size].ravel()
+    bits = low > np.median(low[1:])
+    return _bits_to_int(bits)
+
+
+def _bits_to_int(bits):
+    value = 0
+    for b in bits:
+        value = (value << 1) | int(b)
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def hash_file(path):
+    """子进程中执行：返回 {'phash', 'dhash', 'shape'}，无法解码时返回 None"""
+    gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if gray is None: return None
+    return {'phash': phash(gray), 'dhash': dhash(gray), 'shape': list(gray.shape[:2])}
+
+
+class BKTree:
+    """Burkhard-Keller 树，按汉明距离做半径查询，避免两两比较"""
+
+    def __init__(self):
+        self.root = None  # [hash, [values], {distance: child}]
+
+    def add(self, h, value):
+        if self.root is None:
+            self.root = [h, [value], {}]
+            return
+        node = self.root
+        while True:
+            d = hamming(h, node[0])
+            if d == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, [value], {}]
+                return
+            node = child
+
+    def query(self, h, radius):
+        """返回 [(距离, value), ...]"""
+        found = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d <= radius: found.extend((d, v) for v in node[1])
+            for cd, child in node[2].items():
+                if d - radius <= cd <= d + radius: stack.append(child)
+        return found
+
+
+class HashIndex:
+    """
+    图像感知哈希索引：并行计算哈希 (按 mtime/size 缓存)，再用 BK 树做汉明半径查询分组。
+    """
+
+    def __init__(self, cache_path=None, method='phash'):
+        self.cache_path = cache_path
+        self.method = method
+        self.entries = {}  # path -> {'sig', 'phash', 'dhash', 'shape'}
+        if cache_path:
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def build(self, paths, workers=None, mp_context=None):
+        """只重新计算新增或 mtime/size 变化过的文件；GUI 中调用时应传入 spawn 上下文"""
+        todo = []
+        for path in dict.fromkeys(p for p in paths if p):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            sig = [st.st_mtime_ns, st.st_size]
+            cached = self.entries.get(path)
+            if not cached or cached.get('sig') != sig: todo.append((path, sig))
+        if todo:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as pool:
+                for (path, sig), result in zip(todo, pool.map(hash_file, [t[0] for t in todo], chunksize=32)):
+                    if result is None:
+                        self.entries.pop(path, None)
+                    else:
+                        self.entries[path] = dict(result, sig=sig)
+            self._save()
+        return self
+
+    def groups(self, paths, radius=DEFAULT_RADIUS):
+        """把 paths 中汉明距离 <= radius 的图像归为一组，只返回成员数 >1 的组 (组内保持 paths 的顺序)"""
+        tree = BKTree()
+        present = [p for p in dict.fromkeys(paths) if p in self.entries]
+        for p in present:
+            tree.add(self.entries[p][self.method], p)
+        # 并查集合并所有在半径内的对
+        parent = {p: p for p in present}
+
+        def find(p):
+            while parent[p] != p:
+                parent[p] = parent[parent[p]]
+                p = parent[p]
+            return p
+
+        for p in present:
+            for _, q in tree.query(self.entries[p][self.method], radius):
+                rp, rq = find(p), find(q)
+                if rp != rq: parent[rq] = rp
+        grouped = {}
+        for p in present:
+            grouped.setdefault(find(p), []).append(p)
+        return [g for g in grouped.values() if len(g) > 1]
+
+    def shape(self, path):
+        entry = self.entries.get(path)
+        return tuple(entry['shape']) if entry else None
+
+    def _save(self):
+        if not self.cache_path: return
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.cache_path)
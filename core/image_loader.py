@@ -0,0 +1,265 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from core.label_map import read_label_map, extract_mask
+from core.tracing import tracer, image_size
+from core.memory import memory
+
+
+class ImageCache:
+    """
+    按字节数限制容量的 LRU 缓存，存放解码后的 numpy 数组。
+    registry 不为 None 时，每次放入后检查全局内存预算，超出时由 registry 调用 shrink 淘汰。
+    """
+
+    def __init__(self, max_bytes=1024 * 1024 * 1024, registry=None):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.registry = registry
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            arr = self._items.get(key)
+            if arr is not None:
+                self._items.move_to_end(key)
+            return arr
+
+    def put(self, key, arr):
+        if arr is None: return
+        size = arr.nbytes
+        # 单个数组比整个缓存还大时不缓存，避免把其它条目全部挤掉
+        if size > self.max_bytes: return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old.nbytes
+            self._items[key] = arr
+            self.current_bytes += size
+            self._evict_locked(self.max_bytes)
+        if self.registry is not None: self.registry.enforce()
+
+    def shrink(self, target_bytes):
+        """按 LRU 淘汰到不超过 target_bytes"""
+        with self._lock:
+            self._evict_locked(target_bytes)
+
+    def _evict_locked(self, target_bytes):
+        while self.current_bytes > target_bytes and self._items:
+            _, evicted = self._items.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+
+    def pop(self, key):
+        with self._lock:
+            arr = self._items.pop(key, None)
+            if arr is not None:
+                self.current_bytes -= arr.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.current_bytes = 0
+
+
+class ImageLoader:
+    """
+    图像/Mask 加载服务：
+    - 解码结果放入 ImageCache，重复访问不再读盘
+    - 线程池按导航顺序预读后续条目
+    - 每次 request 会递增 generation，旧请求排队中的任务被取消，已在执行的任务结果被丢弃
+    """
+
+    def __init__(self, max_bytes=1024 * 1024 * 1024, num_workers=4, read_ahead=3, thumb_size=256):
+        self.cache = ImageCache(max_bytes, registry=memory)
+        # 缩略图单独缓存，只占很少内存，切换条目时先用它占位
+        self.thumb_cache = ImageCache(64 * 1024 * 1024, registry=memory)
+        # 内存紧张时先淘汰预读的全尺寸图像，缩略图最后才动
+        memory.register_cache('image', self.cache, priority=0)
+        memory.register_cache('thumbnail', self.thumb_cache, priority=1)
+        self.thumb_size = thumb_size
+        self.read_ahead = read_ahead
+        self._executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="image-loader")
+        self._generation = 0
+        self._pending = []
+        self._lock = threading.Lock()
+
+    # ==========================
+    # 同步读取 (带缓存)
+    # ==========================
+    def load_image(self, path):
+        if not path: return None
+        key = ('image', path)
+        img = self.cache.get(key)
+        if img is None and os.path.exists(path):
+            with tracer.span("load.image", path=os.path.basename(path)) as span:
+                img = cv2.imread(path)
+                span.tag(size=image_size(img))
+            self.cache.put(key, img)
+            if img is not None and self.thumb_cache.get(path) is None:
+                self.thumb_cache.put(path, self._make_thumbnail(img))
+        return img
+
+    def load_thumbnail(self, path):
+        """读取缩略图；JPEG 可用 IMREAD_REDUCED 直接低分辨率解码，比完整解码快得多"""
+        if not path: return None
+        thumb = self.thumb_cache.get(path)
+        if thumb is not None: return thumb
+        full = self.cache.get(('image', path))
+        if full is not None:
+            thumb = self._make_thumbnail(full)
+        elif os.path.exists(path):
+            reduced = cv2.imread(path, cv2.IMREAD_REDUCED_COLOR_4)
+            thumb = self._make_thumbnail(reduced) if reduced is not None else None
+        self.thumb_cache.put(path, thumb)
+        return thumb
+
+    def _make_thumbnail(self, img):
+        h, w = img.shape[:2]
+        scale = self.thumb_size / max(h, w)
+        if scale >= 1: return img.copy()
+        return cv2.resize(img, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+
+    def load_mask(self, path):
+        """读取 Mask 并二值化为 0/1，缓存的是二值化后的结果"""
+        if not path: return None
+        key = ('mask', path)
+        mask = self.cache.get(key)
+        if mask is None and os.path.exists(path):
+            with tracer.span("load.mask", path=os.path.basename(path)):
+                raw = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+            if raw is not None:
+                _, mask = cv2.threshold(raw, 127, 1, cv2.THRESH_BINARY)
+                self.cache.put(key, mask)
+        return mask
+
+    def load_label_map(self, path):
+        """读取单文件标签图 (uint16)，同一源图的所有对象共用一份缓存"""
+        if not path: return None
+        key = ('labels', path)
+        labels = self.cache.get(key)
+        if labels is None:
+            labels = read_label_map(path)
+            self.cache.put(key, labels)
+        return labels
+
+    def invalidate_label_map(self, path):
+        self.cache.pop(('labels', path))
+
+    def update_label_map(self, path, labels):
+        if path and labels is not None: self.cache.put(('labels', path), labels)
+
+    def resolve_mask(self, spec):
+        """
+        mask 来源有两种：字符串为逐对象 PNG 路径；(标签图路径, 标签值) 为标签图中的一个对象。
+        """
+        if isinstance(spec, tuple):
+            labels = self.load_label_map(spec[0])
+            return extract_mask(labels, spec[1]) if labels is not None else None
+        return self.load_mask(spec)
+
+    def get_cached(self, img_path, mask_path=None):
+        """只查缓存，不读盘；全部命中时返回 (image, mask)，否则返回 None"""
+        img = self.cache.get(('image', img_path))
+        if img is None: return None
+        mask = None
+        if isinstance(mask_path, tuple):
+            labels = self.cache.get(('labels', mask_path[0]))
+            if labels is None: return None
+            mask = extract_mask(labels, mask_path[1])
+        elif mask_path:
+            mask = self.cache.get(('mask', mask_path))
+            if mask is None and os.path.exists(mask_path): return None
+        return img, mask
+
+    def invalidate(self, path):
+        """文件被改写后调用，丢弃对应的缓存"""
+        self.cache.pop(('image', path))
+        self.cache.pop(('mask', path))
+
+    def update_mask(self, path, mask):
+        """保存 Mask 后直接把新内容写回缓存，下次打开无需重新读盘"""
+        if not path or mask is None: return
+        self.cache.put(('mask', path), (mask > 0).astype(np.uint8))
+
+    # ==========================
+    # 异步读取与预读
+    # ==========================
+    def request(self, img_path, mask_path, callback, prefetch=()):
+        """
+        异步加载当前条目，完成后在工作线程中调用 callback(generation, image, mask)。
+        mask_path 可以是 PNG 路径，也可以是 (标签图路径, 标签值)。
+        prefetch 为按导航顺序排列的 (img_path, mask_path) 列表，只做缓存预热。
+        返回本次请求的 generation，调用方据此判断结果是否过期。
+        """
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            self._cancel_pending_locked()
+
+            def _task():
+                if generation != self._generation: return
+                img = self.load_image(img_path)
+                mask = self.resolve_mask(mask_path) if img is not None else None
+                if generation != self._generation: return
+                callback(generation, img, mask)
+
+            self._pending.append(self._executor.submit(_task))
+            self._submit_prefetch_locked(generation, prefetch)
+        return generation
+
+    def request_thumbnail(self, img_path, callback):
+        """
+        在当前 generation 下异步读取缩略图，不会作废其它任务。
+        下一次 request/cancel_pending 之后结果自动失效。
+        """
+        with self._lock:
+            generation = self._generation
+
+            def _task():
+                if generation != self._generation: return
+                thumb = self.load_thumbnail(img_path)
+                if thumb is not None and generation == self._generation:
+                    callback(generation, thumb)
+
+            self._pending.append(self._executor.submit(_task))
+        return generation
+
+    def prefetch(self, paths):
+        """当前条目已在缓存中时只做预读，同时作废之前的请求"""
+        with self._lock:
+            self._generation += 1
+            self._cancel_pending_locked()
+            self._submit_prefetch_locked(self._generation, paths)
+
+    def is_current(self, generation):
+        return generation == self._generation
+
+    def cancel_pending(self):
+        with self._lock:
+            self._generation += 1
+            self._cancel_pending_locked()
+
+    def _cancel_pending_locked(self):
+        for future in self._pending:
+            future.cancel()
+        self._pending = []
+
+    def _submit_prefetch_locked(self, generation, paths):
+        for p_img, p_mask in list(paths)[:self.read_ahead]:
+            self._pending.append(self._executor.submit(self._prefetch_task, generation, p_img, p_mask))
+
+    def _prefetch_task(self, generation, img_path, mask_path):
+        if generation != self._generation: return
+        self.load_image(img_path)
+        if generation != self._generation: return
+        self.resolve_mask(mask_path)
+
+    def shutdown(self):
+        self.cancel_pending()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+
+import numpy as np
+
+STORE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "lisa_label", "interaction")
+# 超过这么多天没有更新的未提交状态在打开时清理
+MAX_AGE_DAYS = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    points TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    h INTEGER,
+    w INTEGER,
+    preview BLOB,
+    logits BLOB,
+    logits_shape TEXT,
+    updated_at REAL
+);
+"""
+
+
+def rle_encode(mask):
+    """二值 Mask 按行优先展开后的游程长度 (从 0 的游程开始)，uint32 + zlib"""
+    flat = np.ascontiguousarray(mask).ravel() > 0
+    if flat.size == 0: return zlib.compress(b"")
+    change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    runs = np.diff(np.concatenate(([0], change, [flat.size])))
+    if flat[0]: runs = np.concatenate(([0], runs))
+    return zlib.compress(runs.astype(np.uint32).tobytes())
+
+
+def rle_decode(blob, h, w):
+    runs = np.frombuffer(zlib.decompress(blob), dtype=np.uint32)
+    values = (np.arange(len(runs)) % 2).astype(np.uint8)
+    return np.repeat(values, runs).reshape(h, w)
+
+
+class InteractionStore:
+    """
+    每个条目未提交的 SAM 交互状态：提示点、标签、最近一次低分辨率 logits 和预览 Mask (RLE)。
+    重新打开条目时直接恢复，不必重新点击和解码；条目保存后删除对应记录。
+    每个数据集一个 SQLite 文件，放在 STORE_DIR 下 (以数据集绝对路径的哈希命名)，不污染数据目录。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.execute("DELETE FROM state WHERE updated_at < ?", (time.time() - MAX_AGE_DAYS * 86400,))
+
+    @classmethod
+    def for_dataset(cls, dataset_path):
+        key = hashlib.sha1(os.path.abspath(dataset_path).encode('utf-8')).hexdigest()
+        return cls(os.path.join(STORE_DIR, key + ".db"))
+
+    def close(self):
+        self.conn.close()
+
+    def put(self, key, points, labels, preview=None, logits=None):
+        h, w = preview.shape[:2] if preview is not None else (None, None)
+        preview_blob = rle_encode(preview) if preview is not None else None
+        logits_blob = logits_shape = None
+        if logits is not None:
+            # logits 只用作下一次预测的 mask_input，float16 精度足够
+            logits_blob = zlib.compress(np.ascontiguousarray(logits, dtype=np.float16).tobytes(), 1)
+            logits_shape = json.dumps(list(logits.shape))
+        self.conn.execute(
+            "INSERT OR REPLACE INTO state (key, points, labels, h, w, preview, logits, logits_shape, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (str(key), json.dumps(points), json.dumps(labels), h, w, preview_blob, logits_blob, logits_shape,
+             time.time()))
+
+    def get(self, key):
+        """返回 {'points', 'labels', 'preview', 'logits'}，没有记录时返回 None"""
+        row = self.conn.execute(
+            "SELECT points, labels, h, w, preview, logits, logits_shape FROM state WHERE key = ?",
+            (str(key),)).fetchone()
+        if row is None: return None
+        points, labels, h, w, preview_blob, logits_blob, logits_shape = row
+        logits = None
+        if logits_blob is not None:
+            logits = np.frombuffer(zlib.decompress(logits_blob), dtype=np.float16).astype(np.float32)
+            logits = logits.reshape(json.loads(logits_shape))
+        return {
+            'points': json.loads(points),
+            'labels': json.loads(labels),
+            'preview': rle_decode(preview_blob, h, w) if preview_blob is not None else None,
+            'logits': logits,
+        }
+
+    def delete(self, key):
+        self.conn.execute("DELETE FROM state WHERE key = ?", (str(key),))
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM state").fetchone()[0]
@@ -0,0 +1,149 @@
+import os
+import json
+import codecs
+
+# 常驻内存的轻量字段，其余内容 (conversations、raw_vlm_output 等) 选中时再读取
+LIGHT_FIELDS = ('id', 'category', 'image_path_rgb', 'mask_path', 'training_mask_path', 'label_map_path', 'label_id')
+CHUNK_SIZE = 4 * 1024 * 1024
+_WHITESPACE = ' \t\n\r'
+
+
+class LazyJsonDataset:
+    """
+    按需加载的 LISA JSON 数据集 (顶层为数组)。
+
+    打开时流式读一遍文件，记录每个条目在文件中的字节区间，只保留 LIGHT_FIELDS；
+    get(i) 时 seek 到对应区间解析出完整条目。用法上可当作轻量字段 dict 的列表：
+    len(ds)、ds[i]、for item in ds、ds.pop(i)。
+    save() 的输出与 json.dump(完整列表, indent=4, ensure_ascii=False) 逐字节一致。
+    """
+
+    def __init__(self, json_path):
+        self.path = json_path
+        self.items = []  # 轻量字段
+        self._spans = []  # (字节偏移, 字节长度)
+        self._full = []  # 已物化的完整条目，未物化为 None
+        self._build_index()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __iter__(self):
+        return iter(self.items)
+
+    # ==========================
+    # 读取
+    # ==========================
+    def get(self, index):
+        """返回完整条目；返回的 dict 会被保留，直接修改后调用 save() 即可写回"""
+        if self._full[index] is None:
+            self._full[index] = self.get_uncached(index)
+        return self._full[index]
+
+    def evict(self, index):
+        """丢弃已物化的条目；调用方须保证其修改已经 save() 过"""
+        if 0 <= index < len(self._full):
+            self._full[index] = None
+
+    def pop(self, index):
+        self._spans.pop(index)
+        self._full.pop(index)
+        return self.items.pop(index)
+
+    # ==========================
+    # 保存
+    # ==========================
+    def save(self, path=None):
+        """逐条写出到临时文件再替换，内存中同一时间只有一个条目被解析"""
+        path = path or self.path
+        tmp_path = path + ".tmp"
+        new_spans = []
+        with open(tmp_path, 'wb') as out:
+            if not self.items:
+                out.write(b"[]")
+            else:
+                out.write(b"[\n    ")
+                for i in range(len(self.items)):
+                    if i: out.write(b",\n    ")
+                    entry = self.get_uncached(i)
+                    text = json.dumps(entry, ensure_ascii=False, indent=4).replace("\n", "\n    ")
+                    data = text.encode('utf-8')
+                    new_spans.append((out.tell(), len(data)))
+                    out.write(data)
+                out.write(b"\n]")
+        os.replace(tmp_path, path)
+        if path == self.path:
+            self._spans = new_spans
+            # 物化的条目保持不变 (调用方可能还持有引用)，只同步显示字段
+            for i, full in enumerate(self._full):
+                if full is not None: self.items[i] = self._light(full)
+
+    def get_uncached(self, index):
+        """读取完整条目但不保留在内存中"""
+        if self._full[index] is not None: return self._full[index]
+        offset, length = self._spans[index]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.read(length).decode('utf-8'))
+
+    # ==========================
+    # 建立索引
+    # ==========================
+    @staticmethod
+    def _light(entry):
+        return {k: entry[k] for k in LIGHT_FIELDS if k in entry}
+
+    def _build_index(self):
+        """
+        用 JSONDecoder.raw_decode 逐个解析顶层元素 (C 实现，比逐字符扫描快得多)，
+        同时累计每个元素的 UTF-8 字节长度得到文件偏移。
+        """
+        decoder = json.JSONDecoder()
+        utf8 = codecs.getincrementaldecoder('utf-8')()
+        buf, pos, byte_pos = "", 0, 0  # byte_pos: buf[pos] 在文件中的字节偏移
+        eof, started = False, False
+        with open(self.path, 'rb') as f:
+            while True:
+                # 跳过空白与分隔符
+                while pos < len(buf) and (buf[pos] in _WHITESPACE or (started and buf[pos] == ',')):
+                    pos += 1
+                    byte_pos += 1
+                if pos >= len(buf):
+                    if eof: break
+                    buf, pos, eof = self._read_more(f, utf8, buf, pos)
+                    continue
+                if not started:
+                    if buf[pos] == '\ufeff':  # UTF-8 BOM
+                        pos += 1
+                        byte_pos += 3
+                        continue
+                    if buf[pos] != '[': raise ValueError("JSON 数据集顶层必须是数组")
+                    started = True
+                    pos += 1
+                    byte_pos += 1
+                    continue
+                if buf[pos] == ']': break
+                try:
+                    entry, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if eof: raise
+                    buf, pos, eof = self._read_more(f, utf8, buf, pos)
+                    continue
+                length = len(buf[pos:end].encode('utf-8'))
+                self.items.append(self._light(entry) if isinstance(entry, dict) else {})
+                self._spans.append((byte_pos, length))
+                self._full.append(None)
+                byte_pos += length
+                pos = end
+        if not started: raise ValueError("JSON 数据集顶层必须是数组")
+
+    @staticmethod
+    def _read_more(f, utf8, buf, pos):
+        chunk = f.read(CHUNK_SIZE)
+        eof = not chunk
+        # 丢弃已处理的部分，缓冲区只保留未解析的尾巴
+        buf = buf[pos:] + utf8.decode(chunk, final=eof)
+        return buf, 0, eof
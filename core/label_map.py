@@ -0,0 +1,189 @@
+import os
+import io
+import json
+import hashlib
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from core.async_writer import atomic_write
+
+# JSON 条目中的字段：标签图路径与该对象在图中的标签值
+LABEL_MAP_KEY = 'label_map_path'
+LABEL_ID_KEY = 'label_id'
+MAX_LABELS = 65535
+
+
+def source_key(entry):
+    """同一张源图的对象共用一张标签图；优先按 4 通道源图分组，没有时按 RGB 图"""
+    return entry.get('source_image') or entry.get('image_path_4c') or entry.get('image_path_rgb', '')
+
+
+def entry_mask_path(entry):
+    return entry.get('mask_path') or entry.get('training_mask_path')
+
+
+# ==========================
+# 读写
+# ==========================
+def read_label_map(path):
+    """读取 uint16 标签图 (.png 或 .npz)，不存在时返回 None"""
+    if not path or not os.path.exists(path): return None
+    if path.lower().endswith('.npz'):
+        with np.load(path) as z:
+            return z['labels']
+    return cv2.imread(path, cv2.IMREAD_UNCHANGED)
+
+
+def write_label_map(path, labels):
+    labels = labels.astype(np.uint16, copy=False)
+    if path.lower().endswith('.npz'):
+        buf = io.BytesIO()
+        np.savez_compressed(buf, labels=labels)
+        atomic_write(path, buf.getvalue())
+    else:
+        ok, buf = cv2.imencode('.png', labels)
+        if not ok: raise IOError(f"标签图编码失败: {path}")
+        atomic_write(path, buf.tobytes())
+
+
+def table_path(label_map_path):
+    """id -> 标签值 对照表与标签图同名，后缀为 .json"""
+    return os.path.splitext(label_map_path)[0] + '.json'
+
+
+def read_table(label_map_path):
+    try:
+        with open(table_path(label_map_path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_table(label_map_path, table):
+    atomic_write(table_path(label_map_path), json.dumps(table, ensure_ascii=False, indent=2).encode('utf-8'))
+
+
+# ==========================
+# 单个对象的视图
+# ==========================
+def extract_mask(labels, label):
+    """从标签图中取出某个对象的二值 Mask (0/1)"""
+    return (labels == label).astype(np.uint8)
+
+
+def put_mask(labels, label, mask):
+    """
+    用新的 Mask 替换标签图中某个对象。只写入空白像素和原本属于该对象的像素，
+    已属于其他对象的像素保持不变；返回因重叠而没有写入的像素数。
+    """
+    labels[labels == label] = 0
+    fg = mask > 0
+    free = fg & (labels == 0)
+    labels[free] = label
+    return int(np.count_nonzero(fg)) - int(np.count_nonzero(free))
+
+
+def remove_object(label_map_path, item_id, label):
+    """从标签图和对照表中删除一个对象，图中不再有对象时删除文件"""
+    table = read_table(label_map_path)
+    table.pop(str(item_id), None)
+    if not table:
+        for p in (label_map_path, table_path(label_map_path)):
+            if os.path.exists(p): os.remove(p)
+        return
+    labels = read_label_map(label_map_path)
+    if labels is not None:
+        labels[labels == label] = 0
+        write_label_map(label_map_path, labels)
+    write_table(label_map_path, table)
+
+
+# ==========================
+# 格式转换
+# ==========================
+def entries_to_label_maps(entries, out_dir, fmt='png', remove_pngs=False):
+    """
+    逐对象 PNG -> 每张源图一个标签图。直接修改 entries，写入 label_map_path/label_id。
+    标签值按条目在组内的顺序从 1 开始。一个像素只能有一个标签，与组内已转换对象重叠的对象
+    不放进标签图，保留原来的逐对象 PNG (条目不变)，因此转换不丢失任何像素。
+    remove_pngs=True 时删除已转换对象的 PNG；组内有重叠对象时整组 PNG 都保留，
+    仍被未转换条目引用的路径也不删除。返回统计信息 dict。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    groups = OrderedDict()
+    for entry in entries:
+        groups.setdefault(source_key(entry), []).append(entry)
+
+    stats = {'groups': 0, 'objects': 0, 'missing': 0, 'overlapping': 0, 'removed': 0}
+    removable = []
+    for key, group in groups.items():
+        if len(group) > MAX_LABELS: raise ValueError(f"{key} 的对象数超过 {MAX_LABELS}")
+        labels, table, converted, overlapping = None, {}, [], 0
+        for entry in group:
+            mask_path = entry_mask_path(entry)
+            mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE) if mask_path and os.path.exists(mask_path) else None
+            if mask is None or (labels is not None and mask.shape != labels.shape):
+                stats['missing'] += 1
+                continue
+            if labels is None: labels = np.zeros(mask.shape, dtype=np.uint16)
+            fg = mask > 127
+            if labels[fg].any():
+                overlapping += 1
+                continue
+            label = len(table) + 1
+            labels[fg] = label
+            table[str(entry.get('id'))] = label
+            converted.append((entry, label))
+        stats['overlapping'] += overlapping
+        if not converted: continue
+
+        stem = os.path.splitext(os.path.basename(key))[0] or "group"
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:8]
+        map_path = os.path.join(out_dir, f"{stem}_{digest}_labels.{fmt}")
+        write_label_map(map_path, labels)
+        write_table(map_path, table)
+        for entry, label in converted:
+            entry[LABEL_MAP_KEY] = map_path
+            entry[LABEL_ID_KEY] = label
+        if remove_pngs and not overlapping: removable.extend(entry_mask_path(e) for e, _ in converted)
+        stats['groups'] += 1
+        stats['objects'] += len(converted)
+
+    if removable:
+        # 多个条目可能共用一个 PNG，只删除不再被任何未转换条目引用的路径，每个路径只删一次
+        keep = {entry_mask_path(e) for e in entries if not e.get(LABEL_MAP_KEY)}
+        for path in dict.fromkeys(removable):
+            if path in keep or not os.path.exists(path): continue
+            os.remove(path)
+            stats['removed'] += 1
+    return stats
+
+
+def label_maps_to_entries(entries, out_dir=None):
+    """
+    标签图 -> 逐对象 PNG。写到条目原来的 mask_path (没有时写到 out_dir/<id>_mask.png)，
+    并去掉 label_map_path/label_id 字段。返回写出的 PNG 数量。
+    """
+    cache = {}
+    written = 0
+    for entry in entries:
+        map_path = entry.get(LABEL_MAP_KEY)
+        if not map_path: continue
+        if map_path not in cache: cache = {map_path: read_label_map(map_path)}  # 条目按组相邻，只保留一张
+        labels = cache[map_path]
+        if labels is None: continue
+        out_path = entry_mask_path(entry)
+        if not out_path:
+            if not out_dir: continue
+            os.makedirs(out_dir, exist_ok=True)
+            out_path = os.path.join(out_dir, f"{entry.get('id')}_mask.png")
+            entry['mask_path'] = out_path
+        ok, buf = cv2.imencode('.png', extract_mask(labels, entry[LABEL_ID_KEY]) * 255)
+        if ok:
+            atomic_write(out_path, buf.tobytes())
+            written += 1
+            entry.pop(LABEL_MAP_KEY, None)
+            entry.pop(LABEL_ID_KEY, None)
+    return written
@@ -0,0 +1,86 @@
+import cv2
+import numpy as np
+
+from core.tracing import tracer
+
+# 小于该面积 (像素) 的孤立前景块视为噪点
+DEFAULT_MIN_SPECKLE = 64
+# 不大于该面积的封闭背景区域视为针孔并填充
+DEFAULT_MAX_HOLE = 256
+# 形态学平滑的结构元半径；航拍图中道路等细长目标只有几个像素宽，默认取 1
+DEFAULT_SMOOTH_RADIUS = 1
+
+
+def mask_bbox(mask):
+    """前景的外接框 (y0, y1, x0, x1)，半开区间；没有前景时返回 None"""
+    # 对单通道图像 boundingRect 直接统计非零像素，比 numpy 按行/列归约快得多
+    x, y, w, h = cv2.boundingRect(np.ascontiguousarray(mask, dtype=np.uint8))
+    if w == 0 or h == 0: return None
+    return y, y + h, x, x + w
+
+
+def _border_labels(labels, sides):
+    """落在指定边 (上, 下, 左, 右) 上的连通域编号"""
+    edges = []
+    if sides[0]: edges.append(labels[0, :])
+    if sides[1]: edges.append(labels[-1, :])
+    if sides[2]: edges.append(labels[:, 0])
+    if sides[3]: edges.append(labels[:, -1])
+    return np.unique(np.concatenate(edges)) if edges else np.empty(0, dtype=labels.dtype)
+
+
+def remove_speckles(mask, min_area, cut_sides=(False, False, False, False)):
+    """
+    去掉面积小于 min_area 的前景连通域 (8 邻域)。
+    cut_sides 标出被裁剪截断的边：碰到这些边的连通域在裁剪区外可能还有一部分，一律保留。
+    """
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    if count <= 1: return mask
+    keep = stats[:, cv2.CC_STAT_AREA] >= min_area
+    keep[_border_labels(labels, cut_sides)] = True
+    keep[0] = False
+    if keep[1:].all(): return mask  # 常见情况：没有要去掉的块，省掉整幅查表
+    return keep[labels].astype(np.uint8)
+
+
+def fill_holes(mask, max_area):
+    """填充面积不超过 max_area 的封闭背景区域 (4 邻域)；碰到区域边缘的背景不算孔洞"""
+    count, labels, stats, _ = cv2.connectedComponentsWithStats((mask == 0).astype(np.uint8), connectivity=4)
+    if count <= 1: return mask
+    fill = stats[:, cv2.CC_STAT_AREA] <= max_area
+    fill[_border_labels(labels, (True, True, True, True))] = False
+    fill[0] = False  # 编号 0 是前景本身
+    if not fill.any(): return mask
+    return mask | fill[labels].astype(np.uint8)
+
+
+def smooth(mask, radius):
+    """开运算去毛刺，闭运算补缺口"""
+    if radius <= 0: return mask
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * radius + 1, 2 * radius + 1))
+    opened = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+    return cv2.morphologyEx(opened, cv2.MORPH_CLOSE, kernel)
+
+
+def postprocess(mask, region=None, min_speckle=DEFAULT_MIN_SPECKLE, max_hole=DEFAULT_MAX_HOLE,
+                smooth_radius=DEFAULT_SMOOTH_RADIUS):
+    """
+    就地清理 Mask (0/1, uint8)：去噪点、补针孔、形态学平滑。
+    只处理 region (默认为 mask 本身) 前景外接框外扩几个像素的区域，大图上也能保持交互速度。
+    返回处理的区域 (y0, y1, x0, x1)，没有前景时返回 None。
+    """
+    box = mask_bbox(region if region is not None else mask)
+    if box is None: return None
+    h, w = mask.shape[:2]
+    pad = 2 * smooth_radius + 2
+    y0, y1 = max(0, box[0] - pad), min(h, box[1] + pad)
+    x0, x1 = max(0, box[2] - pad), min(w, box[3] + pad)
+    with tracer.span("mask.postprocess", size=f"{x1 - x0}x{y1 - y0}"):
+        crop = (mask[y0:y1, x0:x1] > 0).astype(np.uint8)
+        # 裁剪边不在图像边界上时，碰到它的前景块可能延伸到区域外
+        cut_sides = (y0 > 0, y1 < h, x0 > 0, x1 < w)
+        if min_speckle > 0: crop = remove_speckles(crop, min_speckle, cut_sides)
+        if max_hole > 0: crop = fill_holes(crop, max_hole)
+        crop = smooth(crop, smooth_radius)
+        mask[y0:y1, x0:x1] = crop
+    return y0, y1, x0, x1
@@ -0,0 +1,153 @@
+import os
+import json
+import zlib
+import shutil
+import threading
+import numpy as np
+
+SHARD_PREFIX = "shard_"
+DEFAULT_SHARD_BYTES = 256 * 1024 * 1024
+
+
+def encode_mask(mask_np):
+    """二值 Mask -> 按位打包后 zlib 压缩的字节串"""
+    bits = np.packbits((mask_np > 0).ravel())
+    return zlib.compress(bits.tobytes(), 6)
+
+
+def decode_mask(blob, h, w):
+    bits = np.frombuffer(zlib.decompress(blob), dtype=np.uint8)
+    return np.unpackbits(bits, count=h * w).reshape(h, w)
+
+
+def read_located(location):
+    """按 MaskStore.locate 的结果读取一个 Mask，不需要加载索引"""
+    bin_path, offset, length, h, w = location
+    with open(bin_path, 'rb') as f:
+        f.seek(offset)
+        blob = f.read(length)
+    return decode_mask(blob, h, w)
+
+
+class MaskStore:
+    """
+    分片的 Mask 存储：一个分片 (shard_XXXXX.bin) 顺序追加保存大量压缩后的 Mask，
+    同名 .idx 文件以 JSONL 追加记录 {key, offset, length, h, w, text}。
+    打开时回放所有 .idx 建立 key -> 位置 的字典，之后读取任意一个 Mask 只需一次 seek + read。
+    同一个 key 重复保存时追加新记录，后写的覆盖先写的；旧数据留在分片中直到 compact()。
+    只依赖 numpy/zlib，训练端可以直接使用。
+    """
+
+    def __init__(self, store_dir, max_shard_bytes=DEFAULT_SHARD_BYTES):
+        self.store_dir = store_dir
+        self.max_shard_bytes = max_shard_bytes
+        self.index = {}  # key -> (shard_id, offset, length, h, w, text)
+        self._lock = threading.Lock()
+        self._write_shard = 0
+        self._load_index()
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def keys(self):
+        return list(self.index)
+
+    # ==========================
+    # 读取
+    # ==========================
+    def read(self, key):
+        """返回 (mask, text)，不存在时返回 (None, None)"""
+        entry = self.index.get(key)
+        if entry is None: return None, None
+        shard_id, offset, length, h, w, text = entry
+        with open(self._shard_path(shard_id, '.bin'), 'rb') as f:
+            f.seek(offset)
+            blob = f.read(length)
+        return decode_mask(blob, h, w), text
+
+    def read_text(self, key):
+        entry = self.index.get(key)
+        return entry[5] if entry else None
+
+    def locate(self, key):
+        """(分片路径, offset, length, h, w)，可交给其它进程用 read_located 读取；不存在时返回 None"""
+        entry = self.index.get(key)
+        if entry is None: return None
+        shard_id, offset, length, h, w, _ = entry
+        return self._shard_path(shard_id, '.bin'), offset, length, h, w
+
+    # ==========================
+    # 写入
+    # ==========================
+    def write(self, key, mask_np, text=""):
+        h, w = mask_np.shape[:2]
+        blob = encode_mask(mask_np)
+        with self._lock:
+            os.makedirs(self.store_dir, exist_ok=True)
+            bin_path = self._shard_path(self._write_shard, '.bin')
+            if os.path.exists(bin_path) and os.path.getsize(bin_path) + len(blob) > self.max_shard_bytes:
+                self._write_shard += 1
+                bin_path = self._shard_path(self._write_shard, '.bin')
+            with open(bin_path, 'ab') as f:
+                offset = f.tell()
+                f.write(blob)
+            record = {'key': key, 'offset': offset, 'length': len(blob), 'h': h, 'w': w, 'text': text}
+            # 先写数据再写索引，中途崩溃最多留下一段没有索引引用的数据
+            with open(self._shard_path(self._write_shard, '.idx'), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.index[key] = (self._write_shard, offset, len(blob), h, w, text)
+
+    def compact(self):
+        """重写所有分片，去掉被覆盖的旧记录；先写到临时目录再整体替换"""
+        base = self.store_dir.rstrip(os.sep)
+        tmp_dir, old_dir = base + ".compact", base + ".old"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        with self._lock:
+            new_store = MaskStore(tmp_dir, self.max_shard_bytes)
+            for key in list(self.index):
+                mask, text = self.read(key)
+                new_store.write(key, mask, text)
+            if os.path.isdir(self.store_dir): os.replace(self.store_dir, old_dir)
+            if os.path.isdir(tmp_dir): os.replace(tmp_dir, self.store_dir)
+            shutil.rmtree(old_dir, ignore_errors=True)
+            self.index = new_store.index
+            self._write_shard = new_store._write_shard
+
+    def export_png(self, out_dir, suffix="_mask.png"):
+        """导出为每个对象一张 PNG (0/255)，兼容旧的逐文件布局；导出的是调用时刻的快照"""
+        import cv2  # 只有导出时需要，读写分片本身不依赖 OpenCV
+        os.makedirs(out_dir, exist_ok=True)
+        # 后台写入线程可能同时在追加记录，先在锁内取索引快照
+        with self._lock:
+            entries = list(self.index.items())
+        paths = []
+        for key, (shard_id, offset, length, h, w, _) in entries:
+            mask = read_located((self._shard_path(shard_id, '.bin'), offset, length, h, w))
+            out_path = os.path.join(out_dir, os.path.splitext(key)[0] + suffix)
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            cv2.imwrite(out_path, mask * 255)
+            paths.append(out_path)
+        return paths
+
+    # ==========================
+    # 内部
+    # ==========================
+    def _shard_path(self, shard_id, ext):
+        return os.path.join(self.store_dir, f"{SHARD_PREFIX}{shard_id:05d}{ext}")
+
+    def _load_index(self):
+        if not os.path.isdir(self.store_dir): return
+        idx_files = sorted(f for f in os.listdir(self.store_dir) if f.startswith(SHARD_PREFIX) and f.endswith('.idx'))
+        for name in idx_files:
+            shard_id = int(name[len(SHARD_PREFIX):-len('.idx')])
+            self._write_shard = max(self._write_shard, shard_id)
+            with open(os.path.join(self.store_dir, name), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        r = json.loads(line)
+                    except ValueError:
+                        continue  # 写到一半的最后一行
+                    self.index[r['key']] = (shard_id, r['offset'], r['length'], r['h'], r['w'], r.get('text', ''))
@@ -0,0 +1,94 @@
+import os
+import threading
+import weakref
+
+MB = 1024 * 1024
+# 全局内存预算，可用环境变量 LISA_MEMORY_BUDGET_MB 覆盖，界面上也可调整
+DEFAULT_BUDGET = int(os.environ.get("LISA_MEMORY_BUDGET_MB", 4096)) * MB
+
+
+def nbytes(obj):
+    """numpy 数组、torch 张量、QPixmap/QImage 或直接给出的字节数"""
+    if obj is None: return 0
+    if isinstance(obj, int): return obj
+    if hasattr(obj, 'nbytes'): return int(obj.nbytes)
+    if hasattr(obj, 'element_size'): return obj.element_size() * obj.nelement()
+    if hasattr(obj, 'depth') and hasattr(obj, 'width'):
+        return obj.width() * obj.height() * obj.depth() // 8
+    return 0
+
+
+class MemoryRegistry:
+    """
+    大块内存的统一记账：
+    - track(类别, 名称, 对象) 登记或更新一块缓冲区，对象为 None 时注销
+    - 缓存用 register_cache 登记，需提供 current_bytes 属性和 shrink(target_bytes) 方法
+    - 总量超过 budget 时，按 priority 从小到大让缓存淘汰，直到回到预算以内
+    工作缓冲区 (当前图像、Mask、QPixmap、SAM 特征) 不能释放，只能靠缓存让出空间。
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        self._buffers = {}  # (类别, 名称) -> 字节数
+        self._caches = []  # [(priority, 名称, weakref)]
+        self._lock = threading.Lock()
+
+    def track(self, category, key, obj):
+        size = nbytes(obj)
+        with self._lock:
+            if size:
+                self._buffers[(category, key)] = size
+            else:
+                self._buffers.pop((category, key), None)
+        if size: self.enforce()
+
+    def register_cache(self, name, cache, priority=0):
+        with self._lock:
+            self._caches = [c for c in self._caches if c[2]() is not None and c[1] != name]
+            self._caches.append((priority, name, weakref.ref(cache)))
+            self._caches.sort(key=lambda c: c[0])
+
+    def _live_caches(self):
+        with self._lock:
+            caches = list(self._caches)
+        return [(name, ref()) for _, name, ref in caches if ref() is not None]
+
+    def totals(self):
+        """{类别: 字节数}，缓存按 cache.<名称> 单独列出"""
+        with self._lock:
+            buffers = list(self._buffers.items())
+        result = {}
+        for (category, _), size in buffers:
+            result[category] = result.get(category, 0) + size
+        for name, cache in self._live_caches():
+            result[f"cache.{name}"] = cache.current_bytes
+        return result
+
+    def total(self):
+        return sum(self.totals().values())
+
+    def set_budget(self, budget):
+        self.budget = budget
+        self.enforce()
+
+    def enforce(self):
+        """超出预算时依次收缩缓存，返回释放的字节数"""
+        excess = self.total() - self.budget
+        freed = 0
+        for _, cache in self._live_caches():
+            if excess <= 0: break
+            before = cache.current_bytes
+            cache.shrink(max(0, before - excess))
+            released = before - cache.current_bytes
+            excess -= released
+            freed += released
+        return freed
+
+
+def format_bytes(size):
+    if size >= 1024 * MB: return f"{size / (1024 * MB):.2f} GB"
+    return f"{size / MB:.1f} MB"
+
+
+# 全局实例，各模块在持有大块缓冲区时向它登记
+memory = MemoryRegistry()
@@ -0,0 +1,96 @@
+import os
+import numpy as np
+
+# 假彩色合成方案：名称 -> 波段序号 (输出 R, G, B)。数据通道顺序约定为 R, G, B, NIR
+COMPOSITES = {
+    "RGB": (0, 1, 2),
+    "CIR (NIR-R-G)": (3, 0, 1),
+    "NIR-G-B": (3, 1, 2),
+    "NDVI": None,  # 特殊处理：(NIR - R) / (NIR + R)
+}
+
+
+class RasterReader:
+    """
+    以 mmap_mode='r' 打开 .npy 栅格，只在需要时读取窗口，不会把整幅数据读进内存。
+    支持 HWC 与 CHW 两种存储顺序；非 uint8 数据按波段 2%~98% 分位数拉伸到 0~255。
+    """
+
+    def __init__(self, npy_path):
+        self.path = npy_path
+        self.data = np.load(npy_path, mmap_mode='r')
+        if self.data.ndim == 2:
+            self.data = self.data[..., None]
+        # 通道数很少而最后一维很大时，认为是 CHW 存储
+        self.channels_first = self.data.shape[0] <= 4 < self.data.shape[-1]
+        if self.channels_first:
+            self.bands, self.height, self.width = self.data.shape
+        else:
+            self.height, self.width, self.bands = self.data.shape
+        self._stretch = {}
+
+    @property
+    def shape(self):
+        return self.height, self.width, self.bands
+
+    def available_composites(self):
+        """按波段数返回可用的合成方案"""
+        if self.bands >= 4: return list(COMPOSITES)
+        if self.bands >= 3: return ["RGB"]
+        return []
+
+    def read_window(self, x, y, w, h, bands=None, step=1):
+        """读取 [y:y+h, x:x+w] 区域 (按 step 抽样)，返回 HWC 原始数据类型数组"""
+        x0, y0 = max(0, int(x)), max(0, int(y))
+        x1, y1 = min(self.width, int(x + w)), min(self.height, int(y + h))
+        step = max(1, int(step))
+        if x1 <= x0 or y1 <= y0:
+            return np.zeros((0, 0, len(bands) if bands else self.bands), dtype=self.data.dtype)
+        if self.channels_first:
+            sel = self.data[:, y0:y1:step, x0:x1:step] if bands is None else self.data[list(bands), y0:y1:step, x0:x1:step]
+            return np.ascontiguousarray(np.moveaxis(sel, 0, -1))
+        sel = self.data[y0:y1:step, x0:x1:step]
+        if bands is not None: sel = sel[..., list(bands)]
+        return np.ascontiguousarray(sel)
+
+    def read_composite(self, name, x=0, y=0, w=None, h=None, step=1):
+        """按合成方案读取窗口并转换为 uint8 RGB，只计算窗口内的像素"""
+        w = self.width if w is None else w
+        h = self.height if h is None else h
+        if name == "NDVI":
+            raw = self.read_window(x, y, w, h, bands=(0, 3), step=step).astype(np.float32)
+            red, nir = raw[..., 0], raw[..., 1]
+            ndvi = (nir - red) / np.maximum(nir + red, 1e-6)
+            gray = ((np.clip(ndvi, -1, 1) + 1) * 127.5).astype(np.uint8)
+            return np.stack([gray] * 3, axis=-1)
+        bands = COMPOSITES.get(name, COMPOSITES["RGB"])
+        raw = self.read_window(x, y, w, h, bands=bands, step=step)
+        return self._to_uint8(raw, bands)
+
+    def _to_uint8(self, raw, bands):
+        if raw.dtype == np.uint8: return raw
+        out = np.empty(raw.shape, dtype=np.uint8)
+        for i, b in enumerate(bands):
+            lo, hi = self._band_stretch(b)
+            band = (raw[..., i].astype(np.float32) - lo) * (255.0 / max(hi - lo, 1e-6))
+            out[..., i] = np.clip(band, 0, 255).astype(np.uint8)
+        return out
+
+    def _band_stretch(self, band):
+        """用抽样估计拉伸范围，只读约 512x512 个像素"""
+        if band not in self._stretch:
+            step = max(1, max(self.height, self.width) // 512)
+            sample = self.read_window(0, 0, self.width, self.height, bands=(band,), step=step).astype(np.float32)
+            lo, hi = np.percentile(sample, (2, 98)) if sample.size else (0.0, 255.0)
+            self._stretch[band] = (float(lo), float(hi))
+        return self._stretch[band]
+
+
+def open_raster(path):
+    """存在且为 .npy 时返回 RasterReader，否则返回 None"""
+    if not path or not path.lower().endswith('.npy') or not os.path.exists(path): return None
+    try:
+        return RasterReader(path)
+    except (OSError, ValueError) as e:
+        print(f"无法打开栅格: {path}, {e}")
+        return None
@@ -0,0 +1,146 @@
+import os
+import json
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from core.async_writer import atomic_write
+from core.label_map import read_label_map, extract_mask
+from core.mask_store import read_located
+
+THUMB_DIR = os.path.join(os.path.expanduser("~"), ".cache", "lisa_label", "review_thumbs")
+THUMB_SIZE = 192
+JPEG_QUALITY = 85
+OVERLAY_COLOR = np.array([0, 0, 255], dtype=np.float32)  # BGR 红色，与画布上的 Mask 一致
+OVERLAY_ALPHA = 0.45
+
+
+# ==========================
+# 缓存键
+# ==========================
+def _file_sig(path):
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def cache_path(img_path, mask_spec, size=THUMB_SIZE, cache_dir=THUMB_DIR):
+    """
+    缩略图缓存文件路径。mask_spec 有三种：
+    ('png', 路径)、('label_map', 标签图路径, 标签值)、('mask_store', 分片路径, offset, length, h, w)。
+    键包含图像与 Mask 文件的 mtime/size，任一文件改动都会得到新的路径；
+    MaskStore 只追加写入，位置本身就能区分新旧内容。
+    """
+    parts = [img_path, _file_sig(img_path), size, list(mask_spec) if mask_spec else None]
+    if mask_spec and mask_spec[0] in ('png', 'label_map'): parts.append(_file_sig(mask_spec[1]))
+    digest = hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, digest[:2], digest + ".jpg")
+
+
+# ==========================
+# 渲染 (在子进程中执行)
+# ==========================
+def _read_mask(spec):
+    kind = spec[0]
+    if kind == 'png':
+        raw = cv2.imread(spec[1], cv2.IMREAD_GRAYSCALE)
+        return (raw > 127).astype(np.uint8) if raw is not None else None
+    if kind == 'label_map':
+        labels = read_label_map(spec[1])
+        return extract_mask(labels, spec[2]) if labels is not None else None
+    if kind == 'mask_store':
+        return read_located(spec[1:])
+    return None
+
+
+def render_thumbnail(img_path, mask_spec, size=THUMB_SIZE):
+    """图像缩放到长边 size 并叠加半透明 Mask 与轮廓，返回 JPEG 字节；图像无法读取时返回 None"""
+    # JPEG 等格式可直接低分辨率解码，够用时不做完整解码
+    img = cv2.imread(img_path, cv2.IMREAD_REDUCED_COLOR_4)
+    if img is None or max(img.shape[:2]) < size: img = cv2.imread(img_path)
+    if img is None: return None
+    h, w = img.shape[:2]
+    scale = min(1.0, size / max(h, w))
+    tw, th = max(1, int(w * scale)), max(1, int(h * scale))
+    thumb = cv2.resize(img, (tw, th), interpolation=cv2.INTER_AREA)
+    mask = _read_mask(mask_spec) if mask_spec else None
+    if mask is not None:
+        # 面积插值再阈值化，缩小后细小目标也不会消失
+        small = cv2.resize(mask.astype(np.uint8) * 255, (tw, th), interpolation=cv2.INTER_AREA) >= 64
+        if small.any():
+            blended = thumb[small].astype(np.float32) * (1 - OVERLAY_ALPHA) + OVERLAY_COLOR * OVERLAY_ALPHA
+            thumb[small] = blended.astype(np.uint8)
+            contours, _ = cv2.findContours(small.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            cv2.drawContours(thumb, contours, -1, (0, 255, 255), 1)
+    ok, buf = cv2.imencode('.jpg', thumb, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    return buf.tobytes() if ok else None
+
+
+def make_thumbnail(img_path, mask_spec, size=THUMB_SIZE, cache_dir=THUMB_DIR):
+    """子进程入口：命中缓存直接返回路径，否则渲染并原子写入缓存；失败返回 None"""
+    path = cache_path(img_path, mask_spec, size, cache_dir)
+    if os.path.exists(path): return path
+    data = render_thumbnail(img_path, mask_spec, size)
+    if data is None: return None
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    atomic_write(path, data)
+    return path
+
+
+class ReviewThumbnailer:
+    """
+    审阅网格的缩略图服务：磁盘缓存命中时由调用方直接读取 (cached)，
+    未命中的交给进程池渲染 (submit)，完成后在工作线程中调用 callback(缓存路径或 None)。
+    网格滚动后调用 cancel_pending 取消尚未开始的任务，再为可见区域重新提交。
+    """
+
+    def __init__(self, size=THUMB_SIZE, cache_dir=THUMB_DIR, workers=None, mp_context=None):
+        self.size = size
+        self.cache_dir = cache_dir
+        self.workers = workers or max(1, min(8, (os.cpu_count() or 2) - 1))
+        self.mp_context = mp_context
+        self._pool = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def cached(self, img_path, mask_spec):
+        path = cache_path(img_path, mask_spec, self.size, self.cache_dir)
+        return path if os.path.exists(path) else None
+
+    def submit(self, img_path, mask_spec, callback):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=self.mp_context)
+            future = self._pool.submit(make_thumbnail, img_path, mask_spec, self.size, self.cache_dir)
+            self._pending.add(future)
+
+        def _done(f):
+            with self._lock:
+                self._pending.discard(f)
+            if f.cancelled(): return
+            try:
+                result = f.result()
+            except Exception as e:
+                print(f"缩略图生成失败 {img_path}: {e}")
+                result = None
+            callback(result)
+
+        future.add_done_callback(_done)
+        return future
+
+    def cancel_pending(self):
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            future.cancel()
+
+    def shutdown(self):
+        self.cancel_pending()
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None: pool.shutdown(wait=False, cancel_futures=True)
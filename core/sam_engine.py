@@ -1,18 +1,32 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import torch
 # 确保安装了 segment_anything: pip install segment-anything
 from segment_anything import sam_model_registry, SamPredictor
 
+from core.tracing import tracer, image_size
+from core.memory import memory
+
 
 class SAMEngine:
-    def __init__(self, checkpoint_path, model_type="vit_b"):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+    def __init__(self, checkpoint_path, model_type="vit_b", device=None):
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
         print(f"Initializing SAM Engine on {self.device}...")
 
         self.sam = sam_model_registry[model_type](checkpoint=checkpoint_path)
         self.sam.to(device=self.device)
         self.predictor = SamPredictor(self.sam)
         self.is_loaded = True
+        self.last_logits = None  # 最近一次预测的低分辨率 logits (1x256x256)
+        memory.track('sam', 'model', sum(p.element_size() * p.nelement() for p in self.sam.parameters()))
+
+        # 后台编码线程：只有一个 worker，保证 predictor 的状态按提交顺序更新
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sam-encoder")
+        self._generation = 0
+        self._pending = []
+        self._lock = threading.Lock()
 
     def set_image(self, image_np):
         if not self.is_loaded: return
@@ -24,10 +38,48 @@ class SAMEngine:
         else:
             image_rgb = np.stack([image_np] * 3, axis=-1)
 
-        self.predictor.set_image(image_rgb)
+        with tracer.span("sam.set_image", size=image_size(image_np)):
+            self.predictor.set_image(image_rgb)
+        # 图像 embedding 常驻到下一次 set_image，GPU 上时统计的是显存
+        memory.track('sam', 'features', self.predictor.features)
         print("SAM: Image embedding computed.")
 
-    def predict_mask(self, points, labels):
+    def submit_image(self, image_np, callback=None):
+        """
+        在后台线程计算 embedding，排队中尚未开始的旧任务会被取消。
+        完成后在工作线程中调用 callback(generation)；返回本次任务的 generation。
+        注意：编码完成前不要调用 predict_mask。
+        """
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            self._cancel_pending_locked()
+
+            def _task():
+                if generation != self._generation: return
+                self.set_image(image_np)
+                if callback is not None and generation == self._generation:
+                    callback(generation)
+
+            self._pending.append(self._executor.submit(_task))
+        return generation
+
+    def cancel_pending(self):
+        with self._lock:
+            self._generation += 1
+            self._cancel_pending_locked()
+
+    def _cancel_pending_locked(self):
+        for future in self._pending:
+            future.cancel()
+        self._pending = []
+
+    def shutdown(self):
+        self.cancel_pending()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def predict_mask(self, points, labels, mask_input=None):
+        """mask_input 为上一次预测的低分辨率 logits，连续点击时传入可让结果逐步细化"""
         if not points or not self.is_loaded:
             return None
 
@@ -35,11 +87,14 @@ class SAMEngine:
         labels_np = np.array(labels)
 
         try:
-            masks, scores, logits = self.predictor.predict(
-                point_coords=points_np,
-                point_labels=labels_np,
-                multimask_output=False
-            )
+            with tracer.span("sam.predict_mask", points=len(points)):
+                masks, scores, logits = self.predictor.predict(
+                    point_coords=points_np,
+                    point_labels=labels_np,
+                    mask_input=mask_input,
+                    multimask_output=False
+                )
+            self.last_logits = logits
             # masks 原本是 [1, H, W] 的 bool 类型
             # 我们取 [0] 变成 [H, W]，然后转成 uint8 (0, 1)
             mask_result = masks[0].astype(np.uint8)
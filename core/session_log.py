@@ -0,0 +1,76 @@
+import os
+import json
+import time
+import hashlib
+
+import numpy as np
+
+SESSION_DIR = os.path.join(os.path.expanduser("~"), ".cache", "lisa_label", "sessions")
+SESSION_VERSION = 1
+
+# 会改变 Mask 的画布动作；其余为导航/保存等窗口动作
+CANVAS_ACTIONS = ('click', 'brush', 'rect_erase', 'polygon')
+# 不是动作，而是记录时的校验值：离开条目时 ("mask", 行号, 校验和)
+MASK_EVENT = 'mask'
+
+
+def mask_checksum(mask):
+    """Mask 的内容校验和 (只看前景/背景与尺寸)，None 时返回 None"""
+    if mask is None: return None
+    h = hashlib.blake2b(digest_size=8)
+    h.update(np.asarray(mask.shape[:2], dtype=np.int64).tobytes())
+    h.update(np.packbits(np.ascontiguousarray(mask) > 0).tobytes())
+    return h.hexdigest()
+
+
+class SessionRecorder:
+    """
+    标注会话记录，一行一个事件 (JSON 数组): [相对毫秒, 动作, 参数...]。
+    第一行是头信息 (数据集路径、模式、起始行等)，回放时据此打开同一数据集。
+    path 为 None 时只保存在内存中 (回放时用它收集校验值)。
+    """
+
+    def __init__(self, path=None, header=None):
+        self.path = path
+        self.events = []
+        self.header = dict(header or {}, version=SESSION_VERSION, started=time.strftime("%Y-%m-%d %H:%M:%S"))
+        self._t0 = time.perf_counter()
+        self._file = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._file = open(path, 'w', encoding='utf-8')
+            self._file.write(json.dumps(self.header, ensure_ascii=False) + "\n")
+
+    def record(self, action, *args):
+        event = [round((time.perf_counter() - self._t0) * 1000.0, 1), action, *args]
+        self.events.append(event)
+        if self._file is not None:
+            # 逐行刷新，程序崩溃时也保留已记录的部分
+            self._file.write(json.dumps(event, separators=(',', ':')) + "\n")
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def mask_checksums(self):
+        """[(行号, 校验和), ...]，按记录顺序"""
+        return [(e[2], e[3]) for e in self.events if e[1] == MASK_EVENT]
+
+
+def default_session_path():
+    return os.path.join(SESSION_DIR, time.strftime("session-%Y%m%d-%H%M%S.jsonl"))
+
+
+def read_session(path):
+    """返回 (header, events)；末尾写了一半的行会被忽略"""
+    with open(path, 'r', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        events = []
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                break
+    return header, events
@@ -0,0 +1,6 @@
+import hashlib
+
+
+def shard_of(item_id, num_shards):
+    """按 id 哈希分片，与条目顺序、机器无关 (导出分片与 VLM 生成分片共用)"""
+    return int(hashlib.sha1(str(item_id).encode('utf-8')).hexdigest(), 16) % num_shards
@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import threading
+import functools
+from collections import deque
+
+
+class _NullSpan:
+    """关闭追踪时返回的共享空对象，进入/退出都不做任何事"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def tag(self, **tags):
+        pass
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'tags', 't0')
+
+    def __init__(self, tracer, name, tags):
+        self.tracer = tracer
+        self.name = name
+        self.tags = tags
+
+    def __enter__(self):
+        self.t0 = time.perf_counter_ns()
+        return self
+
+    def tag(self, **tags):
+        """在 span 执行中补充标签 (如解码后才知道的图像尺寸)"""
+        self.tags.update(tags)
+
+    def __exit__(self, *exc):
+        self.tracer._record(self.name, self.t0, time.perf_counter_ns(), self.tags)
+        return False
+
+
+class Tracer:
+    """
+    轻量追踪：with tracer.span("名称", size=..., item=...) 记录一段耗时。
+    - 关闭时 span() 直接返回共享的空对象，开销只有一次函数调用
+    - 最近 max_events 个事件可导出为 Chrome trace-event JSON (chrome://tracing / Perfetto 打开)
+    - 每个名称保留最近 window 个耗时，用于实时 p50/p95
+    context 中的标签 (如当前条目 id) 会合并到之后每个 span 上。
+    """
+
+    def __init__(self, enabled=False, max_events=50000, window=200):
+        self.enabled = enabled
+        self.context = {}
+        self.window = window
+        self._events = deque(maxlen=max_events)
+        self._recent = {}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter_ns()
+
+    def span(self, name, **tags):
+        if not self.enabled: return _NULL_SPAN
+        if self.context: tags = {**self.context, **tags}
+        return _Span(self, name, tags)
+
+    def set_context(self, **tags):
+        # 整体替换而不是原地修改，工作线程读到的总是完整的一份
+        self.context = {k: v for k, v in tags.items() if v is not None}
+
+    def update_context(self, **tags):
+        self.set_context(**{**self.context, **tags})
+
+    def _record(self, name, t0, t1, tags):
+        with self._lock:
+            self._events.append((name, t0, t1 - t0, threading.get_ident(), tags))
+            recent = self._recent.get(name)
+            if recent is None: recent = self._recent[name] = deque(maxlen=self.window)
+            recent.append(t1 - t0)
+
+    def stats(self):
+        """{名称: (次数, p50 毫秒, p95 毫秒)}，基于最近 window 次"""
+        with self._lock:
+            snapshot = {name: sorted(d) for name, d in self._recent.items()}
+        result = {}
+        for name, durations in snapshot.items():
+            n = len(durations)
+            result[name] = (n, durations[n // 2] / 1e6, durations[min(n - 1, int(n * 0.95))] / 1e6)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+            self._recent.clear()
+
+    def export_chrome_trace(self, path):
+        """写出 Chrome trace-event 格式 (完整事件 ph='X'，时间单位微秒)，返回事件数"""
+        with self._lock:
+            events = list(self._events)
+        pid = os.getpid()
+        trace = [{
+            'name': name, 'cat': name.split('.', 1)[0], 'ph': 'X', 'pid': pid, 'tid': tid,
+            'ts': (t0 - self._origin) / 1000.0, 'dur': dur / 1000.0,
+            'args': {k: v if isinstance(v, (int, float, str, bool)) or v is None else str(v) for k, v in tags.items()},
+        } for name, t0, dur, tid, tags in events]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+        return len(trace)
+
+
+def traced(name):
+    """方法装饰器：整个调用记为一个 span，标签取自 tracer.context"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled: return fn(*args, **kwargs)
+            with tracer.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def image_size(arr):
+    """span 标签用的尺寸字符串 "宽x高"，None 时返回 None"""
+    if arr is None: return None
+    return f"{arr.shape[1]}x{arr.shape[0]}"
+
+
+# 全局实例；设置环境变量 LISA_TRACE=1 启动时即开启，运行中也可在界面上切换
+tracer = Tracer(enabled=os.environ.get("LISA_TRACE") == "1")
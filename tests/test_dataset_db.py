@@ -0,0 +1,94 @@
+import json
+import time
+
+import pytest
+
+from core.dataset_db import DatasetDB
+
+ITEMS = [
+    {"id": "b-2", "category": "road", "image_path_rgb": "img/2.jpg", "mask_path": "m/2.png",
+     "conversations": [{"from": "human", "value": "路在哪里？"}, {"from": "gpt", "value": "[SEG]"}]},
+    {"id": "a-1", "category": "tree", "image_path_rgb": "img/1.jpg", "training_mask_path": "m/1.png",
+     "extra": {"z": 1, "a": [1.5, None, True]}},
+]
+
+
+def _write_json(path, items):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(items, f, ensure_ascii=False, indent=4)
+    return str(path)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "data.db")
+    db = DatasetDB(path, owner="setup")
+    db.import_json(_write_json(tmp_path / "in.json", ITEMS))
+    db.close()
+    return path
+
+
+def test_import_export_round_trip(tmp_path):
+    src = _write_json(tmp_path / "in.json", ITEMS)
+    db = DatasetDB(str(tmp_path / "data.db"))
+    assert db.import_json(src) == 2
+    out = str(tmp_path / "out.json")
+    assert db.export_json(out) == 2
+    with open(src, 'rb') as a, open(out, 'rb') as b:
+        assert a.read() == b.read()
+    assert [i['id'] for i in db.list_items()] == ["b-2", "a-1"]
+    assert db.count(category="tree") == 1
+
+
+@pytest.mark.parametrize("items", [
+    ITEMS + [dict(ITEMS[0])],
+    ITEMS + [{"category": "road"}],
+    ITEMS + [{"id": "", "category": "road"}],
+])
+def test_import_rejects_missing_or_duplicate_ids(tmp_path, items):
+    db = DatasetDB(str(tmp_path / "data.db"))
+    with pytest.raises(ValueError):
+        db.import_json(_write_json(tmp_path / "in.json", items))
+    assert db.count() == 0
+
+
+def test_version_conflict_is_rejected(db_path):
+    alice = DatasetDB(db_path, owner="alice")
+    bob = DatasetDB(db_path, owner="bob")
+    _, version = alice.get_item("a-1")
+    _, stale = bob.get_item("a-1")
+    convs = [{"from": "human", "value": "hi"}]
+    new_version = alice.update_item("a-1", conversations=convs, expected_version=version)
+    assert new_version == version + 1
+    assert bob.update_item("a-1", conversations=[], expected_version=stale) is None
+    item, current = bob.get_item("a-1")
+    assert item["conversations"] == convs
+    assert current == new_version
+    # update_item 按原来的键名更新 Mask 路径
+    assert alice.update_item("a-1", mask_path="m/new.png") == new_version + 1
+    assert alice.get_item("a-1")[0]["training_mask_path"] == "m/new.png"
+
+
+def test_lease_blocks_other_owner_until_expiry(db_path):
+    alice = DatasetDB(db_path, owner="alice", lease_seconds=0.2)
+    bob = DatasetDB(db_path, owner="bob")
+    assert alice.checkout("b-2")
+    assert bob.lease_holder("b-2") == "alice"
+    assert not bob.checkout("b-2")
+    assert bob.update_item("b-2", status="done") is None
+    assert not bob.delete_item("b-2")
+    time.sleep(0.3)
+    assert bob.lease_holder("b-2") is None
+    assert bob.checkout("b-2")
+    assert bob.update_item("b-2", status="done") is not None
+    assert not alice.checkout("b-2")
+
+
+def test_checkout_next_skips_leased_items(db_path):
+    alice = DatasetDB(db_path, owner="alice")
+    bob = DatasetDB(db_path, owner="bob")
+    assert alice.checkout_next() == "b-2"
+    assert bob.checkout_next() == "a-1"
+    assert bob.checkout_next() is None
+    alice.close()
+    assert bob.checkout_next() == "b-2"
@@ -0,0 +1,44 @@
+import random
+
+import cv2
+import numpy as np
+
+from core.image_hash import BKTree, HashIndex, hamming, phash
+
+
+def test_bk_tree_query_matches_brute_force():
+    rng = random.Random(0)
+    hashes = [rng.getrandbits(64) for _ in range(300)]
+    # 加入一些近邻和完全相同的哈希
+    hashes += [h ^ (1 << rng.randrange(64)) for h in hashes[:30]] + hashes[:5]
+    tree = BKTree()
+    for i, h in enumerate(hashes):
+        tree.add(h, i)
+    for radius in (0, 3, 10):
+        for probe in hashes[:40] + [rng.getrandbits(64) for _ in range(10)]:
+            expected = sorted((hamming(probe, h), i) for i, h in enumerate(hashes) if hamming(probe, h) <= radius)
+            assert sorted(tree.query(probe, radius)) == expected
+
+
+def test_empty_tree():
+    assert BKTree().query(123, 5) == []
+
+
+def test_phash_is_stable_under_resize_and_groups_duplicates(tmp_path):
+    rng = np.random.default_rng(0)
+    base = cv2.GaussianBlur((rng.random((256, 256)) * 255).astype(np.uint8), (0, 0), 6)
+    other = cv2.GaussianBlur((rng.random((256, 256)) * 255).astype(np.uint8), (0, 0), 6)
+    small = cv2.resize(base, (128, 128), interpolation=cv2.INTER_AREA)
+    assert hamming(phash(base), phash(small)) <= 4
+
+    paths = []
+    for name, img in (("a.png", base), ("b.png", other), ("a_small.png", small)):
+        path = str(tmp_path / name)
+        cv2.imwrite(path, img)
+        paths.append(path)
+    cache = str(tmp_path / "cache" / "hash.json")
+    index = HashIndex(cache).build(paths, workers=1)
+    assert index.groups(paths) == [[paths[0], paths[2]]]
+    assert index.shape(paths[2]) == (128, 128)
+    # 缓存可以重新加载
+    assert HashIndex(cache).entries == index.entries
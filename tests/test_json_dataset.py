@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from core.json_dataset import LazyJsonDataset
+
+ITEMS = [
+    {"id": "1", "category": "道路", "image_path_rgb": "a.jpg", "mask_path": "a.png",
+     "conversations": [{"from": "human", "value": "带引号 \"和\" 逗号, 以及 ] 括号"}]},
+    {"id": "2", "category": "tree", "nested": {"list": [1, 2.5, None, False], "empty": {}}, "emoji": "🌲"},
+    {"id": "3", "raw_vlm_output": "x" * 5000},
+]
+
+
+def _dump(items):
+    return json.dumps(items, ensure_ascii=False, indent=4)
+
+
+def _write(path, text):
+    path.write_bytes(text.encode('utf-8'))
+    return str(path)
+
+
+@pytest.mark.parametrize("items", [ITEMS, [], ITEMS[:1]])
+def test_save_is_byte_equal_to_json_dump(tmp_path, items):
+    src = _write(tmp_path / "in.json", _dump(items))
+    ds = LazyJsonDataset(src)
+    assert len(ds) == len(items)
+    out = str(tmp_path / "out.json")
+    ds.save(out)
+    with open(out, 'rb') as f:
+        assert f.read() == _dump(items).encode('utf-8')
+
+
+def test_lazy_get_and_light_fields(tmp_path):
+    ds = LazyJsonDataset(_write(tmp_path / "in.json", _dump(ITEMS)))
+    assert ds[1] == {"id": "2", "category": "tree"}
+    assert ds.get_uncached(2) == ITEMS[2]
+    assert ds.get(0) == ITEMS[0]
+
+
+def test_compact_input_is_reindexed(tmp_path):
+    # 紧凑格式或其他缩进的文件也能读取，保存后统一为 indent=4
+    src = _write(tmp_path / "in.json", json.dumps(ITEMS, ensure_ascii=False, separators=(',', ':')))
+    ds = LazyJsonDataset(src)
+    assert [ds.get_uncached(i) for i in range(len(ds))] == ITEMS
+    ds.save()
+    with open(src, 'rb') as f:
+        assert f.read() == _dump(ITEMS).encode('utf-8')
+
+
+def test_edit_pop_and_save_in_place(tmp_path):
+    src = _write(tmp_path / "in.json", _dump(ITEMS))
+    ds = LazyJsonDataset(src)
+    ds.get(1)["category"] = "forest"
+    ds.pop(0)
+    ds.save()
+    expected = [dict(ITEMS[1], category="forest"), ITEMS[2]]
+    with open(src, 'rb') as f:
+        assert f.read() == _dump(expected).encode('utf-8')
+    assert ds[0]["category"] == "forest"
+    # 保存后偏移已更新，丢弃缓存后按新偏移重新读取
+    ds.evict(0)
+    assert ds.get_uncached(0) == expected[0]
+    assert ds.get_uncached(1) == expected[1]
+
+
+def test_rejects_non_array(tmp_path):
+    with pytest.raises(ValueError):
+        LazyJsonDataset(_write(tmp_path / "in.json", '{"id": 1}'))
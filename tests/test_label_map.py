@@ -0,0 +1,103 @@
+import os
+
+import cv2
+import numpy as np
+
+from core.label_map import (LABEL_ID_KEY, LABEL_MAP_KEY, entries_to_label_maps, extract_mask,
+                            label_maps_to_entries, put_mask, read_label_map, read_table)
+
+SHAPE = (40, 60)
+
+
+def _rect(y0, y1, x0, x1):
+    mask = np.zeros(SHAPE, dtype=np.uint8)
+    mask[y0:y1, x0:x1] = 1
+    return mask
+
+
+def _write_png(path, mask):
+    cv2.imwrite(str(path), mask * 255)
+    return str(path)
+
+
+def _read_png(path):
+    return (cv2.imread(path, cv2.IMREAD_GRAYSCALE) > 127).astype(np.uint8)
+
+
+def _dataset(tmp_path):
+    """两张源图：a.jpg 上三个对象 (o3 与 o1 重叠)，b.jpg 上一个对象"""
+    masks = {
+        "o1": _rect(0, 20, 0, 30),
+        "o2": _rect(25, 40, 40, 60),
+        "o3": _rect(10, 30, 20, 50),
+        "o4": _rect(5, 15, 5, 15),
+    }
+    sources = {"o1": "a.jpg", "o2": "a.jpg", "o3": "a.jpg", "o4": "b.jpg"}
+    entries = [{"id": k, "image_path_rgb": sources[k], "mask_path": _write_png(tmp_path / f"{k}.png", m)}
+               for k, m in masks.items()]
+    return entries, masks
+
+
+def test_round_trip_without_overlap(tmp_path):
+    entries, masks = _dataset(tmp_path)
+    entries = [e for e in entries if e["id"] != "o3"]
+    for fmt in ("png", "npz"):
+        stats = entries_to_label_maps(entries, str(tmp_path / fmt), fmt=fmt)
+        assert stats == {'groups': 2, 'objects': 3, 'missing': 0, 'overlapping': 0, 'removed': 0}
+        for entry in entries:
+            labels = read_label_map(entry[LABEL_MAP_KEY])
+            assert labels.dtype == np.uint16
+            assert np.array_equal(extract_mask(labels, entry[LABEL_ID_KEY]), masks[entry["id"]])
+            assert read_table(entry[LABEL_MAP_KEY])[entry["id"]] == entry[LABEL_ID_KEY]
+        assert label_maps_to_entries(entries) == 3
+        assert all(LABEL_MAP_KEY not in e for e in entries)
+
+
+def test_overlapping_objects_keep_their_pngs(tmp_path):
+    entries, masks = _dataset(tmp_path)
+    stats = entries_to_label_maps(entries, str(tmp_path / "labels"), remove_pngs=True)
+    assert stats['overlapping'] == 1
+    assert stats['objects'] == 3
+    by_id = {e["id"]: e for e in entries}
+    # 与 o1 重叠的 o3 不进标签图；a.jpg 整组 PNG 保留，b.jpg 的 PNG 已删除
+    assert LABEL_MAP_KEY not in by_id["o3"]
+    assert all(os.path.exists(by_id[k]["mask_path"]) for k in ("o1", "o2", "o3"))
+    assert not os.path.exists(by_id["o4"]["mask_path"])
+    assert stats['removed'] == 1
+
+    assert label_maps_to_entries(entries) == 3
+    for entry in entries:
+        assert np.array_equal(_read_png(entry["mask_path"]), masks[entry["id"]])
+
+
+def test_shared_mask_path_is_removed_once_and_kept_while_referenced(tmp_path):
+    shared = _write_png(tmp_path / "shared.png", _rect(0, 10, 0, 10))
+    entries = [
+        {"id": "x", "image_path_rgb": "c.jpg", "mask_path": shared},
+        {"id": "y", "image_path_rgb": "d.jpg", "mask_path": shared},
+    ]
+    stats = entries_to_label_maps(entries, str(tmp_path / "labels"), remove_pngs=True)
+    assert stats['objects'] == 2
+    assert stats['removed'] == 1
+    assert not os.path.exists(shared)
+
+    # 同一源图中两个条目共用一个 PNG：第二个与第一个完全重叠，仍被引用，不能删除
+    shared = _write_png(tmp_path / "shared2.png", _rect(0, 10, 0, 10))
+    entries = [
+        {"id": "x", "image_path_rgb": "e.jpg", "mask_path": shared},
+        {"id": "y", "image_path_rgb": "e.jpg", "mask_path": shared},
+    ]
+    stats = entries_to_label_maps(entries, str(tmp_path / "labels2"), remove_pngs=True)
+    assert stats['overlapping'] == 1
+    assert os.path.exists(shared)
+
+
+def test_put_mask_does_not_overwrite_other_objects():
+    labels = np.zeros(SHAPE, dtype=np.uint16)
+    labels[_rect(0, 20, 0, 30) > 0] = 1
+    labels[_rect(30, 40, 0, 10) > 0] = 2
+    other = labels == 1
+    dropped = put_mask(labels, 2, _rect(10, 30, 20, 50))
+    assert dropped == 10 * 10
+    assert np.array_equal(labels == 1, other)
+    assert np.array_equal(extract_mask(labels, 2), _rect(10, 30, 20, 50) & (1 - _rect(0, 20, 0, 30)))
@@ -0,0 +1,80 @@
+import os
+
+import cv2
+import numpy as np
+
+from core.mask_store import MaskStore, read_located
+
+
+def _random_mask(seed, shape=(37, 53)):
+    return (np.random.default_rng(seed).random(shape) > 0.5).astype(np.uint8)
+
+
+def test_put_get_round_trip(tmp_path):
+    store = MaskStore(str(tmp_path / "store"))
+    mask = _random_mask(0)
+    store.write("a/1.jpg", mask, "文本")
+    got, text = store.read("a/1.jpg")
+    assert np.array_equal(got, mask)
+    assert text == "文本"
+    assert store.read("missing.jpg") == (None, None)
+    assert np.array_equal(read_located(store.locate("a/1.jpg")), mask)
+
+
+def test_reopen_keeps_latest_write(tmp_path):
+    store_dir = str(tmp_path / "store")
+    store = MaskStore(store_dir)
+    store.write("k.jpg", _random_mask(1), "old")
+    newer = _random_mask(2)
+    store.write("k.jpg", newer, "new")
+    reopened = MaskStore(store_dir)
+    got, text = reopened.read("k.jpg")
+    assert np.array_equal(got, newer)
+    assert text == "new"
+    assert len(reopened) == 1
+
+
+def test_torn_index_line_is_ignored(tmp_path):
+    store_dir = str(tmp_path / "store")
+    store = MaskStore(store_dir)
+    store.write("k.jpg", _random_mask(3), "")
+    with open(os.path.join(store_dir, "shard_00000.idx"), 'a', encoding='utf-8') as f:
+        f.write('{"key": "half')
+    assert MaskStore(store_dir).keys() == ["k.jpg"]
+
+
+def test_shard_rollover(tmp_path):
+    store = MaskStore(str(tmp_path / "store"), max_shard_bytes=1)
+    masks = {f"{i}.jpg": _random_mask(i) for i in range(3)}
+    for key, mask in masks.items():
+        store.write(key, mask)
+    assert len({store.index[k][0] for k in masks}) == 3
+    for key, mask in masks.items():
+        assert np.array_equal(store.read(key)[0], mask)
+
+
+def test_compaction_drops_overwritten_records(tmp_path):
+    store_dir = str(tmp_path / "store")
+    store = MaskStore(store_dir)
+    for i in range(5):
+        store.write("k.jpg", _random_mask(i), str(i))
+    store.write("other.jpg", _random_mask(10), "x")
+    before = sum(os.path.getsize(os.path.join(store_dir, f)) for f in os.listdir(store_dir))
+    store.compact()
+    after = sum(os.path.getsize(os.path.join(store_dir, f)) for f in os.listdir(store_dir))
+    assert after < before
+    for s in (store, MaskStore(store_dir)):
+        assert np.array_equal(s.read("k.jpg")[0], _random_mask(4))
+        assert s.read("k.jpg")[1] == "4"
+        assert np.array_equal(s.read("other.jpg")[0], _random_mask(10))
+    assert not os.path.exists(store_dir + ".compact")
+    assert not os.path.exists(store_dir + ".old")
+
+
+def test_export_png(tmp_path):
+    store = MaskStore(str(tmp_path / "store"))
+    mask = _random_mask(5)
+    store.write("sub/img.jpg", mask)
+    paths = store.export_png(str(tmp_path / "out"))
+    assert paths == [str(tmp_path / "out" / "sub" / "img_mask.png")]
+    assert np.array_equal(cv2.imread(paths[0], cv2.IMREAD_GRAYSCALE), mask * 255)
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import utils.qwen_vl_generte as gen
+from core.sharding import shard_of
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    """time.monotonic 与 asyncio.sleep 换成虚拟时钟，sleep 直接推进时间"""
+    clock = [0.0]
+
+    async def fake_sleep(delay, *args):
+        clock[0] += max(0.0, delay)
+
+    monkeypatch.setattr(gen.time, 'monotonic', lambda: clock[0])
+    monkeypatch.setattr(gen.asyncio, 'sleep', fake_sleep)
+    return clock
+
+
+def test_token_bucket_allows_burst_then_limits_rate(fake_clock):
+    async def main():
+        bucket = gen.TokenBucket(rate=10.0, capacity=5)
+        for _ in range(5):
+            await bucket.acquire()
+        assert fake_clock[0] == 0.0
+        await asyncio.gather(*(bucket.acquire() for _ in range(20)))
+
+    asyncio.run(main())
+    assert fake_clock[0] == pytest.approx(2.0)
+
+
+def test_token_bucket_refills_while_idle(fake_clock):
+    async def main():
+        bucket = gen.TokenBucket(rate=2.0, capacity=4)
+        for _ in range(4):
+            await bucket.acquire()
+        fake_clock[0] += 100.0  # 空闲很久也只攒满 capacity 个
+        start = fake_clock[0]
+        for _ in range(6):
+            await bucket.acquire()
+        return fake_clock[0] - start
+
+    assert asyncio.run(main()) == pytest.approx(1.0)
+
+
+def _entry(item_id):
+    return {"id": item_id, "conversations": [{"from": "human", "value": f"第 {item_id} 条"}]}
+
+
+def test_jsonl_resume_after_torn_write(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    writer = gen.JsonlWriter(path)
+    for item_id in ("a", "b", "c"):
+        writer.append(_entry(item_id))
+    writer.close()
+    with open(path, 'ab') as f:
+        f.write(b'{"id": "d", "conv')  # 进程在写这一条时被杀
+    assert gen.scan_ids(path) == {"a", "b", "c"}
+
+    # 旁路索引丢失或与记录数不一致时按记录重建
+    os.remove(gen.ids_path(path))
+    assert gen.scan_ids(path) == {"a", "b", "c"}
+    with open(gen.ids_path(path), 'a', encoding='utf-8') as f:
+        f.write('"ghost"\n')
+    assert gen.scan_ids(path) == {"a", "b", "c"}
+
+    writer = gen.JsonlWriter(path)
+    writer.append(_entry("d"))
+    writer.close()
+    out = str(tmp_path / "out.json")
+    assert gen.jsonl_to_json(path, out) == 4
+    with open(out, 'r', encoding='utf-8') as f:
+        text = f.read()
+    assert text == json.dumps([_entry(i) for i in "abcd"], ensure_ascii=False, indent=4)
+
+
+def test_merge_drops_duplicates(tmp_path):
+    paths = []
+    for n, ids in enumerate((("a", "b"), ("b", "c"))):
+        path = str(tmp_path / f"part{n}.jsonl")
+        writer = gen.JsonlWriter(path)
+        for item_id in ids:
+            writer.append(_entry(item_id))
+        writer.close()
+        paths.append(path)
+    written, duplicates = gen.merge_jsonl(paths, str(tmp_path / "merged.json"))
+    assert written == {"a", "b", "c"} and duplicates == 1
+
+
+@pytest.fixture
+def generator_env(tmp_path, monkeypatch):
+    """离线运行 run()：模型请求换成计数的假函数，缓存目录放到临时目录"""
+    monkeypatch.setattr(gen, 'PAYLOAD_CACHE_DIR', str(tmp_path / "payload"))
+    monkeypatch.setattr(gen, 'RESPONSE_CACHE_DIR', str(tmp_path / "responses"))
+    monkeypatch.setattr(gen, 'REGENERATE', False)
+    monkeypatch.setattr(gen, 'BATCH_MODE', False)
+    calls = []
+
+    async def fake_caption(client, limiter, base64_image, category):
+        calls.append(category)
+        return {"simple_instruction": f"The {category}", "spatial_instruction": f"The left {category}",
+                "complex_instruction": f"The big {category}", "reasoning": "test"}
+
+    monkeypatch.setattr(gen, 'generate_caption_with_retry', fake_caption)
+
+    items = []
+    for i in range(5):
+        img_path = str(tmp_path / f"{i}.jpg")
+        cv2.imwrite(img_path, np.full((16, 16, 3), i * 40, dtype=np.uint8))
+        items.append({"id": f"obj_{i}", "category": "car", "visual_prompt_path": img_path,
+                      "image_path_4c": f"{i}.npy", "training_mask_path": f"{i}_mask.png", "bbox": [0, 0, 4, 4]})
+    metadata = str(tmp_path / "step1_metadata.json")
+    with open(metadata, 'w', encoding='utf-8') as f:
+        json.dump(items, f)
+    return metadata, str(tmp_path / "step2.json"), items, calls
+
+
+def test_run_resumes_without_repeating_requests(generator_env):
+    metadata, output, items, calls = generator_env
+    asyncio.run(gen.run(metadata, output, limit=2))
+    assert len(calls) == 2
+    asyncio.run(gen.run(metadata, output, limit=0))
+    assert len(calls) == 5
+    asyncio.run(gen.run(metadata, output, limit=0))
+    assert len(calls) == 5
+    with open(output, 'r', encoding='utf-8') as f:
+        result = json.load(f)
+    assert sorted(e["id"] for e in result) == [item["id"] for item in items]
+
+
+def test_sharded_runs_merge_to_full_coverage(generator_env, tmp_path):
+    metadata, output, items, calls = generator_env
+    paths = []
+    for shard in range(2):
+        asyncio.run(gen.run(metadata, output, shard=shard, num_shards=2, limit=0))
+        paths.append(gen.shard_output_path(output, shard, 2))
+        assert gen.scan_ids(paths[-1]) == {i["id"] for i in items if shard_of(i["id"], 2) == shard}
+    assert len(calls) == len(items)
+    report = gen.merge(metadata, output, paths, num_shards=2)
+    assert report['coverage'] == 1.0
+    assert report['duplicates'] == 0
+    assert report['missing_per_shard'] == {0: 0, 1: 0}
@@ -1,33 +1,96 @@
 import os
 import cv2
-import json
+import hashlib
+import sqlite3
+import threading
+import multiprocessing
 import numpy as np
 from PyQt6.QtWidgets import (QMainWindow, QVBoxLayout, QHBoxLayout, QWidget,
                              QFileDialog, QListWidget, QPushButton, QTextEdit,
-                             QLabel, QSplitter, QMessageBox, QFrame, QGroupBox,
+                             QLabel, QSplitter, QMessageBox, QGroupBox,
                              QRadioButton, QButtonGroup, QSlider, QSpinBox,
-                             QGridLayout)  # <--- 新增 QGridLayout
-from PyQt6.QtCore import pyqtSlot, Qt
-from pathlib import Path
+                             QGridLayout, QCheckBox, QComboBox, QStackedWidget)  # <--- 新增 QGridLayout
+from PyQt6.QtCore import pyqtSlot, pyqtSignal, Qt, QTimer
+from PyQt6.QtGui import QColor
 
 # 确保引入的是修改过支持 set_preview_mask 的 Canvas
 from ui.widgets.canvas import InteractiveCanvas
+from ui.widgets.review_grid import ReviewGrid
 from core.sam_engine import SAMEngine
 from core.data_manager import DataManager
+from core.image_loader import ImageLoader
+from core.raster_reader import COMPOSITES, open_raster
+from core.dataset_db import DatasetDB
+from core.json_dataset import LazyJsonDataset
+from core.async_writer import AsyncWriter
+from core.label_map import LABEL_MAP_KEY, LABEL_ID_KEY, extract_mask, put_mask, remove_object, write_label_map
+from core.image_hash import CACHE_DIR as HASH_CACHE_DIR, HashIndex
+from core.tracing import tracer, traced, image_size
+from core.memory import MB, format_bytes, memory
+from core.interaction_store import InteractionStore
+from core.review_thumbs import ReviewThumbnailer
+from core.mask_postprocess import postprocess
+from core.session_log import MASK_EVENT, SessionRecorder, default_session_path, mask_checksum
 # from utils.translate import BaiduTranslator # 根据实际情况取消注释
 from utils.aiTranslate import BaiduTranslator
 
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    # 工作线程加载完成后通过信号回到 GUI 线程: generation, image, mask
+    item_loaded_signal = pyqtSignal(int, object, object)
+    thumbnail_loaded_signal = pyqtSignal(int, object)
+    sam_ready_signal = pyqtSignal(int)
+    # 后台目录扫描: generation, [(相对路径, 是否已有 Mask), ...]
+    scan_batch_signal = pyqtSignal(int, list)
+    scan_done_signal = pyqtSignal(int)
+    # 后台查重: generation, (HashIndex, [[路径, ...], ...])
+    duplicates_signal = pyqtSignal(int, object)
+    # 后台写盘失败: 条目 key, 错误信息
+    write_failed_signal = pyqtSignal(object, str)
+
+    # 选中项保持不变这么久之后才开始完整加载 (毫秒)
+    ITEM_SWITCH_DELAY_MS = 150
+    # 状态栏追踪统计的刷新间隔 (毫秒) 与显示的 span 数
+    TRACE_STATUS_INTERVAL_MS = 1000
+    TRACE_STATUS_TOP = 4
+    MEMORY_PANEL_INTERVAL_MS = 1000
+
+    def __init__(self, sam_engine=None):
         super().__init__()
         self.setWindowTitle("LISA Annotator (SAM)")
         self.resize(1400, 900)
 
         # 1. 初始化后端逻辑模块
         self.data_manager = DataManager()
-        # 请确保路径正确，且文件已下载
-        self.sam_engine = SAMEngine(checkpoint_path="checkpoints/sam_vit_b_01ec64.pth")
+        self.image_loader = ImageLoader(max_bytes=1024 * 1024 * 1024, num_workers=4, read_ahead=3)
+        self.async_writer = AsyncWriter(on_error=lambda tag, e: self.write_failed_signal.emit(tag, str(e)))
+        self._write_failures = []  # 尚未提示的写盘失败 [(key, 错误信息), ...]
+        # 网格审阅的缩略图在子进程中渲染 (spawn，避免 fork 带上 Qt 状态)
+        self.review_thumbnailer = ReviewThumbnailer(mp_context=multiprocessing.get_context('spawn'))
+        self._load_generation = 0
+        self._sam_generation = 0
+        self._sam_ready = False
+        self._pending_index = -1
+        self._pending_paths = (None, None)
+        self._pending_translation = ""
+        self._loaded_index = -1  # 已完整加载 (可编辑) 的条目
+        self._scan_generation = 0
+        self._dup_generation = 0
+        self._dup_index = None  # 最近一次查重的 HashIndex
+        self._dup_groups = []  # [[行号, ...], ...]
+        self._dup_group_of = {}  # 行号 -> 组号
+        self.session_recorder = None  # 会话记录 (Ctrl+Shift+R)，见 utils/replay_session.py
+        self.interaction_store = None  # 未提交的 SAM 交互状态，按数据集打开
+        self.persist_interactions = True  # 回放等场景关闭，避免读到上次会话残留的状态
+        self._loaded_key = None  # 已完整加载条目的 key (文件夹模式为相对路径，JSON 模式为 id)
+        self._interaction_dirty = False  # 交互状态自上次保存/存档后是否有变化
+
+        self._switch_timer = QTimer(self)
+        self._switch_timer.setSingleShot(True)
+        self._switch_timer.setInterval(self.ITEM_SWITCH_DELAY_MS)
+        self._switch_timer.timeout.connect(self._start_item_load)
+        # 请确保路径正确，且文件已下载 (基准测试 / 回放可传入自己的引擎)
+        self.sam_engine = sam_engine or SAMEngine(checkpoint_path="checkpoints/sam_vit_b_01ec64.pth")
 
         # --- 交互状态缓存 (State) ---
         self.current_image = None
@@ -35,14 +98,26 @@ class MainWindow(QMainWindow):
         self.sam_mask = None  # 临时层：SAM 当前预测的 Mask (显示为绿色)
         self.input_points = []
         self.input_labels = []
+        self.sam_logits = None  # 最近一次 SAM 预测的低分辨率 logits，下一次点击作为 mask_input
         self.current_mask = None
+        self.current_raster = None  # 当前条目的 4 通道栅格 (RasterReader)
 
         # --- 画笔设置 ---
         self.brush_radius = 10  # 默认画笔半径
 
         # --- JSON 数据模式状态 ---
-        self.json_data = []
+        self.json_data = []  # JSON 文件: LazyJsonDataset；SQLite: 轻量字段列表，均在选中时才读取完整条目
         self.json_path = None
+        self.dataset_db = None  # 打开 .db 时的 SQLite 后端
+        self._current_item = None  # 当前条目的完整内容
+        self._current_item_version = None
+        self._materialized_index = -1
+        self._item_readonly = False  # 条目被其他标注员占用时只读
+
+        # --- 脏标记：没有修改的条目切换时不写盘 ---
+        self._loaded_mask_digest = None  # 加载时 Mask 的内容哈希
+        self._text_dirty = False
+        self._json_file_dirty = False  # 删除条目等需要重写 JSON 文件的修改
         self.json_current_index = -1
         self.current_mode = "folder"  # "folder" 或 "json"
 
@@ -61,6 +136,25 @@ class MainWindow(QMainWindow):
         self.canvas.rect_erase_signal.connect(self.handle_rect_erase)
         self.canvas.brush_signal.connect(self.handle_brush_paint)
         self.canvas.polygon_signal.connect(self.handle_polygon_fill)
+        self.text_editor.textChanged.connect(self._on_text_edited)
+        self.item_loaded_signal.connect(self._on_item_loaded)
+        self.thumbnail_loaded_signal.connect(self._on_thumbnail_loaded)
+        self.sam_ready_signal.connect(self._on_sam_ready)
+        self.scan_batch_signal.connect(self._on_scan_batch)
+        self.scan_done_signal.connect(self._on_scan_done)
+        self.duplicates_signal.connect(self._on_duplicates_found)
+        self.write_failed_signal.connect(self._on_write_failed)
+
+        # 追踪统计 (LISA_TRACE=1 启动或 Ctrl+Shift+T 开启)
+        self._trace_timer = QTimer(self)
+        self._trace_timer.setInterval(self.TRACE_STATUS_INTERVAL_MS)
+        self._trace_timer.timeout.connect(self._update_trace_status)
+        if tracer.enabled: self._trace_timer.start()
+
+        self._memory_timer = QTimer(self)
+        self._memory_timer.setInterval(self.MEMORY_PANEL_INTERVAL_MS)
+        self._memory_timer.timeout.connect(self._update_memory_panel)
+        self._memory_timer.start()
 
     def init_ui(self):
         """初始化界面布局"""
@@ -92,12 +186,60 @@ class MainWindow(QMainWindow):
         self.btn_load_dir.setStyleSheet("height: 40px; font-weight: bold;")
         left_layout.addWidget(self.btn_load_dir)
 
+        # 文件夹扫描选项
+        self.folder_options_widget = QWidget()
+        folder_opts_layout = QHBoxLayout(self.folder_options_widget)
+        folder_opts_layout.setContentsMargins(0, 0, 0, 0)
+        self.chk_recursive = QCheckBox("包含子目录")
+        self.chk_unannotated = QCheckBox("仅未标注")
+        self.chk_unannotated.toggled.connect(self.on_unannotated_filter_changed)
+        folder_opts_layout.addWidget(self.chk_recursive)
+        folder_opts_layout.addWidget(self.chk_unannotated)
+        self.btn_export_png = QPushButton("导出PNG")
+        self.btn_export_png.setToolTip("把分片存储中的 Mask 导出为逐文件 <名称>_mask.png")
+        self.btn_export_png.clicked.connect(self.export_mask_pngs_action)
+        folder_opts_layout.addWidget(self.btn_export_png)
+        left_layout.addWidget(self.folder_options_widget)
+
         self.btn_load_json = QPushButton("📄 加载 JSON")
         self.btn_load_json.clicked.connect(self.load_json_action)
         self.btn_load_json.setStyleSheet("height: 40px; font-weight: bold;")
         self.btn_load_json.setVisible(False)
         left_layout.addWidget(self.btn_load_json)
 
+        # SQLite 数据集：导入 / 导出
+        self.db_options_widget = QWidget()
+        db_opts_layout = QHBoxLayout(self.db_options_widget)
+        db_opts_layout.setContentsMargins(0, 0, 0, 0)
+        self.btn_import_db = QPushButton("📥 JSON→SQLite")
+        self.btn_import_db.setToolTip("把 JSON 数据集导入 SQLite，多人可同时标注")
+        self.btn_import_db.clicked.connect(self.import_json_to_db_action)
+        self.btn_export_db = QPushButton("📤 导出 JSON")
+        self.btn_export_db.clicked.connect(self.export_db_json_action)
+        db_opts_layout.addWidget(self.btn_import_db)
+        db_opts_layout.addWidget(self.btn_export_db)
+        self.db_options_widget.setVisible(False)
+        left_layout.addWidget(self.db_options_widget)
+
+        # 重复 / 近似重复图像
+        dup_layout = QHBoxLayout()
+        self.btn_find_dups = QPushButton("🔍 查找重复")
+        self.btn_find_dups.setToolTip("按感知哈希把重复和近似重复的图像分组标记")
+        self.btn_find_dups.clicked.connect(self.find_duplicates_action)
+        self.btn_reuse_mask = QPushButton("📋 Mask 复用到同组")
+        self.btn_reuse_mask.setToolTip("把当前 Mask 写到同组中尺寸相同的其他图像")
+        self.btn_reuse_mask.clicked.connect(self.reuse_mask_action)
+        dup_layout.addWidget(self.btn_find_dups)
+        dup_layout.addWidget(self.btn_reuse_mask)
+        left_layout.addLayout(dup_layout)
+
+        # 网格审阅：整个列表以 图像+Mask 缩略图 平铺，双击回到该条目
+        self.btn_review_grid = QPushButton("🔳 网格审阅")
+        self.btn_review_grid.setCheckable(True)
+        self.btn_review_grid.setToolTip("以缩略图网格浏览全部条目的标注结果，双击进入编辑")
+        self.btn_review_grid.toggled.connect(self.toggle_review_grid)
+        left_layout.addWidget(self.btn_review_grid)
+
         # 统计标签
         self.stats_label = QLabel("共 0 条数据")
         left_layout.addWidget(self.stats_label)
@@ -106,8 +248,13 @@ class MainWindow(QMainWindow):
         self.file_list_widget = QListWidget()
         left_layout.addWidget(self.file_list_widget)
 
-        # === 中间面板：画布 ===
+        # === 中间面板：画布 / 审阅网格 ===
         self.canvas = InteractiveCanvas()
+        self.review_grid = ReviewGrid(self.review_thumbnailer)
+        self.review_grid.item_activated.connect(self._on_review_item_activated)
+        self.center_stack = QStackedWidget()
+        self.center_stack.addWidget(self.canvas)
+        self.center_stack.addWidget(self.review_grid)
 
         # === 右侧面板：控制与信息 ===
         right_panel = QWidget()
@@ -120,6 +267,16 @@ class MainWindow(QMainWindow):
         self.meta_text.setReadOnly(True)
         self.meta_text.setMaximumHeight(120)
         meta_layout.addWidget(self.meta_text)
+
+        # 4 通道 (RGB+NIR) 数据的显示方式，只影响底图显示，SAM 仍使用 RGB 图像
+        composite_layout = QHBoxLayout()
+        composite_layout.addWidget(QLabel("显示波段:"))
+        self.combo_composite = QComboBox()
+        self.combo_composite.addItems(list(COMPOSITES))
+        self.combo_composite.setEnabled(False)
+        self.combo_composite.currentTextChanged.connect(self._apply_composite)
+        composite_layout.addWidget(self.combo_composite)
+        meta_layout.addLayout(composite_layout)
         right_layout.addWidget(meta_group)
 
         # 操作说明
@@ -221,6 +378,17 @@ class MainWindow(QMainWindow):
         action_layout.addWidget(self.btn_sub_mask)
         right_layout.addLayout(action_layout)
 
+        # Mask 清理：合并时自动去噪点/补针孔，或对整个 Mask 手动清理
+        clean_layout = QHBoxLayout()
+        self.chk_auto_clean = QCheckBox("合并时自动清理")
+        self.chk_auto_clean.setChecked(True)
+        self.chk_auto_clean.toggled.connect(lambda on: self._record('auto_clean', on))
+        self.btn_clean_mask = QPushButton("✨ 清理 Mask")
+        self.btn_clean_mask.clicked.connect(self.cleanup_mask_action)
+        clean_layout.addWidget(self.chk_auto_clean)
+        clean_layout.addWidget(self.btn_clean_mask)
+        right_layout.addLayout(clean_layout)
+
         # 文本输入区域
         lbl_text = QLabel("对话/推理文本:")
         self.text_editor = QTextEdit()
@@ -246,6 +414,24 @@ class MainWindow(QMainWindow):
         right_layout.addWidget(lbl_translated)
         right_layout.addWidget(self.translated_text)
 
+        # 内存占用：各类缓冲区与缓存的实时字节数，超出预算时缓存自动淘汰
+        memory_group = QGroupBox("内存")
+        memory_layout = QVBoxLayout(memory_group)
+        self.memory_label = QLabel()
+        self.memory_label.setStyleSheet("font-family: monospace;")
+        memory_layout.addWidget(self.memory_label)
+        budget_layout = QHBoxLayout()
+        budget_layout.addWidget(QLabel("预算:"))
+        self.spin_memory_budget = QSpinBox()
+        self.spin_memory_budget.setRange(256, 256 * 1024)
+        self.spin_memory_budget.setSingleStep(256)
+        self.spin_memory_budget.setSuffix(" MB")
+        self.spin_memory_budget.setValue(memory.budget // MB)
+        self.spin_memory_budget.valueChanged.connect(self.set_memory_budget)
+        budget_layout.addWidget(self.spin_memory_budget)
+        memory_layout.addLayout(budget_layout)
+        right_layout.addWidget(memory_group)
+
         right_layout.addStretch()
 
         # 导航按钮
@@ -274,11 +460,15 @@ class MainWindow(QMainWindow):
         right_layout.addWidget(self.btn_save)
 
         splitter.addWidget(left_panel)
-        splitter.addWidget(self.canvas)
+        splitter.addWidget(self.center_stack)
         splitter.addWidget(right_panel)
         splitter.setSizes([250, 800, 350])
         main_layout.addWidget(splitter)
 
+        # 状态栏：追踪开启时显示各 span 最近的 p50/p95
+        self.trace_label = QLabel()
+        self.statusBar().addPermanentWidget(self.trace_label)
+
     # ==========================
     # 模式切换
     # ==========================
@@ -288,12 +478,30 @@ class MainWindow(QMainWindow):
         if self.radio_folder.isChecked():
             self.current_mode = "folder"
             self.btn_load_dir.setVisible(True)
+            self.folder_options_widget.setVisible(True)
             self.btn_load_json.setVisible(False)
+            self.db_options_widget.setVisible(False)
         else:
             self.current_mode = "json"
             self.btn_load_dir.setVisible(False)
+            self.folder_options_widget.setVisible(False)
             self.btn_load_json.setVisible(True)
-
+            self.db_options_widget.setVisible(True)
+
+        self._switch_timer.stop()
+        self._stop_recording()
+        self.btn_review_grid.setChecked(False)
+        self._close_interaction_store()
+        self._scan_generation += 1
+        self._clear_duplicates()
+        self._close_dataset_db()
+        self.json_data = []
+        self.json_path = None
+        self.json_current_index = -1
+        self.image_loader.cancel_pending()
+        self.sam_engine.cancel_pending()
+        self._loaded_index = -1
+        self.current_image = None
         self.file_list_widget.clear()
         self.stats_label.setText("共 0 条数据")
         self.canvas.set_image(None)
@@ -304,6 +512,8 @@ class MainWindow(QMainWindow):
         self.translated_text.clear()
         self.base_mask = None
         self.sam_mask = None
+        self.current_mask = None
+        self._account_buffers()
 
     # ==========================
     # 文件夹模式
@@ -311,102 +521,404 @@ class MainWindow(QMainWindow):
 
     def load_folder_action(self):
         folder = QFileDialog.getExistingDirectory(self, "选择数据集目录")
-        if folder:
-            files = self.data_manager.load_directory(folder)
-            self.file_list_widget.clear()
-            self.file_list_widget.addItems(files)
-            self.stats_label.setText(f"共 {len(files)} 条数据")
-            if files: self.file_list_widget.setCurrentRow(0)
+        if folder: self.open_folder(folder)
+
+    def open_folder(self, folder):
+        # 扫描在后台线程进行，每扫完一批就追加到列表，不阻塞界面
+        self._stop_recording()
+        # 上一个目录排队中的保存先落盘，再替换 MaskStore
+        self.async_writer.flush()
+        self.btn_review_grid.setChecked(False)
+        self._open_interaction_store(folder)
+        self._scan_generation += 1
+        self._clear_duplicates()
+        scanner = self.data_manager.begin_directory(folder, recursive=self.chk_recursive.isChecked())
+        self.file_list_widget.clear()
+        self.stats_label.setText("扫描中...")
+        threading.Thread(target=self._scan_worker, args=(self._scan_generation, scanner), daemon=True).start()
+
+    def _scan_worker(self, generation, scanner):
+        for batch in scanner.scan():
+            if generation != self._scan_generation:
+                scanner.cancel()
+                return
+            self.scan_batch_signal.emit(generation, batch)
+        self.scan_done_signal.emit(generation)
+
+    @pyqtSlot(int, list)
+    def _on_scan_batch(self, generation, batch):
+        if generation != self._scan_generation: return
+        visible = self.data_manager.add_scan_batch(batch)
+        was_empty = self.file_list_widget.count() == 0
+        self.file_list_widget.addItems(visible)
+        self.stats_label.setText(f"扫描中... 已找到 {len(self.data_manager.file_list)} 条数据")
+        if was_empty and visible: self.file_list_widget.setCurrentRow(0)
+
+    @pyqtSlot(int)
+    def _on_scan_done(self, generation):
+        if generation != self._scan_generation: return
+        self._update_folder_stats()
+
+    def _update_folder_stats(self):
+        dm = self.data_manager
+        self.stats_label.setText(f"共 {len(dm.file_list)} 条数据 (已标注 {len(dm.annotated)}/{len(dm.all_files)})")
+
+    def export_mask_pngs_action(self):
+        if not self.data_manager.root_dir: return
+        out_dir = QFileDialog.getExistingDirectory(self, "选择导出目录", self.data_manager.root_dir)
+        if not out_dir: return
+        try:
+            # 队列中尚未落盘的保存也要导出
+            self.async_writer.flush()
+            paths = self.data_manager.export_mask_pngs(out_dir)
+            QMessageBox.information(self, "成功", f"已导出 {len(paths)} 个 Mask")
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"导出失败: {e}")
+
+    def on_unannotated_filter_changed(self, checked):
+        files = self.data_manager.set_unannotated_only(checked)
+        if self.current_mode != "folder" or not self.data_manager.root_dir: return
+        self._clear_duplicates()
+        self.file_list_widget.clear()
+        self.file_list_widget.addItems(files)
+        self._update_folder_stats()
+        if files: self.file_list_widget.setCurrentRow(0)
 
     def on_file_selected(self, index):
+        """
+        切换条目分两个阶段：
+        1. 立即显示列表行、元信息、文本和缩略图 (只读缓存或低分辨率解码)
+        2. 选中项稳定 ITEM_SWITCH_DELAY_MS 后，才开始完整解码、SAM 编码和翻译
+        长按方向键时，被跳过的条目只会经历第一阶段，未开始的任务全部取消。
+        """
         if index < 0: return
+        if self.session_recorder is not None:
+            self._record_mask_checksum()
+            self._record('select', index)
+        self._stash_interaction()
+        self._switch_timer.stop()
+        self.image_loader.cancel_pending()
+        self.sam_engine.cancel_pending()
+        self._loaded_index = -1
+        self._sam_ready = False
+        self.current_image = None
+        self.base_mask = None
+        self.sam_mask = None
+        self.sam_logits = None
+        self.input_points = []
+        self.input_labels = []
+        self.current_raster = None
+        self.combo_composite.setEnabled(False)
+        self.canvas.set_mask(None)
+        self.canvas.set_preview_mask(None)
+        self._account_buffers()
+
         if self.current_mode == "folder":
-            self._load_folder_item(index)
+            self._preview_folder_item(index)
         else:
-            self._load_json_item(index)
+            self._preview_json_item(index)
+        if tracer.enabled: tracer.set_context(item=self._item_key(index))
 
-    def _load_folder_item(self, index):
+        img_path = self._pending_paths[0]
+        thumb = self.image_loader.thumb_cache.get(img_path) if img_path else None
+        if thumb is not None:
+            self.canvas.set_image(thumb)
+        else:
+            self.canvas.set_image(None)
+            if img_path: self.image_loader.request_thumbnail(img_path, self.thumbnail_loaded_signal.emit)
+
+        self._pending_index = index
+        self._switch_timer.start()
+
+    @pyqtSlot(int, object)
+    def _on_thumbnail_loaded(self, generation, thumb):
+        # 完整图像已经显示或已切到别的条目时，不再用缩略图覆盖
+        if self._loaded_index >= 0 or not self.image_loader.is_current(generation): return
+        self.canvas.set_image(thumb)
+
+    def _start_item_load(self):
+        """防抖定时器到期：选中项已稳定，开始完整加载"""
+        index = self._pending_index
+        if index != self.file_list_widget.currentRow(): return
+        img_path, mask_path = self._pending_paths
+        if self.current_mode == "folder":
+            prefetch = self._folder_prefetch_paths(index)
+        else:
+            prefetch = self._json_prefetch_paths(index)
+            self._checkout_current_item()
+            if self._pending_translation: self._auto_translate(self._pending_translation)
+        self._request_item(img_path, mask_path, prefetch)
+
+    def _preview_folder_item(self, index):
         self.data_manager.current_index = index
         img_path, json_path = self.data_manager.get_current_data()
-        if not img_path: return
-        img = cv2.imread(img_path)
+        self._pending_paths = (img_path, self.data_manager.get_legacy_mask_path(img_path))
+        self._pending_translation = ""
+        self.meta_text.setPlainText(f"文件: {img_path}")
+        # 文本存放在 MaskStore 的索引里，读取不涉及磁盘
+        text = self.data_manager.load_annotation_text()
+        self._set_editor_text(text or "")
+
+    def _show_folder_item(self, img, mask):
         if img is None: return
         self.current_image = img
         self.canvas.set_image(img)
-        self.sam_engine.set_image(img)
+        self._start_sam_encoding(img)
         h, w = img.shape[:2]
         self.base_mask = np.zeros((h, w), dtype=np.uint8)
+        # 优先使用分片存储中的 Mask，没有时兼容旧的 <名称>_mask.png
+        stored_mask, _ = self.data_manager.load_annotation()
+        if stored_mask is None: stored_mask = mask
+        if stored_mask is not None and stored_mask.shape == (h, w): self.base_mask = stored_mask.copy()
         self.sam_mask = None
         self.input_points = []
         self.input_labels = []
         self.update_canvas_display()
-        self.meta_text.setPlainText(f"文件: {img_path}")
-        self.text_editor.clear()
+        self._loaded_mask_digest = self._mask_digest(self.current_mask)
+
+    def _folder_prefetch_paths(self, index):
+        """按导航方向排列的预读列表：先往后，再往前一条"""
+        files = self.data_manager.file_list
+        order = [index + i for i in range(1, self.image_loader.read_ahead + 1)] + [index - 1]
+        paths = []
+        for i in order:
+            if 0 <= i < len(files):
+                img_path = os.path.join(self.data_manager.root_dir, files[i])
+                paths.append((img_path, self.data_manager.get_legacy_mask_path(img_path)))
+        return paths
+
+    # ==========================
+    # 异步加载
+    # ==========================
+    def _request_item(self, img_path, mask_path, prefetch):
+        """缓存命中时同步显示，否则交给 ImageLoader 在后台解码"""
+        cached = self.image_loader.get_cached(img_path, mask_path)
+        if cached is not None:
+            self._load_generation = 0
+            self.image_loader.prefetch(prefetch)
+            self._show_loaded_item(*cached)
+            return
+        self._load_generation = self.image_loader.request(
+            img_path, mask_path, self.item_loaded_signal.emit, prefetch)
+
+    @pyqtSlot(int, object, object)
+    def _on_item_loaded(self, generation, img, mask):
+        # 用户已切到别的条目，丢弃过期结果
+        if generation != self._load_generation or not self.image_loader.is_current(generation): return
+        self._show_loaded_item(img, mask)
+
+    def _show_loaded_item(self, img, mask):
+        if tracer.enabled: tracer.update_context(size=image_size(img))
+        with tracer.span("item.show"):
+            if self.current_mode == "folder":
+                self._show_folder_item(img, mask)
+            else:
+                self._show_json_item(img, mask)
+        if self.current_image is not None:
+            self._loaded_index = self._pending_index
+            self._loaded_key = self._item_key(self._loaded_index)
+            self._restore_interaction()
+
+    def _start_sam_encoding(self, img):
+        self._sam_ready = False
+        self._sam_generation = self.sam_engine.submit_image(img, self.sam_ready_signal.emit)
+
+    @pyqtSlot(int)
+    def _on_sam_ready(self, generation):
+        if generation != self._sam_generation: return
+        self._sam_ready = True
 
     def load_json_action(self):
-        file_path, _ = QFileDialog.getOpenFileName(self, "选择 JSON 文件", "", "JSON Files (*.json)")
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "选择数据集", "", "数据集 (*.json *.db *.sqlite);;JSON Files (*.json);;SQLite (*.db *.sqlite)")
         if file_path:
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    self.json_data = json.load(f)
-                self.json_path = file_path
-                self.file_list_widget.clear()
-                for item in self.json_data:
-                    item_id = item.get('id', 'Unknown')
-                    category = item.get('category', '')
-                    display = f"[{category}] {item_id}" if category else item_id
-                    self.file_list_widget.addItem(display)
-                self.stats_label.setText(f"共 {len(self.json_data)} 条数据")
-                if self.json_data: self.file_list_widget.setCurrentRow(0)
+                self.open_json_dataset(file_path)
                 QMessageBox.information(self, "成功", f"已加载 {len(self.json_data)} 条数据")
             except Exception as e:
                 QMessageBox.critical(self, "错误", f"加载失败: {e}")
 
-    def _load_json_item(self, index):
+    def open_json_dataset(self, file_path):
+        """打开 JSON 或 SQLite 数据集并填充列表，失败时抛出异常"""
+        self._stop_recording()
+        self.btn_review_grid.setChecked(False)
+        self._open_interaction_store(file_path)
+        self._close_dataset_db()
+        if file_path.lower().endswith(('.db', '.sqlite')):
+            self.dataset_db = DatasetDB(file_path)
+            self.json_data = self.dataset_db.list_items()
+        else:
+            # 只建立偏移索引并保留显示字段，完整条目选中时再读取
+            self.json_data = LazyJsonDataset(file_path)
+        self.json_path = file_path
+        self._populate_json_list()
+
+    def _populate_json_list(self):
+        self._clear_duplicates()
+        self.file_list_widget.clear()
+        for item in self.json_data:
+            self.file_list_widget.addItem(self._json_display_text(item))
+        self.stats_label.setText(f"共 {len(self.json_data)} 条数据")
+        if self.json_data: self.file_list_widget.setCurrentRow(0)
+
+    @staticmethod
+    def _json_display_text(item):
+        item_id = item.get('id', 'Unknown')
+        category = item.get('category', '')
+        return f"[{category}] {item_id}" if category else item_id
+
+    def import_json_to_db_action(self):
+        json_file, _ = QFileDialog.getOpenFileName(self, "选择要导入的 JSON", "", "JSON Files (*.json)")
+        if not json_file: return
+        db_file, _ = QFileDialog.getSaveFileName(self, "保存 SQLite 数据集", os.path.splitext(json_file)[0] + ".db",
+                                                 "SQLite (*.db *.sqlite)")
+        if not db_file: return
+        try:
+            self._close_dataset_db()
+            self.dataset_db = DatasetDB(db_file)
+            count = self.dataset_db.import_json(json_file)
+            self.json_data = self.dataset_db.list_items()
+            self.json_path = db_file
+            self._populate_json_list()
+            QMessageBox.information(self, "成功", f"已导入 {count} 条数据到 {db_file}")
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"导入失败: {e}")
+
+    def export_db_json_action(self):
+        if self.dataset_db is None:
+            QMessageBox.information(self, "提示", "当前打开的不是 SQLite 数据集")
+            return
+        out_file, _ = QFileDialog.getSaveFileName(self, "导出 JSON", "", "JSON Files (*.json)")
+        if not out_file: return
+        try:
+            count = self.dataset_db.export_json(out_file)
+            QMessageBox.information(self, "成功", f"已导出 {count} 条数据")
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"导出失败: {e}")
+
+    def _close_dataset_db(self):
+        if self.dataset_db is not None:
+            self.dataset_db.close()
+            self.dataset_db = None
+        self._current_item = None
+        self._materialized_index = -1
+
+    def _materialize_json_item(self, index):
+        """取得完整条目：JSON 文件按偏移从文件读取，SQLite 按 id 从数据库读取"""
+        if self.dataset_db is None:
+            # 上一个条目的修改在切换前已经自动保存，释放它的完整内容
+            if self._current_item is not None and self._materialized_index != index:
+                self.json_data.evict(self._materialized_index)
+            self._current_item, self._current_item_version = self.json_data.get(index), None
+            self._materialized_index = index
+        else:
+            prev = self._current_item
+            if prev is not None and prev.get('id') != self.json_data[index]['id']:
+                self.dataset_db.release(prev.get('id'))
+            self._current_item, self._current_item_version = self.dataset_db.get_item(self.json_data[index]['id'])
+            if self._current_item is None: self._current_item = dict(self.json_data[index])
+        self._item_readonly = False
+        return self._current_item
+
+    def _checkout_current_item(self):
+        """SQLite 模式下领取当前条目的租约，被别人占用时切换为只读"""
+        if self.dataset_db is None or self._current_item is None: return
+        item_id = self._current_item.get('id')
+        if not self.dataset_db.checkout(item_id):
+            self._item_readonly = True
+            holder = self.dataset_db.lease_holder(item_id)
+            self.meta_text.append(f"⚠ 该条目正被 {holder} 编辑，当前为只读")
+
+    def _preview_json_item(self, index):
+        self._pending_paths = (None, None)
+        self._pending_translation = ""
         if index < 0 or index >= len(self.json_data): return
         self.json_current_index = index
-        item = self.json_data[index]
+        item = self._materialize_json_item(index)
         rgb_path = item.get('image_path_rgb', '')
-        img = None
-        if rgb_path and Path(rgb_path).exists(): img = cv2.imread(rgb_path)
+        mask_spec = self._entry_mask_spec(item)
+        mask_desc = f"{mask_spec[0]} #{mask_spec[1]}" if isinstance(mask_spec, tuple) else mask_spec
+        self._pending_paths = (rgb_path, mask_spec)
+        self.meta_text.setPlainText(f"ID: {item.get('id', '')}\nImage: {rgb_path}\nMask: {mask_desc}")
+        conversations = item.get('conversations', [])
+        self.translated_text.clear()
+        if conversations:
+            conv_text = ""
+            for conv in conversations:
+                role = conv.get('from', '')
+                value = conv.get('value', '').replace('<image>\n', '')
+                conv_text += f"{'👤 Human' if role == 'human' else '🤖 GPT'}:\n{value}\n\n"
+            self._set_editor_text(conv_text)
+            # 翻译要走网络，等选中项稳定后再发
+            self._pending_translation = conv_text
+        else:
+            self._set_editor_text("（无对话数据）")
+
+    def _show_json_item(self, img, mask):
         if img is not None:
             self.current_image = img
             self.canvas.set_image(img)
-            self.sam_engine.set_image(img)
+            self._start_sam_encoding(img)
         else:
             self.current_image = None
             self.canvas.set_image(None)
-            print(f"图像不存在: {rgb_path}")
+            print(f"图像不存在: {self._current_item.get('image_path_rgb', '')}")
             return
-        mask_path = item.get('mask_path', '') or item.get('training_mask_path', '')
         h, w = self.current_image.shape[:2]
         self.base_mask = np.zeros((h, w), dtype=np.uint8)
-        if mask_path and Path(mask_path).exists():
-            mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
-            if mask is not None:
-                _, mask_binary = cv2.threshold(mask, 127, 1, cv2.THRESH_BINARY)
-                if mask_binary.shape == (h, w): self.base_mask = mask_binary
+        # 缓存中的 Mask 是共享的，这里拷贝一份再编辑
+        if mask is not None and mask.shape == (h, w): self.base_mask = mask.copy()
         self.sam_mask = None
         self.input_points = []
         self.input_labels = []
+        self._open_item_raster(self._current_item.get('image_path_4c', ''), (h, w))
         self.update_canvas_display()
-        self.meta_text.setPlainText(f"ID: {item.get('id', '')}\nImage: {rgb_path}\nMask: {mask_path}")
-        conversations = item.get('conversations', [])
-        if conversations:
-            conv_text = ""
-            for conv in conversations:
-                role = conv.get('from', '')
-                value = conv.get('value', '').replace('<image>\n', '')
-                conv_text += f"{'👤 Human' if role == 'human' else '🤖 GPT'}:\n{value}\n\n"
-            self.text_editor.setPlainText(conv_text)
-            self._auto_translate(conv_text)
-        else:
-            self.text_editor.setPlainText("（无对话数据）")
-            self.translated_text.clear()
+        self._loaded_mask_digest = self._mask_digest(self.current_mask)
+
+    # ==========================
+    # 多光谱显示
+    # ==========================
+    def _open_item_raster(self, path, image_shape):
+        """mmap 打开 4 通道栅格，尺寸与 RGB 图一致时才允许切换假彩色"""
+        raster = open_raster(path)
+        if raster is not None and (raster.height, raster.width) != image_shape:
+            print(f"4通道数据尺寸 {raster.shape[:2]} 与 RGB 图像 {image_shape} 不一致，忽略")
+            raster = None
+        self.current_raster = raster
+        available = raster.available_composites() if raster is not None else []
+        self.combo_composite.setEnabled(len(available) > 1)
+        self._apply_composite()
+
+    def _apply_composite(self, *_):
+        name = self.combo_composite.currentText()
+        raster = self.current_raster
+        if raster is None or name == "RGB" or name not in raster.available_composites():
+            self.canvas.set_raster_source(None)
+            return
+        # 假彩色只在画布请求某个视口时才计算
+        self.canvas.set_raster_source(
+            lambda x, y, w, h, step: raster.read_composite(name, x, y, w, h, step))
+
+    def _json_prefetch_paths(self, index):
+        order = [index + i for i in range(1, self.image_loader.read_ahead + 1)] + [index - 1]
+        paths = []
+        for i in order:
+            if 0 <= i < len(self.json_data):
+                item = self.json_data[i]
+                paths.append((item.get('image_path_rgb', ''), self._entry_mask_spec(item)))
+        return paths
+
+    @staticmethod
+    def _entry_mask_spec(item):
+        """条目的 Mask 来源：单文件标签图时为 (标签图路径, 标签值)，否则为逐对象 PNG 路径"""
+        if item.get(LABEL_MAP_KEY) and item.get(LABEL_ID_KEY):
+            return item[LABEL_MAP_KEY], item[LABEL_ID_KEY]
+        return item.get('mask_path', '') or item.get('training_mask_path', '')
 
     # ==========================
     # 核心：显示与合并逻辑
     # ==========================
+    @traced("canvas.update_display")
     def update_canvas_display(self):
         if self.base_mask is not None:
             self.canvas.set_mask(self.base_mask)
@@ -430,39 +942,83 @@ class MainWindow(QMainWindow):
                     pass
         else:
             self.current_mask = None
+        self._account_buffers()
 
     def apply_sam_merge(self):
         if self.base_mask is None or self.sam_mask is None: return
+        self._record('merge')
+        if self.chk_auto_clean.isChecked() and self.sam_mask.shape == self.base_mask.shape:
+            # 只清理新加入的区域，已有标注保持原样
+            postprocess(self.sam_mask)
         self.base_mask = np.bitwise_or(self.base_mask, self.sam_mask)
         print("操作：区域已添加")
         self.reset_sam_interaction()
 
     def apply_sam_subtract(self):
         if self.base_mask is None or self.sam_mask is None: return
+        self._record('subtract')
         sam_inverted = 1 - self.sam_mask
         self.base_mask = np.bitwise_and(self.base_mask, sam_inverted)
         print("操作：区域已移除")
         self.reset_sam_interaction()
 
+    def cleanup_mask_action(self):
+        """对当前整个 Mask 去噪点、补针孔并平滑 (只处理前景外接框)"""
+        if self.base_mask is None: return
+        self._record('cleanup')
+        if postprocess(self.base_mask) is None: return
+        print("操作：Mask 已清理")
+        self.update_canvas_display()
+
     def reset_sam_interaction(self):
+        self._record('reset')
         self.input_points = []
         self.input_labels = []
         self.sam_mask = None
+        self.sam_logits = None
+        self._interaction_dirty = True
         self.update_canvas_display()
 
     @pyqtSlot(int, int, int)
     def handle_canvas_click(self, x, y, is_left):
         if self.current_image is None: return
+        if not self._sam_ready:
+            print("SAM: 特征仍在计算中，请稍候")
+            return
+        # 只记录真正生效的点击，回放时会等 SAM 编码完成再发送
+        self._record('click', x, y, is_left)
         self.input_points.append([x, y])
         self.input_labels.append(is_left)
         print(f"🖱️ 点击: ({x}, {y})")
-        mask = self.sam_engine.predict_mask(self.input_points, self.input_labels)
+        mask = self.sam_engine.predict_mask(self.input_points, self.input_labels, mask_input=self.sam_logits)
+        self._interaction_dirty = True
         if mask is not None:
             self.sam_mask = mask
+            self.sam_logits = getattr(self.sam_engine, 'last_logits', None)
             self.update_canvas_display()
 
+    def closeEvent(self, event):
+        self._switch_timer.stop()
+        self._trace_timer.stop()
+        self._memory_timer.stop()
+        self._stop_recording()
+        self._close_interaction_store()
+        self.review_thumbnailer.shutdown()
+        self.image_loader.shutdown()
+        self.sam_engine.shutdown()
+        self.async_writer.shutdown()
+        self._close_dataset_db()
+        super().closeEvent(event)
+
     def keyPressEvent(self, event):
-        if event.key() in (Qt.Key.Key_Space, Qt.Key.Key_Enter):
+        ctrl_shift = Qt.KeyboardModifier.ControlModifier | Qt.KeyboardModifier.ShiftModifier
+        if event.modifiers() == ctrl_shift and event.key() == Qt.Key.Key_T:
+            self.toggle_tracing()
+        elif event.modifiers() == ctrl_shift and event.key() == Qt.Key.Key_E:
+            self.export_trace_action()
+        elif event.modifiers() == ctrl_shift and event.key() == Qt.Key.Key_R:
+            self.toggle_recording()
+        elif event.key() in (Qt.Key.Key_Space, Qt.Key.Key_Enter):
             self.apply_sam_merge()
         elif event.key() in (Qt.Key.Key_Delete, Qt.Key.Key_Backspace):
             self.apply_sam_subtract()
@@ -475,10 +1031,221 @@ class MainWindow(QMainWindow):
         else:
             super().keyPressEvent(event)
 
+    # ==========================
+    # 性能追踪
+    # ==========================
+    def _item_key(self, index):
+        """条目的稳定标识：文件夹模式为相对路径 (MaskStore 的 key)，JSON 模式为 id"""
+        if self.current_mode == "folder":
+            files = self.data_manager.file_list
+            return files[index] if 0 <= index < len(files) else None
+        if 0 <= index < len(self.json_data): return self.json_data[index].get('id', index)
+        return index
+
+    def toggle_tracing(self):
+        """Ctrl+Shift+T：开关追踪；关闭时保留已记录的事件，仍可导出"""
+        tracer.enabled = not tracer.enabled
+        if tracer.enabled:
+            self._trace_timer.start()
+            row = self.file_list_widget.currentRow()
+            tracer.set_context(item=self._item_key(row) if row >= 0 else None,
+                               size=image_size(self.current_image))
+            self.trace_label.setText("追踪已开启")
+        else:
+            self._trace_timer.stop()
+            self.trace_label.setText("追踪已关闭")
+
+    def _update_trace_status(self):
+        stats = tracer.stats()
+        # 按 p95 排序，只显示最慢的几项
+        top = sorted(stats.items(), key=lambda kv: kv[1][2], reverse=True)[:self.TRACE_STATUS_TOP]
+        self.trace_label.setText("  |  ".join(
+            f"{name} p50 {p50:.1f} / p95 {p95:.1f} ms (n={n})" for name, (n, p50, p95) in top))
+
+    def export_trace_action(self):
+        """Ctrl+Shift+E：导出 Chrome trace-event JSON，可在 chrome://tracing 或 Perfetto 中打开"""
+        path, _ = QFileDialog.getSaveFileName(self, "导出追踪", "trace.json", "Chrome Trace (*.json)")
+        if not path: return
+        try:
+            count = tracer.export_chrome_trace(path)
+            QMessageBox.information(self, "成功", f"已导出 {count} 个事件: {path}")
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"导出失败: {e}")
+
+    # ==========================
+    # 网格审阅
+    # ==========================
+    def toggle_review_grid(self, checked):
+        if not checked:
+            self.center_stack.setCurrentWidget(self.canvas)
+            self.review_grid.release()
+            return
+        if self.file_list_widget.count() == 0:
+            self.btn_review_grid.setChecked(False)
+            return
+        # 先落盘当前修改，缩略图按文件 mtime 判断是否需要重新生成
+        self._auto_save_current()
+        self.async_writer.flush()
+        self.review_grid.set_entries(self._review_entries())
+        row = self.file_list_widget.currentRow()
+        if 0 <= row < self.review_grid.count():
+            self.review_grid.setCurrentRow(row)
+            self.review_grid.scrollToItem(self.review_grid.item(row), QListWidget.ScrollHint.PositionAtCenter)
+        self.center_stack.setCurrentWidget(self.review_grid)
+
+    def _on_review_item_activated(self, row):
+        self.btn_review_grid.setChecked(False)
+        if row != self.file_list_widget.currentRow(): self.file_list_widget.setCurrentRow(row)
+
+    def _review_entries(self):
+        """[(显示文字, 图像路径, mask_spec), ...]，与文件列表逐行对应，不访问磁盘"""
+        entries = []
+        for row in range(self.file_list_widget.count()):
+            text = self.file_list_widget.item(row).text()
+            if self.current_mode == "folder":
+                dm = self.data_manager
+                if row >= len(dm.file_list): break
+                key = dm.file_list[row]
+                img_path = os.path.join(dm.root_dir, key)
+                location = dm.mask_store.locate(key) if dm.mask_store is not None else None
+                # 没有分片记录时回退到旧的 <名称>_mask.png，文件不存在则只显示图像
+                spec = ('mask_store', *location) if location else ('png', dm.get_legacy_mask_path(img_path))
+            else:
+                item = self.json_data[row]
+                img_path = item.get('image_path_rgb', '')
+                mask_spec = self._entry_mask_spec(item)
+                if isinstance(mask_spec, tuple):
+                    spec = ('label_map', *mask_spec)
+                else:
+                    spec = ('png', mask_spec) if mask_spec else None
+            entries.append((text, img_path, spec))
+        return entries
+
+    # ==========================
+    # 未提交的交互状态
+    # ==========================
+    def _open_interaction_store(self, dataset_path):
+        """切换数据集：先把当前条目的交互状态存回旧数据集，再打开新数据集的记录"""
+        self._close_interaction_store()
+        if not self.persist_interactions: return
+        try:
+            self.interaction_store = InteractionStore.for_dataset(dataset_path)
+        except (OSError, sqlite3.Error) as e:
+            print(f"交互状态存储不可用: {e}")
+
+    def _close_interaction_store(self):
+        self._stash_interaction()
+        self._loaded_index = -1
+        self._loaded_key = None
+        if self.interaction_store is not None:
+            self.interaction_store.close()
+            self.interaction_store = None
+
+    def _stash_interaction(self):
+        """离开已加载的条目时保存 SAM 提示点、logits 与预览；已清空的交互删除记录"""
+        if self.interaction_store is None or self._loaded_index < 0 or not self._interaction_dirty: return
+        try:
+            if self.input_points or self.sam_mask is not None:
+                self.interaction_store.put(self._loaded_key, self.input_points, self.input_labels,
+                                           self.sam_mask, self.sam_logits)
+            else:
+                self.interaction_store.delete(self._loaded_key)
+        except sqlite3.Error as e:
+            print(f"保存交互状态失败: {e}")
+        self._interaction_dirty = False
+
+    def _restore_interaction(self):
+        """重新打开条目时恢复上次未提交的交互，无需重新点击和解码"""
+        self._interaction_dirty = False
+        if self.interaction_store is None or self._loaded_key is None: return
+        try:
+            state = self.interaction_store.get(self._loaded_key)
+        except sqlite3.Error as e:
+            print(f"读取交互状态失败: {e}")
+            return
+        if state is None: return
+        preview = state['preview']
+        if preview is not None and preview.shape != self.current_image.shape[:2]: return
+        self.input_points = state['points']
+        self.input_labels = state['labels']
+        self.sam_mask = preview
+        self.sam_logits = state['logits']
+        self.update_canvas_display()
+        print(f"已恢复未提交的 SAM 交互 ({len(self.input_points)} 个点)")
+
+    def _prune_interaction(self):
+        """条目保存后交互状态已体现在 Mask 中，删除记录"""
+        self._interaction_dirty = False
+        if self.interaction_store is None or self._loaded_key is None: return
+        try:
+            self.interaction_store.delete(self._loaded_key)
+        except sqlite3.Error as e:
+            print(f"清理交互状态失败: {e}")
+
+    # ==========================
+    # 内存记账
+    # ==========================
+    def _account_buffers(self):
+        """登记当前条目的全尺寸缓冲区；它们不能淘汰，超预算时由缓存让出空间"""
+        memory.track('image', 'current_image', self.current_image)
+        memory.track('mask', 'base_mask', self.base_mask)
+        memory.track('mask', 'sam_mask', self.sam_mask)
+        memory.track('mask', 'current_mask', self.current_mask)
+
+    def set_memory_budget(self, mb):
+        memory.set_budget(mb * MB)
+        self._update_memory_panel()
+
+    def _update_memory_panel(self):
+        totals = memory.totals()
+        lines = [f"{name:<18}{format_bytes(size):>10}" for name, size in sorted(totals.items(), key=lambda kv: -kv[1])]
+        lines.append(f"{'合计':<16}{format_bytes(sum(totals.values())):>10} / {format_bytes(memory.budget)}")
+        self.memory_label.setText("\n".join(lines))
+
+    # ==========================
+    # 会话记录
+    # ==========================
+    def _record(self, action, *args):
+        if self.session_recorder is not None: self.session_recorder.record(action, *args)
+
+    def _record_mask_checksum(self):
+        """离开已完整加载的条目时记下其 Mask 校验和，回放时逐条比对"""
+        if self._loaded_index >= 0:
+            self._record(MASK_EVENT, self._loaded_index, mask_checksum(self.current_mask))
+
+    def toggle_recording(self):
+        """Ctrl+Shift+R：开始/停止记录当前数据集上的标注会话"""
+        if self.session_recorder is not None:
+            path = self.session_recorder.path
+            self._stop_recording()
+            self.statusBar().showMessage(f"会话已保存: {path}", 5000)
+            return
+        dataset = self.data_manager.root_dir if self.current_mode == "folder" else self.json_path
+        if not dataset:
+            self.statusBar().showMessage("请先加载数据集", 3000)
+            return
+        self.session_recorder = SessionRecorder(default_session_path(), header={
+            'mode': self.current_mode,
+            'dataset': dataset,
+            'recursive': self.chk_recursive.isChecked(),
+            'unannotated_only': self.chk_unannotated.isChecked(),
+            'row': self.file_list_widget.currentRow(),
+            'brush_radius': self.brush_radius,
+            'auto_clean': self.chk_auto_clean.isChecked(),
+        })
+        self.statusBar().showMessage(f"正在记录会话: {self.session_recorder.path}")
+
+    def _stop_recording(self):
+        if self.session_recorder is None: return
+        self._record_mask_checksum()
+        self.session_recorder.close()
+        self.session_recorder = None
+
     # ==========================
     # 保存与删除 (保持不变)
     # ==========================
     def save_current(self):
+        self._record('save')
         if self.current_mode == "folder":
             self._save_folder_item()
         else:
@@ -486,26 +1253,145 @@ class MainWindow(QMainWindow):
 
     def _save_folder_item(self):
         if self.current_image is None: return
-        if self.current_mask is not None:
-            self.data_manager.save_annotation(self.current_mask, self.text_editor.toPlainText())
-            print("已保存")
-        self.navigate_next()
+        self._write_folder_item()
+        row = self.file_list_widget.currentRow()
+        if row < self.file_list_widget.count() - 1:
+            self.file_list_widget.setCurrentRow(row + 1)
+
+    @traced("save.folder")
+    def _write_folder_item(self):
+        if self.current_image is None or self.current_mask is None: return
+        mask_changed = self._mask_changed()
+        if not (mask_changed or self._text_dirty): return
+        # 编码与写盘交给后台队列，这里只提交数据的拷贝
+        key = self.data_manager.get_current_key()
+        self.async_writer.submit(self.data_manager.save_annotation, self.current_mask.copy(),
+                                 self.text_editor.toPlainText(), key, self.data_manager.mask_store, tag=key)
+        self._mark_saved()
+        print("已保存")
+
+    # ==========================
+    # 脏标记
+    # ==========================
+    @staticmethod
+    def _mask_digest(mask):
+        if mask is None: return None
+        return mask.shape, hashlib.blake2b(np.ascontiguousarray(mask > 0).tobytes(), digest_size=16).digest()
+
+    def _mask_changed(self):
+        return self.current_mask is not None and self._mask_digest(self.current_mask) != self._loaded_mask_digest
+
+    def _mark_saved(self, mask=True, text=True):
+        if mask:
+            self._loaded_mask_digest = self._mask_digest(self.current_mask)
+            self._prune_interaction()
+        if text: self._text_dirty = False
+
+    @pyqtSlot(object, str)
+    def _on_write_failed(self, key, error):
+        """后台写盘失败：当前条目重新标记为未保存，攒到一起提示一次 (磁盘满时会连续失败很多条)"""
+        if key is not None and key == self._loaded_key:
+            self._loaded_mask_digest = None
+            self._text_dirty = True
+        if not self._write_failures: QTimer.singleShot(0, self._report_write_failures)
+        self._write_failures.append((key, error))
+
+    def _report_write_failures(self):
+        failures, self._write_failures = self._write_failures, []
+        if not failures: return
+        lines = [f"{key}: {error}" for key, error in failures[:10]]
+        if len(failures) > 10: lines.append(f"... 共 {len(failures)} 条")
+        QMessageBox.warning(self, "保存失败",
+                            "以下条目的修改没有写入磁盘，当前条目已重新标记为未保存，请检查后重新保存：\n"
+                            + "\n".join(lines))
+
+    def _on_text_edited(self):
+        self._text_dirty = True
+
+    def _set_editor_text(self, text):
+        """程序填充文本框，不算作用户修改"""
+        self.text_editor.setPlainText(text)
+        self._text_dirty = False
 
     def _save_json_item(self):
         if not self.json_path or self.json_current_index < 0: return
-        item = self.json_data[self.json_current_index]
-        convs = self._parse_conversations(self.text_editor.toPlainText())
-        if convs: item['conversations'] = convs
-        if self.current_mask is not None:
-            mask_path = item.get('mask_path') or item.get('training_mask_path')
-            if mask_path: cv2.imwrite(mask_path, (self.current_mask * 255).astype(np.uint8))
         try:
-            with open(self.json_path, 'w', encoding='utf-8') as f:
-                json.dump(self.json_data, f, ensure_ascii=False, indent=4)
-            QMessageBox.information(self, "成功", f"已保存: {self.json_path}")
+            if self._write_json_item(status='done'):
+                QMessageBox.information(self, "成功", f"已保存: {self.json_path}")
         except Exception as e:
             QMessageBox.critical(self, "错误", f"保存失败: {e}")
 
+    @traced("save.json")
+    def _write_json_item(self, status=None, write_mask=True, interactive=True):
+        """
+        保存当前条目。JSON 文件整体重写；SQLite 只更新这一行，
+        并校验 version，防止覆盖其他标注员的修改。返回是否保存成功。
+        """
+        item = self._current_item
+        if item is None: return False
+        if self._item_readonly:
+            if interactive: QMessageBox.warning(self, "只读", "该条目正被其他标注员编辑，修改未保存")
+            return False
+        text_changed = self._text_dirty
+        mask_changed = write_mask and self._mask_changed()
+        # 浏览已审核过的数据时什么都不写
+        if not (text_changed or mask_changed or self._json_file_dirty or (self.dataset_db is not None and status)):
+            return True
+        convs = self._parse_conversations(self.text_editor.toPlainText()) if text_changed else []
+        if self.dataset_db is not None:
+            # 先校验 version 更新这一行 (Mask 有改动时同样占用一个新版本)，
+            # 成功后才写 Mask 文件，被拒绝时磁盘上别人的 Mask 保持不变
+            version = self.dataset_db.update_item(item.get('id'), conversations=convs or None, status=status,
+                                                  expected_version=self._current_item_version)
+            if version is None:
+                msg = "该条目已被其他标注员修改或占用，保存被拒绝，请重新打开后再编辑"
+                if interactive:
+                    QMessageBox.warning(self, "冲突", msg)
+                else:
+                    print(msg)
+                return False
+            self._current_item_version = version
+        if convs: item['conversations'] = convs
+        if mask_changed:
+            stored = self._write_entry_mask(self._entry_mask_spec(item), self.current_mask, self._loaded_key)
+            if stored is not None:
+                # 与同一标签图中其他对象重叠的像素没有写入，画布同步为实际保存的结果
+                self.base_mask &= stored
+                self.update_canvas_display()
+                msg = "与同一源图中其他对象重叠的像素属于已有对象，未写入当前对象"
+                if interactive:
+                    QMessageBox.warning(self, "重叠", msg)
+                else:
+                    print(msg)
+            self._mark_saved(text=False)
+        if self.dataset_db is None and (text_changed or self._json_file_dirty):
+            self.json_data.save()
+            self._json_file_dirty = False
+        self._mark_saved(mask=False)
+        return True
+
+    def _write_entry_mask(self, mask_spec, mask, key=None):
+        """
+        提交 JSON 条目的 Mask 写盘，并同步更新 ImageLoader 的缓存；key 用于写盘失败时定位条目。
+        标签图中与其他对象重叠的像素不会写入，此时返回实际写入的二值 Mask，否则返回 None。
+        """
+        if isinstance(mask_spec, tuple):
+            # 标签图在 GUI 线程更新缓存，保证同一源图的下一个对象看到的是最新内容
+            map_path, label = mask_spec
+            labels = self.image_loader.load_label_map(map_path)
+            labels = labels.copy() if labels is not None else np.zeros(mask.shape, dtype=np.uint16)
+            if labels.shape == mask.shape:
+                dropped = put_mask(labels, label, mask)
+                self.image_loader.update_label_map(map_path, labels)
+                self.async_writer.submit(write_label_map, map_path, labels, tag=key)
+                if dropped:
+                    print(f"{key}: {dropped} 个像素与其他对象重叠，未写入")
+                    return extract_mask(labels, label)
+        elif mask_spec:
+            self.async_writer.write_mask_png(mask_spec, mask, tag=key)
+            self.image_loader.update_mask(mask_spec, mask)
+        return None
+
     def _parse_conversations(self, text: str) -> list:
         if not text.strip(): return []
         conversations = []
@@ -540,7 +1426,15 @@ class MainWindow(QMainWindow):
         if self.json_current_index < 0: return
         if QMessageBox.question(self, '确认删除',
                                 f"确定删除 ID: {self.json_data[self.json_current_index].get('id')}？") == QMessageBox.StandardButton.Yes:
-            item = self.json_data[self.json_current_index]
+            item = self._current_item or self.json_data[self.json_current_index]
+            if self.dataset_db is not None and not self.dataset_db.delete_item(item.get('id')):
+                QMessageBox.warning(self, "无法删除", "该条目正被其他标注员编辑")
+                return
+            if item.get(LABEL_MAP_KEY):
+                # 标签图由同一源图的多个对象共用，只清掉这个对象的标签
+                self.async_writer.flush()
+                remove_object(item[LABEL_MAP_KEY], item.get('id'), item.get(LABEL_ID_KEY))
+                self.image_loader.invalidate_label_map(item[LABEL_MAP_KEY])
             for k in ['visual_prompt_path', 'training_mask_path', 'mask_path']:
                 if p := item.get(k):
                     try:
@@ -549,6 +1443,8 @@ class MainWindow(QMainWindow):
                     except:
                         pass
             self.json_data.pop(self.json_current_index)
+            if self.dataset_db is None: self._json_file_dirty = True
+            self._clear_duplicates()
             self.file_list_widget.takeItem(self.json_current_index)
             self.stats_label.setText(f"共 {len(self.json_data)} 条数据")
             if self.json_data:
@@ -556,33 +1452,126 @@ class MainWindow(QMainWindow):
             else:
                 self.on_mode_changed()
 
+    # ==========================
+    # 重复图像
+    # ==========================
+    def _row_image_paths(self):
+        if self.current_mode == "folder":
+            root = self.data_manager.root_dir
+            return [os.path.join(root, rel) for rel in self.data_manager.file_list] if root else []
+        return [item.get('image_path_rgb', '') for item in self.json_data]
+
+    def find_duplicates_action(self):
+        paths = self._row_image_paths()
+        if not paths: return
+        source = self.data_manager.root_dir if self.current_mode == "folder" else self.json_path
+        cache_path = os.path.join(HASH_CACHE_DIR, hashlib.sha1(os.path.abspath(source).encode('utf-8')).hexdigest() + ".json")
+        self._dup_generation += 1
+        self.btn_find_dups.setEnabled(False)
+        self.stats_label.setText(f"正在计算 {len(paths)} 张图像的感知哈希...")
+        threading.Thread(target=self._duplicates_worker, args=(self._dup_generation, paths, cache_path),
+                         daemon=True).start()
+
+    def _duplicates_worker(self, generation, paths, cache_path):
+        try:
+            # 已有 Qt/加载线程的进程里 fork 不安全，子进程用 spawn 启动
+            index = HashIndex(cache_path).build(paths, mp_context=multiprocessing.get_context('spawn'))
+            self.duplicates_signal.emit(generation, (index, index.groups(paths)))
+        except Exception as e:
+            print(f"查重失败: {e}")
+            self.duplicates_signal.emit(generation, None)
+
+    @pyqtSlot(int, object)
+    def _on_duplicates_found(self, generation, result):
+        self.btn_find_dups.setEnabled(True)
+        # 计算期间列表已重建，结果中的行号不再可靠
+        if generation != self._dup_generation or result is None: return
+        index, groups = result
+        rows_of = {}
+        for row, path in enumerate(self._row_image_paths()):
+            rows_of.setdefault(path, []).append(row)
+        self._dup_index = index
+        self._dup_groups = [[r for p in group for r in rows_of.get(p, [])] for group in groups]
+        self._dup_group_of = {r: gid for gid, rows in enumerate(self._dup_groups) for r in rows}
+        for gid, rows in enumerate(self._dup_groups):
+            color = QColor.fromHsv((gid * 47) % 360, 60, 255)
+            for r in rows:
+                list_item = self.file_list_widget.item(r)
+                list_item.setText(f"⧉{gid + 1} {list_item.text()}")
+                list_item.setBackground(color)
+                list_item.setToolTip(f"重复组 {gid + 1}，共 {len(rows)} 张")
+        self.stats_label.setText(f"共 {self.file_list_widget.count()} 条数据，发现 {len(groups)} 组重复 / 近似重复图像")
+
+    def _clear_duplicates(self):
+        """列表行号变化时丢弃分组结果，恢复列表文本"""
+        self._dup_generation += 1
+        self.btn_find_dups.setEnabled(True)
+        if self._dup_group_of:
+            for r in self._dup_group_of:
+                list_item = self.file_list_widget.item(r)
+                if list_item is None: continue
+                list_item.setText(list_item.text().split(' ', 1)[1])
+                list_item.setData(Qt.ItemDataRole.BackgroundRole, None)
+                list_item.setToolTip("")
+        self._dup_index = None
+        self._dup_groups = []
+        self._dup_group_of = {}
+
+    def reuse_mask_action(self):
+        """把当前 Mask 写到同组中尺寸相同的其他条目 (近似重复但尺寸不同的图像不处理)"""
+        row = self.file_list_widget.currentRow()
+        if row not in self._dup_group_of or self._loaded_index != row or self.current_mask is None:
+            QMessageBox.information(self, "提示", "请先查找重复，并打开一个属于重复组的条目")
+            return
+        paths = self._row_image_paths()
+        shape = self.current_mask.shape
+        targets = [r for r in self._dup_groups[self._dup_group_of[row]]
+                   if r != row and self._dup_index.shape(paths[r]) == shape]
+        if self.current_mode == "json" and self.dataset_db is not None:
+            targets = [r for r in targets
+                       if self.dataset_db.lease_holder(self.json_data[r]['id']) in (None, self.dataset_db.owner)]
+        if not targets:
+            QMessageBox.information(self, "提示", "同组中没有尺寸相同且可写的其他条目")
+            return
+        if QMessageBox.question(self, "复用 Mask", f"用当前 Mask 覆盖同组其他 {len(targets)} 个条目的 Mask？") \
+                != QMessageBox.StandardButton.Yes: return
+        mask = self.current_mask.copy()
+        for r in targets:
+            if self.current_mode == "folder":
+                key = self.data_manager.file_list[r]
+                text = self.data_manager.load_annotation_text(key) or ""
+                self.async_writer.submit(self.data_manager.save_annotation, mask, text, key,
+                                         self.data_manager.mask_store, tag=key)
+            else:
+                self._write_entry_mask(self._entry_mask_spec(self.json_data[r]), mask, self._item_key(r))
+        print(f"Mask 已复用到 {len(targets)} 个条目")
+
     # ==========================
     # 辅助功能与导航
     # ==========================
     def navigate_prev(self):
         row = self.file_list_widget.currentRow()
         if row > 0:
+            self._record('prev')
             self._auto_save_current()
             self.file_list_widget.setCurrentRow(row - 1)
 
     def navigate_next(self):
         row = self.file_list_widget.currentRow()
         if row < self.file_list_widget.count() - 1:
+            self._record('next')
             self._auto_save_current()
             self.file_list_widget.setCurrentRow(row + 1)
 
     def _auto_save_current(self):
+        # 只预览过 (尚未完整加载) 的条目没有可保存的修改
+        if self._loaded_index != self.file_list_widget.currentRow(): return
         if self.current_mode == "folder":
-            self._save_folder_item()
+            self._write_folder_item()
         else:
             if not self.json_path or self.json_current_index < 0: return
-            item = self.json_data[self.json_current_index]
-            convs = self._parse_conversations(self.text_editor.toPlainText())
-            if convs: item['conversations'] = convs
             try:
-                with open(self.json_path, 'w', encoding='utf-8') as f:
-                    json.dump(self.json_data, f, ensure_ascii=False, indent=4)
-                print("文本已自动保存")
+                if self._write_json_item(write_mask=False, interactive=False): print("文本已自动保存")
             except:
                 pass
 
@@ -597,6 +1586,7 @@ class MainWindow(QMainWindow):
             self.btn_translate.setEnabled(True);
             self.btn_translate.setText("🌐 翻译为中文")
 
+    @traced("translate")
     def _auto_translate(self, text):
         if not text.strip(): self.translated_text.clear(); return
         try:
@@ -627,6 +1617,7 @@ class MainWindow(QMainWindow):
         self.text_editor.setPlaceholderText(tips.get(mode, ""))
 
     def set_brush_radius(self, radius):
+        if radius != self.brush_radius: self._record('brush_radius', radius)
         self.brush_radius = radius
 
     # ==========================
@@ -636,6 +1627,7 @@ class MainWindow(QMainWindow):
     @pyqtSlot(int, int, int, int)
     def handle_rect_erase(self, x, y, w, h):
         if self.base_mask is None: return
+        self._record('rect_erase', x, y, w, h)
         h_img, w_img = self.base_mask.shape[:2]
         x1, y1 = max(0, x), max(0, y)
         x2, y2 = min(w_img, x + w), min(h_img, y + h)
@@ -650,6 +1642,7 @@ class MainWindow(QMainWindow):
         if self.base_mask is None:
             if self.current_image is None: return
             self.base_mask = np.zeros(self.current_image.shape[:2], dtype=np.uint8)
+        self._record('brush', x, y, is_add)
 
         color = 1 if is_add else 0
         cv2.circle(self.base_mask, (x, y), self.brush_radius, color, -1)
@@ -665,6 +1658,7 @@ class MainWindow(QMainWindow):
             if self.current_image is None: return
             # 如果没有 Mask，创建一个新的
             self.base_mask = np.zeros(self.current_image.shape[:2], dtype=np.uint8)
+        self._record('polygon', [list(p) for p in points])
 
         # 将点列表转换为 OpenCV 需要的 NumPy 数组格式 (int32)
         # points 结构是 [(x1,y1), (x2,y2), ...]
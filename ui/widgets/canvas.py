@@ -2,7 +2,10 @@ import numpy as np
 import cv2
 from PyQt6.QtWidgets import QWidget
 from PyQt6.QtGui import QImage, QPixmap, QPainter, QColor, QPen, QPolygon
-from PyQt6.QtCore import pyqtSignal, Qt, QPoint, QRect
+from PyQt6.QtCore import pyqtSignal, Qt, QPoint, QRect, QRectF
+
+from core.tracing import tracer, image_size
+from core.memory import memory
 
 
 class InteractiveCanvas(QWidget):
@@ -23,6 +26,10 @@ class InteractiveCanvas(QWidget):
         self._image_w = 0
         self._image_h = 0
 
+        # --- 可选的栅格数据源 (多光谱假彩色等)，按视口按需读取 ---
+        self.raster_source = None  # callable(x, y, w, h, step) -> RGB uint8 数组
+        self._raster_cache = None  # (x, y, w, h, step, QPixmap)
+
         # --- 视图变换 ---
         self.scale = 1.0
         self.offset_x = 0.0
@@ -68,8 +75,12 @@ class InteractiveCanvas(QWidget):
         self.update()
 
     def set_image(self, img_np):
+        self.raster_source = None
+        self._raster_cache = None
+        memory.track('pixmap', 'canvas.raster', None)
         if img_np is None:
             self.pixmap_image = None
+            memory.track('pixmap', 'canvas.image', None)
             self.update()
             return
 
@@ -85,36 +96,59 @@ class InteractiveCanvas(QWidget):
 
         self._image_w = w
         self._image_h = h
-        q_img = QImage(img_rgb.data, w, h, w * (3 if ch == 3 else 1), fmt)
-        self.pixmap_image = QPixmap.fromImage(q_img)
+        with tracer.span("canvas.set_image", size=image_size(img_np)):
+            q_img = QImage(img_rgb.data, w, h, w * (3 if ch == 3 else 1), fmt)
+            self.pixmap_image = QPixmap.fromImage(q_img)
+        memory.track('pixmap', 'canvas.image', self.pixmap_image)
 
         self.pixmap_base = None
         self.pixmap_preview = None
+        memory.track('pixmap', 'canvas.mask', None)
+        memory.track('pixmap', 'canvas.preview', None)
         self.fit_to_window()
         self.update()
 
+    def set_raster_source(self, source):
+        """
+        设置底图的替代数据源 (尺寸须与 set_image 的图像一致)，传 None 恢复普通底图。
+        只读取当前视口 (外扩一圈) 的像素，缩小显示时按步长抽样。
+        """
+        self.raster_source = source
+        self._raster_cache = None
+        memory.track('pixmap', 'canvas.raster', None)
+        self.update()
+
     def set_mask(self, mask_np):
         self.pixmap_base = self._make_colored_mask(mask_np, (255, 0, 0))
+        memory.track('pixmap', 'canvas.mask', self.pixmap_base)
         self.update()
 
     def set_preview_mask(self, mask_np):
         self.pixmap_preview = self._make_colored_mask(mask_np, (0, 255, 0))
+        memory.track('pixmap', 'canvas.preview', self.pixmap_preview)
         self.update()
 
     def _make_colored_mask(self, mask_np, color):
         if mask_np is None: return None
-        if mask_np.shape[:2] != (self._image_h, self._image_w):
-            mask_np = cv2.resize(mask_np, (self._image_w, self._image_h), interpolation=cv2.INTER_NEAREST)
+        with tracer.span("canvas.colored_mask", size=image_size(mask_np)):
+            if mask_np.shape[:2] != (self._image_h, self._image_w):
+                mask_np = cv2.resize(mask_np, (self._image_w, self._image_h), interpolation=cv2.INTER_NEAREST)
 
-        mask_rgba = np.zeros((self._image_h, self._image_w, 4), dtype=np.uint8)
-        mask_rgba[mask_np > 0] = [color[0], color[1], color[2], 120]
-        return QPixmap.fromImage(
-            QImage(mask_rgba.data, self._image_w, self._image_h, self._image_w * 4, QImage.Format.Format_RGBA8888))
+            mask_rgba = np.zeros((self._image_h, self._image_w, 4), dtype=np.uint8)
+            mask_rgba[mask_np > 0] = [color[0], color[1], color[2], 120]
+            return QPixmap.fromImage(
+                QImage(mask_rgba.data, self._image_w, self._image_h, self._image_w * 4, QImage.Format.Format_RGBA8888))
 
     # ==========================
     # 绘图事件 (Paint Event)
     # ==========================
     def paintEvent(self, event):
+        # 每帧都会调用，关闭追踪时连标签都不构造
+        if not tracer.enabled: return self._paint()
+        with tracer.span("canvas.paint", size=f"{self._image_w}x{self._image_h}" if self.pixmap_image else None):
+            self._paint()
+
+    def _paint(self):
         painter = QPainter(self)
         painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
 
@@ -124,7 +158,10 @@ class InteractiveCanvas(QWidget):
             painter.scale(self.scale, self.scale)
 
             # 1. 画底图层
-            painter.drawPixmap(0, 0, self.pixmap_image)
+            if self.raster_source is not None:
+                self._draw_raster_viewport(painter)
+            else:
+                painter.drawPixmap(0, 0, self.pixmap_image)
             if self.pixmap_base: painter.drawPixmap(0, 0, self.pixmap_base)
             if self.pixmap_preview: painter.drawPixmap(0, 0, self.pixmap_preview)
 
@@ -159,6 +196,32 @@ class InteractiveCanvas(QWidget):
             painter.setPen(QColor(150, 150, 150))
             painter.drawText(self.rect(), Qt.AlignmentFlag.AlignCenter, "No Image Loaded")
 
+    def _draw_raster_viewport(self, painter):
+        # 当前视口对应的图像区域
+        vx0 = max(0, int(-self.offset_x / self.scale))
+        vy0 = max(0, int(-self.offset_y / self.scale))
+        vx1 = min(self._image_w, int((self.width() - self.offset_x) / self.scale) + 1)
+        vy1 = min(self._image_h, int((self.height() - self.offset_y) / self.scale) + 1)
+        if vx1 <= vx0 or vy1 <= vy0: return
+        step = max(1, int(1 / self.scale))
+
+        cache = self._raster_cache
+        if not (cache and cache[4] == step and cache[0] <= vx0 and cache[1] <= vy0
+                and cache[0] + cache[2] >= vx1 and cache[1] + cache[3] >= vy1):
+            # 外扩半个视口，平移时不必每帧重新读取
+            pad_x, pad_y = (vx1 - vx0) // 2, (vy1 - vy0) // 2
+            x0, y0 = max(0, vx0 - pad_x), max(0, vy0 - pad_y)
+            x1, y1 = min(self._image_w, vx1 + pad_x), min(self._image_h, vy1 + pad_y)
+            rgb = np.ascontiguousarray(self.raster_source(x0, y0, x1 - x0, y1 - y0, step))
+            if rgb.size == 0: return
+            h, w = rgb.shape[:2]
+            pixmap = QPixmap.fromImage(QImage(rgb.data, w, h, w * 3, QImage.Format.Format_RGB888))
+            cache = self._raster_cache = (x0, y0, x1 - x0, y1 - y0, step, pixmap)
+            memory.track('pixmap', 'canvas.raster', pixmap)
+
+        x, y, w, h, _, pixmap = cache
+        painter.drawPixmap(QRectF(x, y, w, h), pixmap, QRectF(pixmap.rect()))
+
     # ==========================
     # 鼠标交互逻辑
     # ==========================
@@ -0,0 +1,174 @@
+from PyQt6.QtWidgets import QListWidget, QListWidgetItem, QListView, QAbstractItemView
+from PyQt6.QtGui import QIcon, QPixmap, QColor
+from PyQt6.QtCore import pyqtSignal, QSize, QPoint, QTimer
+
+from core.memory import memory
+
+
+class ReviewGrid(QListWidget):
+    """
+    审阅网格：所有条目以 图像+Mask 叠加缩略图 平铺显示，双击条目发出 item_activated(行号)。
+    - 只为可见区域 (上下各多一屏) 请求缩略图，滚动停下后才提交
+    - 磁盘缓存命中时直接读取，否则交给 ReviewThumbnailer 的进程池渲染
+    - 同时持有的缩略图超过 MAX_LOADED 张时，释放离可见区域最远的
+    """
+    item_activated = pyqtSignal(int)
+    # 工作线程回到 GUI 线程: generation, 行号, 缓存路径 (失败为 None)
+    _thumb_ready = pyqtSignal(int, int, object)
+
+    MAX_LOADED = 800
+    SCROLL_SETTLE_MS = 60
+
+    def __init__(self, thumbnailer, parent=None):
+        super().__init__(parent)
+        self.thumbnailer = thumbnailer
+        size = thumbnailer.size
+        self.setViewMode(QListView.ViewMode.IconMode)
+        self.setResizeMode(QListView.ResizeMode.Adjust)
+        self.setMovement(QListView.Movement.Static)
+        self.setUniformItemSizes(True)
+        self.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.setIconSize(QSize(size, size))
+        self.setGridSize(QSize(size + 16, size + 36))
+        self.setWordWrap(True)
+
+        placeholder = QPixmap(size, size)
+        placeholder.fill(QColor(60, 60, 60))
+        self._placeholder = QIcon(placeholder)
+        self._sources = []  # 行号 -> (图像路径, mask_spec)
+        self._loaded = {}  # 行号 -> 缩略图字节数
+        self._futures = {}  # 行号 -> 进行中的 Future
+        self._done = set()  # 已加载或确认无法生成的行
+        self._generation = 0
+
+        self._settle_timer = QTimer(self)
+        self._settle_timer.setSingleShot(True)
+        self._settle_timer.setInterval(self.SCROLL_SETTLE_MS)
+        self._settle_timer.timeout.connect(self._load_visible)
+        self.verticalScrollBar().valueChanged.connect(self._settle_timer.start)
+        self.itemDoubleClicked.connect(lambda item: self.item_activated.emit(self.row(item)))
+        self._thumb_ready.connect(self._on_thumb_ready)
+
+    def set_entries(self, entries):
+        """entries: [(显示文字, 图像路径, mask_spec), ...]；行数和文字不变时只刷新来源变化的行"""
+        texts = [e[0] for e in entries]
+        sources = [(e[1], e[2]) for e in entries]
+        same_rows = self.count() == len(entries) and all(
+            self.item(i).text() == t for i, t in enumerate(texts))
+        if same_rows:
+            for row, (old, new) in enumerate(zip(self._sources, sources)):
+                if old != new:
+                    self._drop_future(row)
+                    self._reset_row(row)
+        else:
+            self._invalidate_futures()
+            self.clear()
+            self._loaded.clear()
+            self._done.clear()
+            for text, (img_path, _) in zip(texts, sources):
+                item = QListWidgetItem(self._placeholder, text)
+                item.setToolTip(img_path or "")
+                self.addItem(item)
+        self._sources = sources
+        self._account()
+        self._settle_timer.start()
+
+    def release(self):
+        """离开网格模式：取消渲染，释放全部缩略图"""
+        self._invalidate_futures()
+        for row in list(self._loaded): self._reset_row(row)
+        self._done.clear()
+        self._account()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self._settle_timer.start()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self._settle_timer.start()
+
+    # ==========================
+    # 懒加载
+    # ==========================
+    def _visible_range(self):
+        """当前可见的行区间 [first, last)，上下各外扩一屏"""
+        count = self.count()
+        if count == 0: return 0, 0
+        grid = self.gridSize()
+        view = self.viewport().rect()
+        cols = max(1, view.width() // max(1, grid.width()))
+        top = self.indexAt(QPoint(grid.width() // 2, grid.height() // 2))
+        bottom = self.indexAt(QPoint(grid.width() // 2, view.height() - grid.height() // 2))
+        first = top.row() - top.row() % cols if top.isValid() else 0
+        last = (bottom.row() // cols + 1) * cols if bottom.isValid() else count
+        span = max(cols, last - first)
+        return max(0, first - span), min(count, last + span)
+
+    def _load_visible(self):
+        if not self.isVisible(): return
+        first, last = self._visible_range()
+        # 滚走的行中尚未开始的渲染直接取消
+        self._cancel_rows([r for r in self._futures if not first <= r < last])
+        generation = self._generation
+        for row in range(first, last):
+            if row in self._done or row in self._futures: continue
+            img_path, mask_spec = self._sources[row]
+            if not img_path:
+                self._done.add(row)
+                continue
+            cached = self.thumbnailer.cached(img_path, mask_spec)
+            if cached is not None:
+                self._set_thumbnail(row, cached)
+            else:
+                self._futures[row] = self.thumbnailer.submit(
+                    img_path, mask_spec, lambda path, r=row: self._thumb_ready.emit(generation, r, path))
+        self._evict_far((first + last) // 2)
+        self._account()
+
+    def _cancel_rows(self, rows):
+        """取消尚未开始的渲染；已在运行的保留，结果回来时照常使用"""
+        for row in rows:
+            if self._futures[row].cancel(): del self._futures[row]
+
+    def _drop_future(self, row):
+        future = self._futures.pop(row, None)
+        if future is not None: future.cancel()
+
+    def _invalidate_futures(self):
+        """递增 generation：正在运行的渲染结果回来时会被丢弃"""
+        self._generation += 1
+        for future in self._futures.values():
+            future.cancel()
+        self._futures.clear()
+
+    def _on_thumb_ready(self, generation, row, path):
+        if generation != self._generation or row not in self._futures: return
+        self._futures.pop(row)
+        if path is None:
+            self._done.add(row)
+            self.item(row).setToolTip(f"{self._sources[row][0]} (无法生成缩略图)")
+            return
+        self._set_thumbnail(row, path)
+        self._account()
+
+    def _set_thumbnail(self, row, path):
+        pixmap = QPixmap(path)
+        self._done.add(row)
+        if pixmap.isNull(): return
+        self.item(row).setIcon(QIcon(pixmap))
+        self._loaded[row] = pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+    def _reset_row(self, row):
+        self._loaded.pop(row, None)
+        self._done.discard(row)
+        if row < self.count(): self.item(row).setIcon(self._placeholder)
+
+    def _evict_far(self, center):
+        excess = len(self._loaded) - self.MAX_LOADED
+        if excess <= 0: return
+        for row in sorted(self._loaded, key=lambda r: -abs(r - center))[:excess]:
+            self._reset_row(row)
+
+    def _account(self):
+        memory.track('pixmap', 'review_grid', sum(self._loaded.values()))
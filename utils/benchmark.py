@@ -0,0 +1,313 @@
+# utils/benchmark.py
+# 标注热点路径的无界面基准测试 (Qt offscreen 平台 + 合成数据)，在项目根目录运行:
+#   python -m utils.benchmark --output bench.json                 # 运行并与基线比较
+#   python -m utils.benchmark --save-baseline                     # 把本次结果保存为基线
+#   python -m utils.benchmark --filter canvas --quick             # 只跑名称包含 canvas 的项目，跳过大尺寸
+# 与基线相比中位数变慢超过 --threshold 倍的项目记为回归，此时退出码为 1。
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import cv2
+import numpy as np
+from PyQt6.QtWidgets import QApplication
+from PyQt6.QtGui import QPixmap
+from PyQt6.QtCore import QT_VERSION_STR
+
+from ui.widgets.canvas import InteractiveCanvas
+from core import dir_scanner
+from core.dir_scanner import DirectoryScanner
+from core.json_dataset import LazyJsonDataset
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+CANVAS_SIZES = (512, 2048, 4096)
+JSON_SIZES = (1000, 10000, 100000)
+SCAN_FILES = 10000
+SAM_CHECKPOINT = "checkpoints/sam_vit_b_01ec64.pth"
+
+
+# ==========================
+# 计时与合成数据
+# ==========================
+def summarize(times):
+    ms = sorted(t * 1000.0 for t in times)
+    return {
+        'median_ms': round(ms[len(ms) // 2], 4),
+        'p95_ms': round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 4),
+        'min_ms': round(ms[0], 4),
+        'mean_ms': round(sum(ms) / len(ms), 4),
+        'repeat': len(ms),
+    }
+
+
+def measure(fn, repeat=20, warmup=2, setup=None):
+    """setup 在每次计时前调用，不计入耗时"""
+    for _ in range(warmup):
+        if setup: setup()
+        fn()
+    times = []
+    for _ in range(repeat):
+        if setup: setup()
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return summarize(times)
+
+
+def synthetic_image(size, seed=0):
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+    return cv2.GaussianBlur(img, (0, 0), 3)
+
+
+def synthetic_mask(size, seed=0, blobs=20):
+    rng = np.random.default_rng(seed)
+    mask = np.zeros((size, size), dtype=np.uint8)
+    for _ in range(blobs):
+        cx, cy = rng.integers(0, size, 2)
+        cv2.circle(mask, (int(cx), int(cy)), int(rng.integers(size // 40 + 1, size // 8 + 2)), 1, -1)
+    return mask
+
+
+def synthetic_entry(i):
+    return {
+        "id": f"tile_{i // 8:06d}_obj_{i % 8}",
+        "category": ("building", "car", "tree", "low_vegetation")[i % 4],
+        "image_path_4c": f"/data/tiles/tile_{i // 8:06d}.npy",
+        "image_path_rgb": f"/data/prompts/tile_{i // 8:06d}_obj_{i % 8}.png",
+        "mask_path": f"/data/masks/tile_{i // 8:06d}_obj_{i % 8}.png",
+        "bbox": [i % 500, (i * 7) % 500, 40, 30],
+        "conversations": [
+            {"from": "human", "value": "<image>\nPlease segment the red-roofed building next to the parking lot."},
+            {"from": "gpt", "value": "Sure. [SEG]"},
+        ],
+        "raw_vlm_output": {
+            "simple_instruction": "The red-roofed building",
+            "spatial_instruction": "The building adjacent to the parking lot",
+            "complex_instruction": "The rectangular building with a brown roof and a small courtyard",
+            "reasoning": "It is the only building with a red roof in the tile.",
+        },
+    }
+
+
+class _NoSAM:
+    """处理函数基准不包含 SAM 编码，用它代替真实引擎"""
+
+    def submit_image(self, image_np, callback=None): return 0
+
+    def cancel_pending(self): pass
+
+    def shutdown(self): pass
+
+    def predict_mask(self, points, labels, mask_input=None): return None
+
+
+# ==========================
+# 各项基准
+# ==========================
+def bench_canvas(record, sizes):
+    canvas = InteractiveCanvas()
+    canvas.resize(1280, 800)
+    target = QPixmap(canvas.size())
+    for size in sizes:
+        img, mask = synthetic_image(size), synthetic_mask(size)
+        canvas.set_image(img)
+        record(f"canvas.make_colored_mask[{size}]", measure(lambda: canvas._make_colored_mask(mask, (255, 0, 0))))
+        record(f"canvas.set_image[{size}]", measure(lambda: canvas.set_image(img), repeat=10))
+        canvas.set_mask(mask)
+        canvas.set_preview_mask(synthetic_mask(size, seed=1))
+        record(f"canvas.paintEvent_fit[{size}]", measure(lambda: canvas.render(target)))
+        canvas.scale, canvas.offset_x, canvas.offset_y = 1.0, 0.0, 0.0
+        record(f"canvas.paintEvent_1to1[{size}]", measure(lambda: canvas.render(target)))
+        canvas.fit_to_window()
+
+
+def bench_handlers(record, sizes):
+    from ui.main_window import MainWindow
+    window = MainWindow(sam_engine=_NoSAM())
+    window.resize(1400, 900)
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        img = synthetic_image(size)
+        window.current_image = img
+        window.canvas.set_image(img)
+        window.base_mask = synthetic_mask(size)
+        window.sam_mask = synthetic_mask(size, seed=1)
+        points = iter(rng.integers(0, size, (10000, 2)).tolist())
+        record(f"window.handle_brush_paint[{size}]", measure(lambda: window.handle_brush_paint(*next(points), 1)))
+        center, radius = size // 2, size // 3
+        angles = np.linspace(0, 2 * np.pi, 200, endpoint=False)
+        polygon = [(int(center + radius * np.cos(a)), int(center + radius * np.sin(a))) for a in angles]
+        record(f"window.handle_polygon_fill[{size}]", measure(lambda: window.handle_polygon_fill(polygon)))
+        record(f"window.handle_rect_erase[{size}]",
+               measure(lambda: window.handle_rect_erase(size // 4, size // 4, size // 8, size // 8)))
+        record(f"window.update_canvas_display[{size}]", measure(window.update_canvas_display))
+    window.close()
+
+
+def bench_sam(record, checkpoint):
+    if not os.path.exists(checkpoint):
+        record("sam", {'skipped': f"找不到权重文件: {checkpoint}"})
+        return
+    try:
+        from core.sam_engine import SAMEngine
+        engine = SAMEngine(checkpoint, device="cpu")
+    except Exception as e:
+        record("sam", {'skipped': f"SAM 无法加载: {e}"})
+        return
+    img = synthetic_image(1024)
+    record("sam.set_image[1024]", measure(lambda: engine.set_image(img), repeat=3, warmup=1))
+    record("sam.predict_mask[1pt]", measure(lambda: engine.predict_mask([[512, 512]], [1])))
+    record("sam.predict_mask[3pt]",
+           measure(lambda: engine.predict_mask([[512, 512], [300, 600], [700, 200]], [1, 1, 0])))
+    engine.shutdown()
+
+
+def bench_json(record, sizes, tmp_dir):
+    for n in sizes:
+        path = os.path.join(tmp_dir, f"dataset_{n}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump([synthetic_entry(i) for i in range(n)], f, indent=4, ensure_ascii=False)
+        repeat = 3 if n >= 100000 else 5
+
+        def _json_load():
+            with open(path, 'r', encoding='utf-8') as fp:
+                json.load(fp)
+
+        record(f"json.load_full[{n}]", measure(_json_load, repeat=repeat, warmup=1))
+        record(f"json.lazy_index[{n}]", measure(lambda: LazyJsonDataset(path), repeat=repeat, warmup=1))
+        ds = LazyJsonDataset(path)
+        indices = iter(np.random.default_rng(0).integers(0, n, 10000).tolist())
+        record(f"json.get_item[{n}]", measure(lambda: ds.get_uncached(next(indices)), repeat=200))
+
+        def _edit():
+            ds.get(n // 2)['conversations'][1]['value'] = f"Sure. [SEG] {time.perf_counter()}"
+
+        out_path = os.path.join(tmp_dir, f"dataset_{n}_out.json")
+        record(f"json.save[{n}]", measure(lambda: ds.save(out_path), repeat=repeat, warmup=1, setup=_edit))
+
+
+def bench_scan(record, num_files, tmp_dir):
+    root = os.path.join(tmp_dir, "scan")
+    for d in range(10):
+        sub = os.path.join(root, f"dir_{d}")
+        os.makedirs(sub, exist_ok=True)
+        for i in range(num_files // 10):
+            open(os.path.join(sub, f"img_{i:06d}.png"), 'wb').close()
+            if i % 3 == 0: open(os.path.join(sub, f"img_{i:06d}_mask.png"), 'wb').close()
+    # 索引写到临时目录，不影响用户缓存
+    dir_scanner.INDEX_DIR = os.path.join(tmp_dir, "dir_index")
+
+    def _scan():
+        for _ in DirectoryScanner(root, recursive=True).scan():
+            pass
+
+    def _drop_index():
+        shutil.rmtree(dir_scanner.INDEX_DIR, ignore_errors=True)
+
+    record(f"scan.cold[{num_files}]", measure(_scan, repeat=5, warmup=1, setup=_drop_index))
+    _scan()
+    record(f"scan.warm[{num_files}]", measure(_scan, repeat=5, warmup=1))
+
+
+# ==========================
+# 基线比较
+# ==========================
+def compare(results, baseline, threshold):
+    """在结果中写入与基线的比值，返回回归项目名列表"""
+    regressions = []
+    for name, cur in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base or 'median_ms' not in cur or 'median_ms' not in base: continue
+        ratio = cur['median_ms'] / max(base['median_ms'], 1e-6)
+        cur['baseline_median_ms'] = base['median_ms']
+        cur['ratio'] = round(ratio, 3)
+        if ratio > threshold: regressions.append(name)
+    return regressions
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="标注热点路径的无界面基准测试")
+    parser.add_argument("--output", default=None, help="结果输出路径 (JSON)")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="基线文件路径")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果写入基线文件")
+    parser.add_argument("--threshold", type=float, default=1.2, help="中位数超过基线多少倍记为回归")
+    parser.add_argument("--filter", default=None, help="只运行名称包含该字符串的项目")
+    parser.add_argument("--quick", action="store_true", help="跳过最大尺寸 (4096 图像、10 万条 JSON)")
+    parser.add_argument("--sam-checkpoint", default=SAM_CHECKPOINT)
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    canvas_sizes = CANVAS_SIZES[:-1] if args.quick else CANVAS_SIZES
+    json_sizes = JSON_SIZES[:-1] if args.quick else JSON_SIZES
+    scan_files = SCAN_FILES // 5 if args.quick else SCAN_FILES
+
+    results = {}
+
+    def record(name, stats):
+        results[name] = stats
+        if 'skipped' in stats:
+            print(f"{name:<40} 跳过: {stats['skipped']}")
+        else:
+            print(f"{name:<40} 中位数 {stats['median_ms']:>10.3f} ms   p95 {stats['p95_ms']:>10.3f} ms")
+
+    suites = [
+        ("canvas", lambda tmp: bench_canvas(record, canvas_sizes)),
+        ("window", lambda tmp: bench_handlers(record, canvas_sizes)),
+        ("sam", lambda tmp: bench_sam(record, args.sam_checkpoint)),
+        ("json", lambda tmp: bench_json(record, json_sizes, tmp)),
+        ("scan", lambda tmp: bench_scan(record, scan_files, tmp)),
+    ]
+    with tempfile.TemporaryDirectory(prefix="lisa_bench_") as tmp_dir:
+        for name, suite in suites:
+            if args.filter and args.filter not in name: continue
+            suite(tmp_dir)
+    if args.filter:
+        results = {k: v for k, v in results.items() if args.filter in k}
+
+    report = {
+        'meta': {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'git': _git_revision(), 'python': platform.python_version(),
+                 'platform': platform.platform(), 'qt': QT_VERSION_STR, 'opencv': cv2.__version__,
+                 'numpy': np.__version__, 'quick': args.quick},
+        'results': results,
+    }
+
+    regressions = []
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        report['regressions'] = regressions
+        for name in regressions:
+            r = results[name]
+            print(f"⚠ 回归: {name} {r['baseline_median_ms']:.3f} ms -> {r['median_ms']:.3f} ms (x{r['ratio']})")
+        if not regressions: print("与基线相比没有回归")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+        print(f"基线已保存: {args.baseline}")
+    app.quit()
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,197 @@
+# utils/export_lisa_shards.py
+# 把标注好的 LISA JSON 导出为 WebDataset 风格的 tar 分片，训练节点可顺序流式读取。
+# 在项目根目录运行:
+#   python -m utils.export_lisa_shards dataset.json export_dir --num-shards 64 --workers 8
+# 再次运行时只重写内容有变化的分片，未变化的样本直接从旧分片拷贝，不重新编码。
+import os
+import io
+import re
+import json
+import time
+import hashlib
+import tarfile
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+from core.json_dataset import LazyJsonDataset
+from core.label_map import LABEL_MAP_KEY, LABEL_ID_KEY, read_label_map, entry_mask_path
+from core.sharding import shard_of
+
+MANIFEST_NAME = "manifest.json"
+# 样本 json 中保留的字段，raw_vlm_output 等分析用数据不进入训练分片
+SAMPLE_FIELDS = ('id', 'category', 'bbox', 'conversations')
+# 样本 key 的格式版本，变化后旧分片全部重写
+KEY_VERSION = 2
+
+
+def sample_key(item_id):
+    """
+    WebDataset 用第一个 '.' 之前的部分作为样本 key，所以只保留安全字符；
+    替换会让不同的 id 撞在一起 ("a.b" 与 "a_b")，末尾再加原始 id 的短哈希区分。
+    """
+    raw = str(item_id)
+    digest = hashlib.sha1(raw.encode('utf-8')).hexdigest()[:10]
+    return f"{re.sub(r'[^A-Za-z0-9_-]', '_', raw)}-{digest}"
+
+
+def _file_sig(path):
+    try:
+        st = os.stat(path)
+        return [st.st_mtime_ns, st.st_size]
+    except (OSError, TypeError):
+        return None
+
+
+def fingerprint(entry):
+    """条目内容 + 图像/Mask 文件的 mtime/size，任何一项变化都需要重新导出"""
+    mask_src = entry.get(LABEL_MAP_KEY) or entry_mask_path(entry)
+    payload = json.dumps([entry, _file_sig(entry.get('image_path_rgb')), _file_sig(mask_src)],
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def encode_sample(entry, jpeg_quality):
+    """在子进程中执行：读取并编码一个样本，返回 (id, {扩展名: bytes}) 或 (id, 错误信息)"""
+    item_id = entry.get('id')
+    img = cv2.imread(entry.get('image_path_rgb', ''))
+    if img is None: return item_id, f"图像无法读取: {entry.get('image_path_rgb')}"
+    if entry.get(LABEL_MAP_KEY):
+        labels = read_label_map(entry[LABEL_MAP_KEY])
+        mask = (labels == entry.get(LABEL_ID_KEY)) if labels is not None else None
+    else:
+        raw = cv2.imread(entry_mask_path(entry) or '', cv2.IMREAD_GRAYSCALE)
+        mask = raw > 127 if raw is not None else None
+    if mask is None: return item_id, "Mask 无法读取"
+    if mask.shape != img.shape[:2]: return item_id, f"Mask 尺寸 {mask.shape} 与图像 {img.shape[:2]} 不一致"
+
+    ok_img, img_buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+    ok_mask, mask_buf = cv2.imencode('.png', mask.astype('uint8') * 255)
+    if not (ok_img and ok_mask): return item_id, "编码失败"
+    meta = {k: entry[k] for k in SAMPLE_FIELDS if k in entry}
+    return item_id, {
+        'jpg': img_buf.tobytes(),
+        'mask.png': mask_buf.tobytes(),
+        'json': json.dumps(meta, ensure_ascii=False).encode('utf-8'),
+    }
+
+
+def _read_shard(path):
+    """读取旧分片，返回 {key: {扩展名: bytes}}"""
+    samples = {}
+    if not os.path.exists(path): return samples
+    with tarfile.open(path, 'r') as tar:
+        for member in tar:
+            if not member.isfile(): continue
+            key, ext = member.name.split('.', 1)
+            samples.setdefault(key, {})[ext] = tar.extractfile(member).read()
+    return samples
+
+
+def _write_shard(path, samples):
+    """samples: [(key, {扩展名: bytes})]；固定 mtime/uid，保证同样内容产生同样的文件"""
+    tmp_path = path + ".tmp"
+    with tarfile.open(tmp_path, 'w', format=tarfile.USTAR_FORMAT) as tar:
+        for key, files in samples:
+            for ext in ('jpg', 'mask.png', 'json'):
+                info = tarfile.TarInfo(f"{key}.{ext}")
+                info.size = len(files[ext])
+                info.mtime = 0
+                info.mode = 0o644
+                tar.addfile(info, io.BytesIO(files[ext]))
+    os.replace(tmp_path, path)
+
+
+def export(input_json, out_dir, num_shards=64, workers=None, jpeg_quality=95):
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            old = json.load(f)
+    except (OSError, ValueError):
+        old = {}
+    settings = {'num_shards': num_shards, 'jpeg_quality': jpeg_quality, 'key_version': KEY_VERSION}
+    old_items = old.get('items', {}) if old.get('settings') == settings else {}
+
+    # 1. 计算每个条目的分片与指纹 (只在内存中保留索引和指纹，完整条目读完即丢弃)
+    dataset = LazyJsonDataset(input_json)
+    shard_ids = {s: [] for s in range(num_shards)}  # 分片 -> [(条目序号, id), ...]
+    fingerprints = {}
+    for i in range(len(dataset)):
+        entry = dataset.get_uncached(i)
+        item_id = str(entry.get('id'))
+        if item_id in fingerprints:
+            print(f"重复的 id 被跳过: {item_id}")
+            continue
+        fingerprints[item_id] = fingerprint(entry)
+        shard_ids[shard_of(item_id, num_shards)].append((i, item_id))
+
+    # 2. 找出需要重写的分片：有新增、修改或删除的条目
+    dirty = set()
+    for s, members in shard_ids.items():
+        ids = {item_id for _, item_id in members}
+        old_ids = {k for k, v in old_items.items() if v['shard'] == s}
+        if ids != old_ids or any(old_items[k]['fp'] != fingerprints[k] for k in ids):
+            dirty.add(s)
+        if not os.path.exists(os.path.join(out_dir, f"lisa-{s:05d}.tar")) and ids:
+            dirty.add(s)
+
+    new_items, errors, encoded = {}, {}, 0
+    for item_id, fp in fingerprints.items():
+        if item_id in old_items and old_items[item_id]['fp'] == fp:
+            new_items[item_id] = old_items[item_id]
+
+    # 3. 重写脏分片：未变化的样本从旧分片拷贝，变化的样本在进程池中重新编码
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for s in sorted(dirty):
+            path = os.path.join(out_dir, f"lisa-{s:05d}.tar")
+            entries = [dataset.get_uncached(i) for i, _ in shard_ids[s]]
+            old_samples = _read_shard(path)
+            reuse = {}
+            todo = []
+            for entry in entries:
+                item_id = str(entry.get('id'))
+                key = sample_key(item_id)
+                if item_id in new_items and key in old_samples:
+                    reuse[item_id] = old_samples[key]
+                else:
+                    todo.append(entry)
+            results = pool.map(encode_sample, todo, [jpeg_quality] * len(todo), chunksize=8)
+            for item_id, result in results:
+                item_id = str(item_id)
+                if isinstance(result, str):
+                    errors[item_id] = result
+                    continue
+                reuse[item_id] = result
+                new_items[item_id] = {'shard': s, 'fp': fingerprints[item_id]}
+                encoded += 1
+            samples = [(sample_key(i), reuse[i]) for i in sorted(reuse)]
+            if samples:
+                _write_shard(path, samples)
+            elif os.path.exists(path):
+                os.remove(path)
+
+    manifest = {'settings': settings, 'exported_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'items': new_items, 'errors': errors}
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+    print(f"样本 {len(new_items)} 个, 本次编码 {encoded} 个, 重写分片 {len(dirty)}/{num_shards}, 失败 {len(errors)} 个")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出 LISA 训练集为 tar 分片 (WebDataset 格式)")
+    parser.add_argument("input_json")
+    parser.add_argument("out_dir")
+    parser.add_argument("--num-shards", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=None, help="编码进程数，默认 CPU 核数")
+    parser.add_argument("--jpeg-quality", type=int, default=95)
+    args = parser.parse_args()
+    export(args.input_json, args.out_dir, args.num_shards, args.workers, args.jpeg_quality)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# utils/label_map_convert.py
+# 在项目根目录运行:
+#   python -m utils.label_map_convert to-labels dataset.json dataset_labels.json --out-dir labels --format png
+#   python -m utils.label_map_convert to-pngs dataset_labels.json dataset.json --out-dir masks
+import argparse
+import json
+
+from core.label_map import entries_to_label_maps, label_maps_to_entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="逐对象 Mask PNG 与单文件标签图之间互相转换")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_labels = sub.add_parser("to-labels", help="逐对象 PNG -> 每张源图一个标签图")
+    p_labels.add_argument("input_json")
+    p_labels.add_argument("output_json")
+    p_labels.add_argument("--out-dir", required=True, help="标签图输出目录")
+    p_labels.add_argument("--format", choices=["png", "npz"], default="png", help="uint16 PNG 或压缩 npz")
+    p_labels.add_argument("--remove-pngs", action="store_true",
+                          help="删除已转换对象的 PNG (有重叠对象的源图整组保留)")
+
+    p_pngs = sub.add_parser("to-pngs", help="标签图 -> 逐对象 PNG")
+    p_pngs.add_argument("input_json")
+    p_pngs.add_argument("output_json")
+    p_pngs.add_argument("--out-dir", default=None, help="条目没有 mask_path 时的输出目录")
+
+    args = parser.parse_args()
+    with open(args.input_json, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+
+    if args.command == "to-labels":
+        stats = entries_to_label_maps(entries, args.out_dir, fmt=args.format, remove_pngs=args.remove_pngs)
+        print(f"源图 {stats['groups']} 张, 对象 {stats['objects']} 个, 缺失/尺寸不符 {stats['missing']} 个, "
+              f"与其他对象重叠而保留 PNG {stats['overlapping']} 个, 删除 PNG {stats['removed']} 个")
+    else:
+        print(f"已写出 {label_maps_to_entries(entries, args.out_dir)} 个 PNG")
+
+    with open(args.output_json, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, ensure_ascii=False, indent=4)
+
+
+if __name__ == "__main__":
+    main()
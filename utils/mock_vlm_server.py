@@ -0,0 +1,84 @@
+# utils/mock_vlm_server.py
+# 本地 OpenAI 兼容 mock 服务，用来离线测试 qwen_vl_generte.py 的并发、限流与重试:
+#   python utils/mock_vlm_server.py --port 8000 --latency 0.5 --fail-rate 0.1
+#   QWEN_BASE_URL=http://127.0.0.1:8000/v1 python -m utils.qwen_vl_generte
+import re
+import json
+import time
+import random
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_answer(prompt):
+    """按 prompt 中的类别生成固定格式的回答；批量 prompt 按编号返回 objects 列表"""
+    objects = re.findall(r"Object (\d+):\s*([^\n]+)", prompt)
+    if objects:
+        return {"objects": [dict(index=int(n), **_fake_object(category.strip())) for n, category in objects]}
+    match = re.search(r"Target Category\**:\s*([^\n]+)", prompt)
+    return _fake_object(match.group(1).strip() if match else "object")
+
+
+def _fake_object(category):
+    return {
+        "simple_instruction": f"The red-roofed {category}",
+        "spatial_instruction": f"The {category} adjacent to the parking lot",
+        "complex_instruction": f"The rectangular {category} with a brown roof",
+        "reasoning": "mock",
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    latency = 0.0
+    fail_rate = 0.0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        time.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if random.random() < self.fail_rate:
+            status = random.choice([429, 500, 503])
+            return self._reply(status, {"error": {"message": "mock failure", "code": status}})
+        prompt = ""
+        for message in body.get('messages', []):
+            content = message.get('content')
+            if isinstance(content, list):
+                prompt += "".join(part.get('text', '') for part in content if part.get('type') == 'text')
+            elif isinstance(content, str):
+                prompt += content
+        self._reply(200, {
+            "id": f"chatcmpl-mock-{random.getrandbits(32):08x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get('model', 'mock'),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": json.dumps(fake_answer(prompt))}}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的 mock VLM 服务")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.2, help="平均响应延迟 (秒)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="随机返回 429/5xx 的比例")
+    args = parser.parse_args()
+    Handler.latency = args.latency
+    Handler.fail_rate = args.fail_rate
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), Handler)
+    print(f"mock 服务已启动: http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,71 @@
 import os
+import glob
 import json
 import base64
 import time
 import random
+import asyncio
+import argparse
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
 from tqdm import tqdm
-from openai import OpenAI
+import openai
+from openai import AsyncOpenAI
+
+from core.raster_reader import open_raster
+from core.sharding import shard_of
 
 # ================= 配置区域 =================
-API_KEY = "sk-6e57ca6470284b42ace045432d98e6bd"
-BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+# 可用环境变量覆盖，例如指向本地 mock 服务离线测试:
+#   QWEN_BASE_URL=http://127.0.0.1:8000/v1 python -m utils.qwen_vl_generte   (在项目根目录运行)
+# 多机 / 多进程：每台机器跑一个分片，最后合并:
+#   python -m utils.qwen_vl_generte run --data-root /data/xxx --shard 0 --num-shards 4 --limit 0
+#   python -m utils.qwen_vl_generte merge --data-root /data/xxx --num-shards 4 --report coverage.json
+API_KEY = os.environ.get("QWEN_API_KEY", "sk-6e57ca6470284b42ace045432d98e6bd")
+BASE_URL = os.environ.get("QWEN_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")
 MODEL_NAME = "qwen-vl-max"
 
 DATA_ROOT = "/Users/cuimingcan/Downloads/Potsdam/SegImage_Output_2"
 INPUT_METADATA = os.path.join(DATA_ROOT, "step1_metadata.json")
 OUTPUT_JSON = os.path.join(DATA_ROOT, "step2_dataset_qwen_varied.json")  # 改个名区分一下
+# 生成过程中逐条追加到同名 .jsonl (分片运行时为 .shardXXX-of-NNN.jsonl)，结束时再转换为 LISA 的 JSON 数组
 
 TEST_MODE = True
-TEST_COUNT = 50  # 测试5个看看效果
+TEST_COUNT = 50  # 测试5个看看效果 (命令行 --limit 覆盖，0 为不限)
+
+# 并发与限流
+CONCURRENCY = 8  # 同时在途的请求数
+REQUESTS_PER_SECOND = 4.0  # 令牌桶速率 (按服务端 QPS 限额设置)
+BURST = 8  # 令牌桶容量
+REQUEST_TIMEOUT = 120.0  # 单次请求超时 (秒)
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0  # 指数退避: 第 n 次重试前等待 U(0, min(BACKOFF_MAX, BACKOFF_BASE * 2^n)) 秒
+BACKOFF_MAX = 60.0
+SEED = 0  # 模板随机选择按 (SEED, id) 取种子，同一 id 每次生成的句式相同，与完成顺序无关
+
+# 上传图像预处理：长边缩到 PAYLOAD_MAX_SIDE 后重新编码为 JPEG，base64 结果按 (文件哈希, 参数) 缓存
+PAYLOAD_MAX_SIDE = 1024
+PAYLOAD_JPEG_QUALITY = 90
+PAYLOAD_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "lisa_label", "vlm_payload")
+PREP_WORKERS = 4  # 预处理线程数
+PREP_AHEAD = 32  # 预处理最多领先请求多少张
+
+# 模型原始输出按 (图像内容哈希, 类别, 模型, prompt 哈希) 缓存；只改模板重新组装时不再请求 API
+RESPONSE_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "lisa_label", "vlm_responses")
+REGENERATE = False  # True: 已有输出备份为 .bak 后全部重新组装 (命中响应缓存的条目不请求 API)
+
+# 批量模式：同一源图上的多个对象画成编号框，一次请求生成全部对象的描述；解析失败的对象逐条回退
+BATCH_MODE = False
+BATCH_MAX_OBJECTS = 8  # 每次请求最多包含的对象数
+BBOX_FORMAT = "xywh"  # step1 中 bbox 的格式: "xywh" 或 "xyxy"
+BOX_COLORS = [(255, 255, 0), (0, 0, 255), (0, 255, 0), (255, 0, 255), (0, 165, 255), (255, 0, 0), (0, 255, 255),
+              (255, 255, 255)]  # BGR
 # ===========================================
 
-client = OpenAI(
-    api_key=API_KEY,
-    base_url=BASE_URL,
-    timeout=120.0,
-    max_retries=3
-)
-
 # ================= 定义多样化模板 (User & GPT) =================
 # 这里的 {} 会被 Qwen 生成的名词短语替换 (例如 "the red car")
 HUMAN_QUESTION_TEMPLATES = [
@@ -51,15 +91,157 @@ GPT_ANSWER_TEMPLATES = [
 ]
 
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+def read_image(path):
+    """返回 (文件内容, 内容哈希)，读取失败时返回 (None, None)"""
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+    except OSError:
+        return None, None
+    return raw, hashlib.blake2b(raw, digest_size=16).hexdigest()
 
 
-def generate_caption_with_retry(image_path, category, max_retries=3):
+def prepare_job(item):
     """
-    句式的变化由 Python 代码来完成。
+    在线程池中执行：返回 (base64 JPEG, 图像内容哈希, 缓存的模型输出)。
+    命中响应缓存时不再准备图像；图像无法读取或解码时前两项为 None。
+    """
+    raw, file_hash = read_image(item['visual_prompt_path'])
+    if raw is None: return None, None, None
+    cached = load_cached_response(file_hash, item['category'])
+    if cached is not None: return None, file_hash, cached
+    return prepare_payload(raw, file_hash), file_hash, None
+
+
+def prepare_batch_job(items):
+    """
+    在线程池中执行：返回 (编号框图像的 base64 JPEG, {id: 图像哈希}, {id: 缓存的模型输出}, 需要请求的条目)。
+    需要请求的条目不足两个或源图不可用时 base64 为 None，由调用方逐条请求。
+    """
+    hashes, cached, todo = {}, {}, []
+    for item in items:
+        _, file_hash = read_image(item['visual_prompt_path'])
+        hashes[item['id']] = file_hash
+        result = load_cached_response(file_hash, item['category']) if file_hash else None
+        if result is not None:
+            cached[item['id']] = result
+        else:
+            todo.append(item)
+    payload = None
+    if len(todo) > 1:
+        img = render_batch_image(todo)
+        if img is not None: payload = encode_payload(img)
+    return payload, hashes, cached, todo
+
+
+def prepare_payload(raw, file_hash):
+    """
+    缩放并重新编码为 JPEG，返回 base64 字符串，无法解码时返回 None。
+    缓存键包含文件内容哈希和缩放/质量参数，修改参数后自动失效。
     """
+    key = hashlib.sha1(f"{file_hash}:{PAYLOAD_MAX_SIDE}:{PAYLOAD_JPEG_QUALITY}".encode('utf-8')).hexdigest()
+    cache_path = os.path.join(PAYLOAD_CACHE_DIR, key[:2], key + ".b64")
+    try:
+        with open(cache_path, "r", encoding='ascii') as f:
+            return f.read()
+    except OSError:
+        pass
+
+    img = cv2.imdecode(np.frombuffer(raw, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None: return None
+    payload = encode_payload(img)
+    if payload is not None: _write_cache_file(cache_path, payload)
+    return payload
+
+
+def encode_payload(img):
+    """BGR 图像长边缩到 PAYLOAD_MAX_SIDE 后编码为 JPEG base64"""
+    h, w = img.shape[:2]
+    scale = PAYLOAD_MAX_SIDE / max(h, w)
+    if scale < 1:
+        img = cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, PAYLOAD_JPEG_QUALITY])
+    if not ok: return None
+    return base64.b64encode(buf.tobytes()).decode('ascii')
+
+
+def batch_key(item):
+    """同一源图的对象合并请求；优先按 source_image，其次按 4 通道源图"""
+    return item.get('source_image') or item.get('image_path_4c') or item['visual_prompt_path']
+
+
+def group_batches(items):
+    """按源图分组并切成不超过 BATCH_MAX_OBJECTS 的批次，保持输入顺序"""
+    groups = {}
+    for item in items:
+        groups.setdefault(batch_key(item), []).append(item)
+    for group in groups.values():
+        for i in range(0, len(group), BATCH_MAX_OBJECTS):
+            yield group[i:i + BATCH_MAX_OBJECTS]
+
+
+def render_batch_image(items):
+    """在源图上画出编号框 (BGR)；源图不可用或 bbox 格式不对时返回 None"""
+    img = cv2.imread(items[0]['source_image']) if items[0].get('source_image') else None
+    if img is None:
+        raster = open_raster(items[0].get('image_path_4c'))
+        if raster is None or raster.bands < 3: return None
+        img = cv2.cvtColor(raster.read_composite("RGB"), cv2.COLOR_RGB2BGR)
+    h, w = img.shape[:2]
+    thickness = max(2, round(max(h, w) / 400))
+    try:
+        for n, item in enumerate(items, 1):
+            x0, y0, a, b = [int(round(v)) for v in item['bbox']]
+            x1, y1 = (x0 + a, y0 + b) if BBOX_FORMAT == "xywh" else (a, b)
+            color = BOX_COLORS[(n - 1) % len(BOX_COLORS)]
+            cv2.rectangle(img, (x0, y0), (x1, y1), color, thickness)
+            cv2.putText(img, str(n), (x0 + thickness, max(y0 - 2 * thickness, 12 * thickness)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5 * thickness, color, thickness)
+    except (KeyError, TypeError, ValueError):
+        return None
+    return img
+
+
+def _write_cache_file(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class TokenBucket:
+    """令牌桶限流：平均 rate 次/秒，允许突发 capacity 次"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def backoff_delay(attempt):
+    """指数退避 + 全抖动，避免大量并发请求在同一时刻重试"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+# 参数错误、鉴权失败等重试也不会成功的错误
+FATAL_ERRORS = (openai.BadRequestError, openai.AuthenticationError, openai.PermissionDeniedError)
+
+
+def build_prompt(category):
     system_prompt = "You are an expert Remote Sensing Analyst. You answer strictly in JSON."
 
     user_prompt = f"""
@@ -86,12 +268,137 @@ def generate_caption_with_retry(image_path, category, max_retries=3):
         "reasoning": "Explanation of why this object matches." 
     }}
     """
+    return system_prompt, user_prompt
+
+
+BATCH_USER_PROMPT = """
+    # Role
+    You are a geospatial expert creating a training dataset for Referring Segmentation.
+
+    # Input Status
+    - The image contains {count} target objects, each marked by a numbered colored box:
+{objects}
+    - **Visual Cue**: Numbered Boxes (Ignore the box artifacts and numbers in output).
+
+    # Task
+    For EACH numbered object, generate 3 distinct **Referring Expressions** (Target Noun Phrases) that uniquely identify it among all objects in the image.
+
+    # CRITICAL GRAMMAR CONSTRAINTS
+    1. **NOUN PHRASES ONLY**: e.g., "The red car", "The building next to the tree". NO complete sentences like "There is a car".
+    2. **Start with 'The'**: Always start with "The".
+    3. **No UI Mentions**: Do not mention the boxes, the numbers or the box colors.
+
+    # Output Format (JSON)
+    {{
+        "objects": [
+            {{
+                "index": 1,
+                "simple_instruction": "Short phrase.",
+                "spatial_instruction": "Location phrase.",
+                "complex_instruction": "Detailed phrase.",
+                "reasoning": "Explanation of why this object matches."
+            }}
+        ]
+    }}
+    Return exactly one entry per numbered object.
+    """
+
+RESPONSE_FIELDS = ("simple_instruction", "spatial_instruction", "complex_instruction", "reasoning")
+
+
+def build_batch_prompt(items):
+    system_prompt, _ = build_prompt("")
+    objects = "\n".join(f"      - Object {n}: {item['category']}" for n, item in enumerate(items, 1))
+    return system_prompt, BATCH_USER_PROMPT.format(count=len(items), objects=objects)
+
+
+def split_batch_response(data, items):
+    """按编号把批量输出拆回各条目 {id: 输出}；缺失或格式不对的编号不返回，由调用方逐条回退"""
+    objects = data.get('objects') if isinstance(data, dict) else None
+    if not isinstance(objects, list): return {}
+    results = {}
+    for obj in objects:
+        if not isinstance(obj, dict): continue
+        try:
+            n = int(obj.get('index'))
+        except (TypeError, ValueError):
+            continue
+        if not 1 <= n <= len(items): continue
+        result = {k: obj[k] for k in RESPONSE_FIELDS if isinstance(obj.get(k), str) and obj[k].strip()}
+        if any(k in result for k in RESPONSE_FIELDS[:3]): results[items[n - 1]['id']] = result
+    return results
+
+
+def parse_response(content):
+    if content.startswith("```json"):
+        content = content.replace("```json", "").replace("```", "")
+    elif content.startswith("```"):
+        content = content.replace("```", "")
+    return json.loads(content)
+
+
+# ==========================
+# 模型输出缓存
+# ==========================
+def prompt_hash(category, batched=False):
+    """批量请求的 prompt 与同批的其他对象有关，按模板本身取哈希"""
+    system_prompt, user_prompt = build_prompt(category)
+    if batched: user_prompt = BATCH_USER_PROMPT
+    return hashlib.sha1(f"{system_prompt}\0{user_prompt}".encode('utf-8')).hexdigest()
+
+
+def response_cache_path(file_hash, category, batched=False):
+    key = hashlib.sha1(json.dumps([file_hash, category, MODEL_NAME, prompt_hash(category, batched)],
+                                  ensure_ascii=False).encode('utf-8')).hexdigest()
+    return os.path.join(RESPONSE_CACHE_DIR, key[:2], key + ".json")
+
+
+def load_cached_response(file_hash, category):
+    """单独请求和批量请求的输出都可用，优先单独请求的"""
+    for batched in (False, True):
+        try:
+            with open(response_cache_path(file_hash, category, batched), "r", encoding='utf-8') as f:
+                return json.load(f)['response']
+        except (OSError, ValueError, KeyError):
+            pass
+    return None
+
+
+def store_response(file_hash, category, result, batched=False):
+    if file_hash is None: return
+    record = {'image_hash': file_hash, 'category': category, 'model': MODEL_NAME,
+              'prompt_hash': prompt_hash(category, batched), 'batched': batched, 'created': time.time(),
+              'response': result}
+    _write_cache_file(response_cache_path(file_hash, category, batched), json.dumps(record, ensure_ascii=False))
+
+
+async def generate_caption_with_retry(client, limiter, base64_image, category, max_retries=MAX_RETRIES):
+    """
+    句式的变化由 Python 代码来完成。
+    base64_image 由 prepare_job 预先准备好 (JPEG)。返回解析后的 dict，失败返回 None。
+    """
+    system_prompt, user_prompt = build_prompt(category)
+    return await request_json_with_retry(client, limiter, system_prompt, user_prompt, base64_image, max_retries)
 
-    base64_image = encode_image(image_path)
 
+async def generate_batch_with_retry(client, limiter, base64_image, items, max_retries=MAX_RETRIES):
+    """一次请求生成多个对象的描述，返回 {id: 输出}；输出无法解析时不重试，直接返回已拆出的部分"""
+    system_prompt, user_prompt = build_batch_prompt(items)
+    data = await request_json_with_retry(client, limiter, system_prompt, user_prompt, base64_image, max_retries,
+                                         retry_invalid_json=False)
+    return split_batch_response(data, items) if data is not None else {}
+
+
+async def request_json_with_retry(client, limiter, system_prompt, user_prompt, base64_image, max_retries=MAX_RETRIES,
+                                  retry_invalid_json=True):
+    """
+    每次尝试先从令牌桶取令牌，超时或失败后按指数退避重试；返回解析后的 JSON，失败返回 None。
+    retry_invalid_json=False 时返回内容无法解析不再重试。
+    """
     for attempt in range(max_retries):
+        await limiter.acquire()
         try:
-            completion = client.chat.completions.create(
+            completion = await asyncio.wait_for(client.chat.completions.create(
                 model=MODEL_NAME,
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -105,111 +412,435 @@ def generate_caption_with_retry(image_path, category, max_retries=3):
                 ],
                 response_format={"type": "json_object"},
                 temperature=0.3,  # 稍微调高一点点温度，增加词汇丰富度
-            )
+            ), timeout=REQUEST_TIMEOUT)
+            return parse_response(completion.choices[0].message.content)
+
+        except ValueError as e:
+            if not retry_invalid_json or attempt == max_retries - 1:
+                print(f"Error: 返回内容无法解析 ({e})")
+                return None
+            print(f"Error: 返回内容无法解析 ({e}), 重试...")
+        except FATAL_ERRORS as e:
+            print(f"Error: {e}, 不再重试")
+            return None
+        except Exception as e:
+            if attempt == max_retries - 1:
+                print(f"Error: {e!r}, 已重试 {max_retries} 次，放弃")
+                return None
+            delay = backoff_delay(attempt)
+            print(f"Error: {e!r}, {delay:.1f}s 后重试...")
+            await asyncio.sleep(delay)
+
+
+def build_lisa_entry(item, result):
+    """由模型输出和模板组装 LISA 条目；随机数按 id 取种子，结果只取决于 id 与模型输出"""
+    rng = random.Random(f"{SEED}:{item['id']}")
+
+    # 1. 随机选择一种描述风格 (简单/空间/复杂)
+    style = rng.choice(["simple_instruction", "spatial_instruction", "complex_instruction"])
+    noun_phrase = result.get(style, f"The {item['category']}")
+
+    # 2. 处理首字母大小写，使其能融入句子
+    # 如果名词短语是 "The red car"，变成 "the red car" 以便放入 "Please segment..."
+    # 但如果模板就是 "{}" (只有短语)，则保持 "The red car"
+
+    # 随机选一个人类提问模板
+    human_tmpl = rng.choice(HUMAN_QUESTION_TEMPLATES)
+
+    # 简单的逻辑：如果模板开头不是 "{", 说明有前缀词，需要把名词首字母小写
+    if not human_tmpl.startswith("{"):
+        # 把 "The" 变成 "the"
+        if noun_phrase.startswith("The "):
+            noun_phrase_formatted = "the " + noun_phrase[4:]
+        else:
+            noun_phrase_formatted = noun_phrase.lower()  # 兜底
+    else:
+        # 如果模板只是 "{}"，保持首字母大写
+        noun_phrase_formatted = noun_phrase
+
+    # 组装 Question
+    # 移除可能重复的句号
+    final_question = human_tmpl.format(noun_phrase_formatted)
+    if final_question.endswith(".."): final_question = final_question[:-1]
+
+    # 3. 随机选一个 GPT 回答模板 (不再包含 Reasoning)
+    gpt_response = rng.choice(GPT_ANSWER_TEMPLATES)
+
+    return {
+        "id": item['id'],
+        "image_path_4c": item['image_path_4c'],
+        "image_path_rgb": item['visual_prompt_path'],
+        "mask_path": item['training_mask_path'],
+        "bbox": item['bbox'],
+        "conversations": [
+            {
+                "from": "human",
+                "value": f"<image>\n{final_question}"
+            },
+            {
+                "from": "gpt",
+                "value": gpt_response
+            }
+        ],
+        # 依然保存原始 Reasoning 供以后分析，但不在 conversations 里展示
+        "raw_vlm_output": result
+    }
 
-            content = completion.choices[0].message.content
-            if content.startswith("```json"):
-                content = content.replace("```json", "").replace("```", "")
-            elif content.startswith("```"):
-                content = content.replace("```", "")
-            return json.loads(content)
 
-        except Exception as e:
-            print(f"Error: {e}, Retrying...")
-            time.sleep(2)
-            if attempt == max_retries - 1: return None
+# ==========================
+# JSONL 输出与断点续跑
+# ==========================
+def ids_path(jsonl_path):
+    """已完成 id 的旁路索引，每行一个 id (JSON 字符串)"""
+    return jsonl_path + ".ids"
 
 
-def main():
-    if not os.path.exists(INPUT_METADATA):
-        print(f"找不到输入文件: {INPUT_METADATA}")
+class JsonlWriter:
+    """
+    逐条追加并 fsync，每条的开销与已有数据量无关；进程被杀时最多丢失正在写的一条。
+    先写记录再写 id 索引，索引中的 id 一定有对应的完整记录。
+    """
+
+    def __init__(self, jsonl_path):
+        _truncate_partial_line(jsonl_path)
+        _truncate_partial_line(ids_path(jsonl_path))
+        self._data = open(jsonl_path, 'ab')
+        self._ids = open(ids_path(jsonl_path), 'ab')
+        self._lock = threading.Lock()
+
+    def append(self, entry):
+        line = json.dumps(entry, ensure_ascii=False).encode('utf-8') + b"\n"
+        id_line = json.dumps(entry['id'], ensure_ascii=False).encode('utf-8') + b"\n"
+        with self._lock:
+            for f, data in ((self._data, line), (self._ids, id_line)):
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def close(self):
+        self._data.close()
+        self._ids.close()
+
+
+def _truncate_partial_line(path):
+    """去掉崩溃时写了一半的最后一行"""
+    if not os.path.exists(path): return
+    with open(path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0: return
+        pos = size
+        while pos > 0:
+            step = min(65536, pos)
+            f.seek(pos - step)
+            chunk = f.read(step)
+            nl = chunk.rfind(b"\n")
+            if nl >= 0:
+                pos = pos - step + nl + 1
+                break
+            pos -= step
+        if pos != size: f.truncate(pos)
+
+
+def scan_ids(jsonl_path):
+    """
+    读取已完成的 id：优先读旁路索引；索引缺失或行数与 JSONL 不一致时，
+    逐行只解码 id 字段 (记录总是以 {"id": 开头)，不解析整条记录。
+    """
+    if not os.path.exists(jsonl_path): return set()
+    _truncate_partial_line(jsonl_path)
+    with open(jsonl_path, 'rb') as f:
+        records = sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1 << 20), b""))
+    try:
+        with open(ids_path(jsonl_path), 'r', encoding='utf-8') as f:
+            ids = [json.loads(line) for line in f if line.strip()]
+        if len(ids) == records: return set(ids)
+    except (OSError, ValueError):
+        pass
+    decoder = json.JSONDecoder()
+    ids = []
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('{"id": '):
+                ids.append(decoder.raw_decode(line, 7)[0])
+            elif line.strip():
+                ids.append(json.loads(line)['id'])
+    # 重建索引
+    with open(ids_path(jsonl_path), 'w', encoding='utf-8') as f:
+        for item_id in ids:
+            f.write(json.dumps(item_id, ensure_ascii=False) + "\n")
+    return set(ids)
+
+
+def jsonl_to_json(jsonl_path, json_path):
+    """流式转换为 LISA JSON 数组，返回条目数"""
+    return len(merge_jsonl([jsonl_path], json_path)[0])
+
+
+def merge_jsonl(jsonl_paths, json_path):
+    """
+    按顺序合并多个 JSONL，流式写出 LISA JSON 数组，输出与 json.dump(..., indent=4, ensure_ascii=False) 一致；
+    同一 id 只保留第一条。返回 (写出的 id 集合, 重复条数)。
+    """
+    seen = set()
+    duplicates = 0
+    tmp_path = json_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as dst:
+        dst.write("[")
+        for jsonl_path in jsonl_paths:
+            with open(jsonl_path, 'r', encoding='utf-8') as src:
+                for line in src:
+                    if not line.strip(): continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        print(f"跳过损坏的行: {jsonl_path}")
+                        continue
+                    if entry['id'] in seen:
+                        duplicates += 1
+                        continue
+                    body = json.dumps(entry, indent=4, ensure_ascii=False).replace("\n", "\n    ")
+                    dst.write(("," if seen else "") + "\n    " + body)
+                    seen.add(entry['id'])
+        dst.write("\n]" if seen else "]")
+    os.replace(tmp_path, json_path)
+    return seen, duplicates
+
+
+def migrate_legacy_output(json_path, jsonl_path):
+    """旧版本只写 OUTPUT_JSON；第一次运行新版本时把已有结果转成 JSONL，避免重复请求"""
+    if os.path.exists(jsonl_path) or not os.path.exists(json_path): return
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            legacy = json.load(f)
+    except (OSError, ValueError):
         return
+    writer = JsonlWriter(jsonl_path)
+    try:
+        for entry in legacy:
+            writer.append(entry)
+    finally:
+        writer.close()
 
-    with open(INPUT_METADATA, 'r') as f:
-        data_list = json.load(f)
 
-    processed_ids = set()
-    existing_data = []
+def shard_output_path(output_json, shard, num_shards):
+    """分片运行时每个分片写自己的 JSONL，互不干扰"""
+    if num_shards <= 1: return os.path.splitext(output_json)[0] + ".jsonl"
+    return f"{os.path.splitext(output_json)[0]}.shard{shard:03d}-of-{num_shards:03d}.jsonl"
 
-    if os.path.exists(OUTPUT_JSON):
-        try:
-            with open(OUTPUT_JSON, 'r', encoding='utf-8') as f:
-                existing_data = json.load(f)
-                for item in existing_data:
-                    processed_ids.add(item['id'])
-        except:
-            existing_data = []
 
-    todos = [item for item in data_list if item['id'] not in processed_ids]
-    if TEST_MODE: todos = todos[:TEST_COUNT]
+async def run(input_metadata=INPUT_METADATA, output_json=OUTPUT_JSON, shard=0, num_shards=1,
+              limit=TEST_COUNT if TEST_MODE else 0):
+    """num_shards > 1 时只处理 shard_of(id) == shard 的条目，结果留在分片 JSONL 中，由 merge 合并"""
+    if not os.path.exists(input_metadata):
+        print(f"找不到输入文件: {input_metadata}")
+        return
 
-    for i, item in enumerate(tqdm(todos)):
-        vis_path = item['visual_prompt_path']
-        if not os.path.exists(vis_path): continue
+    with open(input_metadata, 'r') as f:
+        data_list = json.load(f)
+    output_jsonl = shard_output_path(output_json, shard, num_shards)
 
-        result = generate_caption_with_retry(vis_path, item['category'])
+    if REGENERATE:
+        # 保留旧结果备查；之后所有条目重新组装，模型输出从缓存读取
+        for path in (output_jsonl, ids_path(output_jsonl)):
+            if os.path.exists(path): os.replace(path, path + ".bak")
+    elif num_shards <= 1:
+        migrate_legacy_output(output_json, output_jsonl)
+    processed_ids = scan_ids(output_jsonl)
 
+    if num_shards > 1: data_list = [item for item in data_list if shard_of(item['id'], num_shards) == shard]
+    todos = [item for item in data_list if item['id'] not in processed_ids]
+    if limit: todos = todos[:limit]
+
+    # 客户端自身不重试，由 generate_caption_with_retry 统一退避
+    client = AsyncOpenAI(api_key=API_KEY, base_url=BASE_URL, timeout=REQUEST_TIMEOUT, max_retries=0)
+    limiter = TokenBucket(REQUESTS_PER_SECOND, BURST)
+    writer = JsonlWriter(output_jsonl)
+    prep_pool = ThreadPoolExecutor(max_workers=PREP_WORKERS, thread_name_prefix="payload-prep")
+    # 预处理线程池领先请求 worker 运行，worker 取到的图像已经缩放、编码好
+    prepared = asyncio.Queue(maxsize=CONCURRENCY)
+    progress = tqdm(total=len(todos))
+    stats = {'cache_hits': 0, 'requests': 0, 'batched': 0, 'fallback': 0}
+
+    async def producer():
+        loop = asyncio.get_running_loop()
+        pending = deque()
+        existing = []
+        for item in todos:
+            if os.path.exists(item['visual_prompt_path']):
+                existing.append(item)
+            else:
+                progress.update(1)
+        batches = group_batches(existing) if BATCH_MODE else ([item] for item in existing)
+        for items in batches:
+            if len(items) > 1:
+                job = ('batch', items, loop.run_in_executor(prep_pool, prepare_batch_job, items))
+            else:
+                job = ('single', items[0], loop.run_in_executor(prep_pool, prepare_job, items[0]))
+            pending.append(job)
+            if len(pending) >= PREP_AHEAD:
+                kind, target, future = pending.popleft()
+                await prepared.put((kind, target, await future))
+        while pending:
+            kind, target, future = pending.popleft()
+            await prepared.put((kind, target, await future))
+        for _ in range(CONCURRENCY):
+            await prepared.put(None)
+
+    async def emit(item, result):
+        # 按完成顺序追加，fsync 放到线程里，不阻塞其他请求
+        await asyncio.to_thread(writer.append, build_lisa_entry(item, result))
+        progress.update(1)
+
+    async def process_single(item, prep):
+        payload, file_hash, result = prep
+        if result is not None:
+            stats['cache_hits'] += 1
+        elif payload is None:
+            print(f"图像无法解码，跳过: {item['visual_prompt_path']}")
+        else:
+            stats['requests'] += 1
+            result = await generate_caption_with_retry(client, limiter, payload, item['category'])
+            if result: await asyncio.to_thread(store_response, file_hash, item['category'], result)
         if result:
-            # 1. 随机选择一种描述风格 (简单/空间/复杂)
-            style = random.choice(["simple_instruction", "spatial_instruction", "complex_instruction"])
-            noun_phrase = result.get(style, f"The {item['category']}")
-
-            # 2. 处理首字母大小写，使其能融入句子
-            # 如果名词短语是 "The red car"，变成 "the red car" 以便放入 "Please segment..."
-            # 但如果模板就是 "{}" (只有短语)，则保持 "The red car"
-
-            # 随机选一个人类提问模板
-            human_tmpl = random.choice(HUMAN_QUESTION_TEMPLATES)
-
-            # 简单的逻辑：如果模板开头不是 "{", 说明有前缀词，需要把名词首字母小写
-            if not human_tmpl.startswith("{"):
-                # 把 "The" 变成 "the"
-                if noun_phrase.startswith("The "):
-                    noun_phrase_formatted = "the " + noun_phrase[4:]
-                else:
-                    noun_phrase_formatted = noun_phrase.lower()  # 兜底
+            await emit(item, result)
+        else:
+            progress.update(1)
+
+    async def process_batch(items, prep):
+        payload, hashes, cached, todo = prep
+        for item in items:
+            if item['id'] in cached:
+                stats['cache_hits'] += 1
+                await emit(item, cached[item['id']])
+        results = {}
+        if payload is not None:
+            stats['requests'] += 1
+            results = await generate_batch_with_retry(client, limiter, payload, todo)
+        for item in todo:
+            result = results.get(item['id'])
+            if result is None:
+                # 批量输出中缺失或无法解析的对象，逐条重新请求
+                stats['fallback'] += 1
+                await process_single(item, await asyncio.to_thread(prepare_job, item))
+                continue
+            stats['batched'] += 1
+            await asyncio.to_thread(store_response, hashes[item['id']], item['category'], result, True)
+            await emit(item, result)
+
+    async def worker():
+        while (job := await prepared.get()) is not None:
+            kind, target, prep = job
+            if kind == 'batch':
+                await process_batch(target, prep)
             else:
-                # 如果模板只是 "{}"，保持首字母大写
-                noun_phrase_formatted = noun_phrase
-
-            # 组装 Question
-            # 移除可能重复的句号
-            final_question = human_tmpl.format(noun_phrase_formatted)
-            if final_question.endswith(".."): final_question = final_question[:-1]
-
-            # 3. 随机选一个 GPT 回答模板 (不再包含 Reasoning)
-            gpt_response = random.choice(GPT_ANSWER_TEMPLATES)
-
-            lisa_entry = {
-                "id": item['id'],
-                "image_path_4c": item['image_path_4c'],
-                "image_path_rgb": item['visual_prompt_path'],
-                "mask_path": item['training_mask_path'],
-                "bbox": item['bbox'],
-                "conversations": [
-                    {
-                        "from": "human",
-                        "value": f"<image>\n{final_question}"
-                    },
-                    {
-                        "from": "gpt",
-                        "value": gpt_response
-                    }
-                ],
-                # 依然保存原始 Reasoning 供以后分析，但不在 conversations 里展示
-                "raw_vlm_output": result
-            }
-            existing_data.append(lisa_entry)
+                await process_single(target, prep)
+
+    try:
+        await asyncio.gather(producer(), *(worker() for _ in range(CONCURRENCY)))
+    finally:
+        progress.close()
+        prep_pool.shutdown(wait=True, cancel_futures=True)
+        writer.close()
+        await client.close()
+
+    if num_shards > 1:
+        print(f"\n🎉 分片 {shard}/{num_shards} 完成！结果已追加到: {output_jsonl}")
+    else:
+        count = jsonl_to_json(output_jsonl, output_json)
+        print(f"\n🎉 完成！共 {count} 条，生成数据已保存: {output_json}")
+    print(f"本次请求 {stats['requests']} 次，命中响应缓存 {stats['cache_hits']} 条，"
+          f"批量生成 {stats['batched']} 条，逐条回退 {stats['fallback']} 条")
+
+
+def merge(input_metadata, output_json, jsonl_paths, num_shards=None, report_path=None):
+    """合并分片输出并按 id 去重，统计相对 step1_metadata 的覆盖率"""
+    written, duplicates = merge_jsonl(jsonl_paths, output_json)
+    expected = []
+    if os.path.exists(input_metadata):
+        with open(input_metadata, 'r') as f:
+            expected = [item['id'] for item in json.load(f)]
+    expected_set = set(expected)
+    missing = [i for i in expected if i not in written]
+    report = {
+        'output': output_json,
+        'inputs': jsonl_paths,
+        'expected': len(expected_set),
+        'written': len(written),
+        'covered': len(written & expected_set),
+        'coverage': round(len(written & expected_set) / len(expected_set), 4) if expected_set else None,
+        'duplicates': duplicates,
+        'unknown_ids': len(written - expected_set) if expected_set else 0,
+        'missing_ids': missing,
+    }
+    if num_shards and num_shards > 1:
+        per_shard = {s: 0 for s in range(num_shards)}
+        for item_id in missing:
+            per_shard[shard_of(item_id, num_shards)] += 1
+        report['missing_per_shard'] = per_shard
+
+    print(f"已合并 {len(jsonl_paths)} 个文件 -> {output_json}")
+    print(f"写出 {len(written)} 条, 重复 {duplicates} 条", end="")
+    if expected_set:
+        print(f", 覆盖 {report['covered']}/{len(expected_set)} ({report['coverage']:.1%}), 缺失 {len(missing)} 条")
+    else:
+        print()
+    if 'missing_per_shard' in report:
+        lagging = {s: n for s, n in report['missing_per_shard'].items() if n}
+        if lagging: print(f"未完成的分片 (分片: 缺失条数): {lagging}")
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+    return report
 
-            if (i + 1) % 5 == 0:
-                with open(OUTPUT_JSON, 'w', encoding='utf-8') as f:
-                    json.dump(existing_data, f, indent=4, ensure_ascii=False)
 
-    with open(OUTPUT_JSON, 'w', encoding='utf-8') as f:
-        json.dump(existing_data, f, indent=4, ensure_ascii=False)
-
-    print(f"\n🎉 完成！生成数据已保存: {OUTPUT_JSON}")
+def main():
+    global BATCH_MODE, REGENERATE, CONCURRENCY, REQUESTS_PER_SECOND
+    parser = argparse.ArgumentParser(description="调用 VLM 为 step1 元数据生成 LISA 指代分割对话")
+    parser.add_argument("--data-root", default=None, help="数据目录，默认输入/输出路径都在其下")
+    parser.add_argument("--input", default=None, help="step1_metadata.json 路径")
+    parser.add_argument("--output", default=None, help="LISA JSON 输出路径")
+    sub = parser.add_subparsers(dest="command")
+
+    p_run = sub.add_parser("run", help="生成 (默认)")
+    p_run.add_argument("--shard", type=int, default=0, help="本进程处理的分片序号")
+    p_run.add_argument("--num-shards", type=int, default=1, help="分片总数，按 id 哈希划分")
+    p_run.add_argument("--limit", type=int, default=TEST_COUNT if TEST_MODE else 0, help="最多处理条数，0 为不限")
+    p_run.add_argument("--batch", action="store_true", default=BATCH_MODE, help="同一源图的对象合并请求")
+    p_run.add_argument("--regenerate", action="store_true", default=REGENERATE, help="备份已有输出后全部重新组装")
+    p_run.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    p_run.add_argument("--rps", type=float, default=REQUESTS_PER_SECOND, help="每秒请求数上限")
+
+    p_merge = sub.add_parser("merge", help="合并分片输出并报告覆盖率")
+    p_merge.add_argument("jsonl", nargs="*", help="要合并的 JSONL，默认按输出路径查找全部分片")
+    p_merge.add_argument("--num-shards", type=int, default=None, help="只合并该分片数的输出，并按分片统计缺失")
+    p_merge.add_argument("--report", default=None, help="覆盖率报告输出路径 (JSON)")
+    args = parser.parse_args()
+
+    data_root = args.data_root or DATA_ROOT
+    input_metadata = args.input or (os.path.join(data_root, "step1_metadata.json") if args.data_root else INPUT_METADATA)
+    output_json = args.output or (os.path.join(data_root, os.path.basename(OUTPUT_JSON)) if args.data_root else OUTPUT_JSON)
+
+    if args.command == "merge":
+        paths = args.jsonl
+        if not paths:
+            base = os.path.splitext(output_json)[0]
+            pattern = f"{base}.shard*-of-{args.num_shards:03d}.jsonl" if args.num_shards else f"{base}.shard*.jsonl"
+            paths = sorted(glob.glob(pattern))
+        if not paths:
+            print("没有找到分片输出")
+            return 1
+        merge(input_metadata, output_json, paths, args.num_shards, args.report)
+        return 0
+
+    if args.command == "run":
+        if not 0 <= args.shard < args.num_shards: parser.error("--shard 必须在 [0, --num-shards) 范围内")
+        BATCH_MODE, REGENERATE = args.batch, args.regenerate
+        CONCURRENCY, REQUESTS_PER_SECOND = args.concurrency, args.rps
+        asyncio.run(run(input_metadata, output_json, args.shard, args.num_shards, args.limit))
+    else:
+        asyncio.run(run(input_metadata, output_json))
+    return 0
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    raise SystemExit(main())
@@ -0,0 +1,253 @@
+# utils/replay_session.py
+# 无界面回放标注会话 (界面中 Ctrl+Shift+R 记录)，在项目根目录运行:
+#   python -m utils.replay_session session.jsonl                          # 按原始节奏回放
+#   python -m utils.replay_session session.jsonl --max-speed --output replay.json
+#   python -m utils.replay_session session.jsonl --dataset /tmp/copy/data.json --no-sam
+# 报告每类动作的延迟，并逐条比对离开条目时的 Mask 校验和，不一致时退出码为 1。
+# 注意：回放会像原会话一样真实保存，请用 --dataset 指向数据集副本。
+import os
+import sys
+import json
+import time
+import argparse
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt6.QtWidgets import QApplication, QMessageBox
+from PyQt6.QtCore import QTimer
+
+from core.session_log import CANVAS_ACTIONS, MASK_EVENT, SessionRecorder, read_session
+from utils.benchmark import SAM_CHECKPOINT, summarize
+
+# 等待条目加载 / SAM 编码的超时 (秒)
+WAIT_TIMEOUT = 120.0
+
+
+class _InstantSAM:
+    """--no-sam 时代替真实引擎：编码立即完成，点击不产生预测 (含点击的会话校验和会不一致)"""
+
+    def __init__(self):
+        self._generation = 0
+
+    def submit_image(self, image_np, callback=None):
+        self._generation += 1
+        generation = self._generation
+        # MainWindow 在 submit_image 返回后才记下 generation，所以回调要推迟到事件循环
+        if callback is not None: QTimer.singleShot(0, lambda: callback(generation))
+        return generation
+
+    def cancel_pending(self):
+        self._generation += 1
+
+    def shutdown(self): pass
+
+    def predict_mask(self, points, labels, mask_input=None): return None
+
+
+class _NoTranslator:
+    """回放不访问翻译服务，保证离线且耗时稳定"""
+
+    def translate(self, text, from_lang='en', to_lang='zh'):
+        return text
+
+
+def _silence_dialogs():
+    """模态对话框在无界面回放中会卡住，改为打印；确认框一律回答 Yes"""
+    def _print(parent, title, text, *args, **kwargs):
+        print(f"[{title}] {text}")
+        return QMessageBox.StandardButton.Ok
+
+    QMessageBox.information = staticmethod(_print)
+    QMessageBox.warning = staticmethod(_print)
+    QMessageBox.critical = staticmethod(_print)
+    QMessageBox.question = staticmethod(lambda *args, **kwargs: QMessageBox.StandardButton.Yes)
+
+
+class Replayer:
+    def __init__(self, app, window, max_speed=False, timeout=WAIT_TIMEOUT):
+        self.app = app
+        self.window = window
+        self.max_speed = max_speed
+        self.timeout = timeout
+        self.latencies = {}  # 动作 -> [秒, ...]
+        self.sam_waits = []
+        self.timeouts = 0
+        # 交互状态存储会恢复上次会话残留的预览，回放必须从干净状态开始
+        window.persist_interactions = False
+        if max_speed:
+            # 防抖是为长按方向键准备的，全速回放时不需要
+            window._switch_timer.setInterval(0)
+
+    def wait_until(self, predicate, timeout=None):
+        deadline = time.perf_counter() + (self.timeout if timeout is None else timeout)
+        while not predicate():
+            if time.perf_counter() > deadline:
+                self.timeouts += 1
+                return False
+            self.app.processEvents()
+            time.sleep(0.001)
+        return True
+
+    def item_ready(self):
+        w = self.window
+        row = w.file_list_widget.currentRow()
+        return row < 0 or w._loaded_index == row
+
+    def open_dataset(self, header, dataset):
+        w = self.window
+        if header['mode'] == "json":
+            w.radio_json.setChecked(True)
+            w.open_json_dataset(dataset)
+        else:
+            w.radio_folder.setChecked(True)
+            w.chk_recursive.setChecked(header.get('recursive', False))
+            done = []
+            w.scan_done_signal.connect(done.append)
+            w.open_folder(dataset)
+            self.wait_until(lambda: done)
+            w.chk_unannotated.setChecked(header.get('unannotated_only', False))
+        w.set_brush_radius(header.get('brush_radius', w.brush_radius))
+        w.chk_auto_clean.setChecked(header.get('auto_clean', True))
+        row = header.get('row', 0)
+        if row >= 0 and row != w.file_list_widget.currentRow(): w.file_list_widget.setCurrentRow(row)
+        self.wait_until(self.item_ready)
+
+    def run(self, events):
+        w = self.window
+        # 回放过程中用内存记录器收集校验和，与原会话比较
+        w.session_recorder = recorder = SessionRecorder()
+        expected = []
+        t_start = time.perf_counter()
+        for event in events:
+            t_ms, action, args = event[0], event[1], event[2:]
+            if action == MASK_EVENT:
+                expected.append(tuple(args))
+                continue
+            if not self.max_speed:
+                target = t_start + t_ms / 1000.0
+                self.wait_until(lambda: time.perf_counter() >= target, timeout=float('inf'))
+            if action in CANVAS_ACTIONS or action in ('merge', 'subtract', 'reset', 'cleanup'):
+                self.wait_until(self.item_ready)
+            if action == 'click':
+                t0 = time.perf_counter()
+                self.wait_until(lambda: w._sam_ready)
+                self.sam_waits.append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            self.dispatch(action, args)
+            self.app.processEvents()  # 让本次动作触发的重绘也计入延迟
+            if not self.item_ready(): self.wait_until(self.item_ready)
+            self.latencies.setdefault(action, []).append(time.perf_counter() - t0)
+        w._stop_recording()
+        wall = time.perf_counter() - t_start
+        return wall, expected, recorder.mask_checksums()
+
+    def dispatch(self, action, args):
+        w = self.window
+        if action == 'select':
+            if args[0] != w.file_list_widget.currentRow(): w.file_list_widget.setCurrentRow(args[0])
+        elif action == 'next':
+            w.navigate_next()
+        elif action == 'prev':
+            w.navigate_prev()
+        elif action == 'save':
+            w.save_current()
+        elif action == 'merge':
+            w.apply_sam_merge()
+        elif action == 'subtract':
+            w.apply_sam_subtract()
+        elif action == 'reset':
+            w.reset_sam_interaction()
+        elif action == 'cleanup':
+            w.cleanup_mask_action()
+        elif action == 'auto_clean':
+            w.chk_auto_clean.setChecked(args[0])
+        elif action == 'brush_radius':
+            w.set_brush_radius(args[0])
+        elif action == 'click':
+            w.canvas.click_signal.emit(*args)
+        elif action == 'brush':
+            w.canvas.brush_signal.emit(*args)
+        elif action == 'rect_erase':
+            w.canvas.rect_erase_signal.emit(*args)
+        elif action == 'polygon':
+            w.canvas.polygon_signal.emit([tuple(p) for p in args[0]])
+        else:
+            print(f"未知动作，跳过: {action}")
+
+
+def compare_checksums(expected, actual):
+    mismatches = []
+    for i in range(max(len(expected), len(actual))):
+        exp = expected[i] if i < len(expected) else None
+        got = actual[i] if i < len(actual) else None
+        if exp != got: mismatches.append({'index': i, 'expected': exp, 'actual': got})
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="无界面回放标注会话并报告延迟与 Mask 校验和")
+    parser.add_argument("session", help="Ctrl+Shift+R 记录的会话文件 (.jsonl)")
+    parser.add_argument("--dataset", help="覆盖会话中记录的数据集路径 (建议指向副本)")
+    parser.add_argument("--max-speed", action="store_true", help="忽略原始时间间隔，只等待加载完成")
+    parser.add_argument("--no-sam", action="store_true", help="不加载 SAM，编码立即完成")
+    parser.add_argument("--sam-checkpoint", default=SAM_CHECKPOINT)
+    parser.add_argument("--translate", action="store_true", help="回放时仍调用翻译服务")
+    parser.add_argument("--timeout", type=float, default=WAIT_TIMEOUT, help="单次等待加载的超时 (秒)")
+    parser.add_argument("--output", help="把报告写入 JSON 文件")
+    args = parser.parse_args()
+
+    header, events = read_session(args.session)
+    dataset = args.dataset or header['dataset']
+    app = QApplication.instance() or QApplication(sys.argv)
+    _silence_dialogs()
+
+    from ui.main_window import MainWindow
+    if args.no_sam:
+        sam = _InstantSAM()
+    else:
+        from core.sam_engine import SAMEngine
+        sam = SAMEngine(checkpoint_path=args.sam_checkpoint)
+    window = MainWindow(sam_engine=sam)
+    window.resize(1400, 900)
+    window.show()
+    if not args.translate: window.translator = _NoTranslator()
+
+    replayer = Replayer(app, window, max_speed=args.max_speed, timeout=args.timeout)
+    replayer.open_dataset(header, dataset)
+    wall, expected, actual = replayer.run(events)
+    window.close()
+
+    mismatches = compare_checksums(expected, actual)
+    report = {
+        'session': os.path.abspath(args.session),
+        'dataset': dataset,
+        'mode': header['mode'],
+        'max_speed': args.max_speed,
+        'sam': not args.no_sam,
+        'events': len(events),
+        'wall_s': round(wall, 3),
+        'timeouts': replayer.timeouts,
+        'actions': {a: summarize(t) for a, t in sorted(replayer.latencies.items())},
+        'sam_wait': summarize(replayer.sam_waits) if replayer.sam_waits else None,
+        'checksums': {'expected': len(expected), 'actual': len(actual), 'mismatches': mismatches},
+    }
+
+    print(f"{'动作':<14}{'次数':>8}{'中位数 ms':>12}{'p95 ms':>12}{'最大 ms':>12}")
+    for action, times in sorted(replayer.latencies.items()):
+        s = report['actions'][action]
+        print(f"{action:<14}{s['repeat']:>8}{s['median_ms']:>12.2f}{s['p95_ms']:>12.2f}{max(times) * 1000.0:>12.2f}")
+    print(f"总耗时 {wall:.2f}s，等待超时 {replayer.timeouts} 次")
+    matched = sum(1 for exp, got in zip(expected, actual) if exp == got)
+    print(f"Mask 校验和: {matched}/{len(expected)} 一致")
+    for m in mismatches:
+        print(f"  #{m['index']}: 期望 {m['expected']}，实际 {m['actual']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"报告已写入 {args.output}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
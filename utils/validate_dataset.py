@@ -0,0 +1,231 @@
+# utils/validate_dataset.py
+# 数据集完整性检查，在项目根目录运行:
+#   python -m utils.validate_dataset dataset.json --report report.json
+#   python -m utils.validate_dataset /path/to/image_folder --recursive
+# 每个文件的检查结果按 (mtime, size) 缓存，小改动后重新检查只需解码变化过的文件。
+import os
+import json
+import hashlib
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from core.json_dataset import LazyJsonDataset
+from core.label_map import LABEL_MAP_KEY, LABEL_ID_KEY, read_label_map, entry_mask_path
+from core.data_manager import DataManager
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "lisa_label", "validate")
+CACHE_VERSION = 1
+
+
+# ==========================
+# 单文件检查 (在子进程中执行)
+# ==========================
+def check_file(kind, path):
+    """返回可缓存的检查结果 dict：ok、shape，以及 mask 是否二值 / 标签图中出现的标签"""
+    if kind == 'image':
+        img = cv2.imread(path)
+        if img is None: return {'ok': False, 'error': "图像无法解码"}
+        return {'ok': True, 'shape': list(img.shape[:2])}
+    if kind == 'mask':
+        mask = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if mask is None: return {'ok': False, 'error': "Mask 无法解码"}
+        values = np.unique(mask)
+        binary = bool(np.isin(values, (0, 1)).all() or np.isin(values, (0, 255)).all())
+        return {'ok': True, 'shape': list(mask.shape[:2]), 'binary': binary, 'empty': bool(values.max() == 0)}
+    if kind == 'labels':
+        labels = read_label_map(path)
+        if labels is None: return {'ok': False, 'error': "标签图无法解码"}
+        return {'ok': True, 'shape': list(labels.shape[:2]), 'labels': [int(v) for v in np.unique(labels) if v]}
+    raise ValueError(kind)
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+        return [st.st_mtime_ns, st.st_size]
+    except (OSError, TypeError):
+        return None
+
+
+class FileChecker:
+    """按 (kind, path) 去重、查缓存，只把变化过的文件交给进程池"""
+
+    def __init__(self, cache_path, workers=None):
+        self.cache_path = cache_path
+        self.workers = workers
+        self.cache = {}
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == CACHE_VERSION: self.cache = data.get('files', {})
+        except (OSError, ValueError):
+            pass
+        self.results = {}
+        self.decoded = 0
+        self.missing = 0
+
+    def run(self, requests):
+        """requests: 可迭代的 (kind, path)；返回 {(kind, path): 结果}，文件不存在时结果为 None"""
+        todo = []
+        for kind, path in set(requests):
+            sig = _stat(path)
+            if sig is None:
+                self.results[(kind, path)] = None
+                self.missing += 1
+                continue
+            cached = self.cache.get(f"{kind}:{path}")
+            if cached and cached['sig'] == sig:
+                self.results[(kind, path)] = cached['result']
+            else:
+                todo.append((kind, path, sig))
+        if todo:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                results = pool.map(check_file, [t[0] for t in todo], [t[1] for t in todo], chunksize=16)
+                for (kind, path, sig), result in zip(todo, results):
+                    self.results[(kind, path)] = result
+                    self.cache[f"{kind}:{path}"] = {'sig': sig, 'result': result}
+            self.decoded = len(todo)
+        self._save()
+        return self.results
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': CACHE_VERSION, 'files': self.cache}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.cache_path)
+
+
+# ==========================
+# 条目级检查
+# ==========================
+def _bbox_problem(bbox, shape):
+    """bbox 兼容 [x, y, w, h] 与 [x1, y1, x2, y2]，两种解释都越界才报错"""
+    if not isinstance(bbox, (list, tuple)) or len(bbox) != 4 or not all(isinstance(v, (int, float)) for v in bbox):
+        return f"bbox 格式错误: {bbox}"
+    if shape is None: return None
+    h, w = shape
+    x, y, a, b = bbox
+    if x < 0 or y < 0 or a <= 0 or b <= 0: return f"bbox 越界: {bbox}"
+    fits_xywh = x + a <= w and y + b <= h
+    fits_xyxy = a > x and b > y and a <= w and b <= h
+    return None if fits_xywh or fits_xyxy else f"bbox 越界: {bbox} (图像 {w}x{h})"
+
+
+def _check_mask(problems, result, img_shape, what="Mask"):
+    if result is None:
+        problems.append(f"{what}不存在")
+    elif not result['ok']:
+        problems.append(result['error'])
+    else:
+        if 'binary' in result and not result['binary']: problems.append(f"{what}不是二值图")
+        if img_shape is not None and result['shape'] != img_shape:
+            problems.append(f"{what}尺寸 {result['shape']} 与图像 {img_shape} 不一致")
+
+
+def validate_json(json_path, checker):
+    dataset = LazyJsonDataset(json_path)
+    entries = [dataset.get_uncached(i) for i in range(len(dataset))]
+    requests = []
+    for e in entries:
+        requests.append(('image', e.get('image_path_rgb')))
+        if e.get(LABEL_MAP_KEY):
+            requests.append(('labels', e[LABEL_MAP_KEY]))
+        elif entry_mask_path(e):
+            requests.append(('mask', entry_mask_path(e)))
+    results = checker.run(requests)
+
+    id_counts = Counter(str(e.get('id')) for e in entries)
+    report = []
+    for e in entries:
+        problems = []
+        item_id = str(e.get('id'))
+        if 'id' not in e: problems.append("缺少 id")
+        elif id_counts[item_id] > 1: problems.append(f"id 重复 {id_counts[item_id]} 次")
+        img = results.get(('image', e.get('image_path_rgb')))
+        img_shape = None
+        if img is None:
+            problems.append(f"图像不存在: {e.get('image_path_rgb')}")
+        elif not img['ok']:
+            problems.append(img['error'])
+        else:
+            img_shape = img['shape']
+        if e.get(LABEL_MAP_KEY):
+            labels = results.get(('labels', e[LABEL_MAP_KEY]))
+            _check_mask(problems, labels, img_shape, "标签图")
+            if labels and labels['ok'] and e.get(LABEL_ID_KEY) not in labels['labels']:
+                problems.append(f"标签图中没有标签 {e.get(LABEL_ID_KEY)}")
+        elif entry_mask_path(e):
+            _check_mask(problems, results.get(('mask', entry_mask_path(e))), img_shape)
+        else:
+            problems.append("缺少 mask_path")
+        if 'bbox' in e:
+            p = _bbox_problem(e['bbox'], img_shape)
+            if p: problems.append(p)
+        if not e.get('conversations'): problems.append("没有对话数据")
+        if problems: report.append({'id': item_id, 'image': e.get('image_path_rgb'), 'problems': problems})
+    return len(entries), report
+
+
+def validate_folder(folder, checker, recursive=False):
+    dm = DataManager()
+    files = dm.load_directory(folder, recursive=recursive)
+    requests = []
+    for rel in files:
+        img_path = os.path.join(folder, rel)
+        requests.append(('image', img_path))
+        legacy = dm.get_legacy_mask_path(img_path)
+        if os.path.exists(legacy): requests.append(('mask', legacy))
+    results = checker.run(requests)
+
+    report = []
+    for rel in files:
+        problems = []
+        img_path = os.path.join(folder, rel)
+        img = results.get(('image', img_path))
+        img_shape = img['shape'] if img and img['ok'] else None
+        if img and not img['ok']: problems.append(img['error'])
+        legacy = dm.get_legacy_mask_path(img_path)
+        if ('mask', legacy) in results: _check_mask(problems, results[('mask', legacy)], img_shape)
+        if rel in dm.mask_store:
+            shard_id, offset, length, h, w, text = dm.mask_store.index[rel]
+            if img_shape is not None and [h, w] != img_shape:
+                problems.append(f"分片存储中的 Mask 尺寸 {[h, w]} 与图像 {img_shape} 不一致")
+        if problems: report.append({'id': rel, 'image': img_path, 'problems': problems})
+    return len(files), report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查 JSON 数据集或图片文件夹的完整性")
+    parser.add_argument("input", help="LISA JSON 文件或图片文件夹")
+    parser.add_argument("--report", default=None, help="机器可读报告输出路径 (JSON)")
+    parser.add_argument("--recursive", action="store_true", help="文件夹模式下包含子目录")
+    parser.add_argument("--workers", type=int, default=None, help="解码进程数，默认 CPU 核数")
+    args = parser.parse_args()
+
+    cache_key = hashlib.sha1(os.path.abspath(args.input).encode('utf-8')).hexdigest()
+    checker = FileChecker(os.path.join(CACHE_DIR, cache_key + ".json"), workers=args.workers)
+    if os.path.isdir(args.input):
+        total, report = validate_folder(args.input, checker, recursive=args.recursive)
+    else:
+        total, report = validate_json(args.input, checker)
+
+    summary = {'input': os.path.abspath(args.input), 'total': total, 'invalid': len(report),
+               'decoded_files': checker.decoded, 'cached_files': len(checker.results) - checker.decoded - checker.missing,
+               'missing_files': checker.missing}
+    print(f"共 {total} 条, 有问题 {len(report)} 条 (本次解码 {summary['decoded_files']} 个文件, "
+          f"命中缓存 {summary['cached_files']} 个)")
+    for r in report[:20]:
+        print(f"  {r['id']}: {'; '.join(r['problems'])}")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({'summary': summary, 'errors': report}, f, ensure_ascii=False, indent=4)
+    return 1 if report else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())